@@ -0,0 +1,164 @@
+from variable_template import template_variables
+
+
+class ActionNode:
+    '''
+    One top level action of an installer script, together with its
+    success_actions and error_actions, which always run with it.
+    - index: position in the script
+    - action: the action dict
+    - provides: variables and ids this node sets
+    - reads: variables and ids this node needs
+    - depends: indexes of the nodes that must finish first
+    - dialog_depends: indexes of the nodes that must finish before this one
+      shows a dialog, it may start and do its automatic steps before
+    - dependents: indexes of the nodes waiting for this one
+    '''
+    def __init__(self, index, action):
+        self.index = index
+        self.action = action
+        self.provides = set()
+        self.reads = set()
+        self.depends = set()
+        self.dialog_depends = set()
+        self.dependents = []
+
+
+class ActionGraph:
+    '''
+    Compiles a list of installer actions into a dependency graph, so that
+    independent actions can run at the same time.
+
+    Dependencies come from explicit keys and from the variables each action
+    uses:
+      - action: find_folder
+        id: find_game
+        provides: [ GAME_PATH ]
+        depends_on: [ some_other_id, SOME_VARIABLE ]
+    An action provides its id, its provides list, the variable of
+    find_folder's save_path_to_variable and of set_variable/append_variable.
+    It reads its depends_on list and every <NAME> placeholder in its values.
+    A reader waits for the last earlier action providing the name, and an
+    action providing a name waits for the earlier providers and readers of
+    it, so results are the same as running in order. ask_continue/abort
+    wait for everything before them and hold back everything after them.
+    Actions that change files or that the user sees (messages, dialogs) run
+    in script order, after every earlier action that could ask the user or
+    abort, also from its error_actions. find_folder with an ask method starts
+    at once, so its registry and path lookups run in parallel; only its
+    folder dialog is ordered like that, through dialog_depends.
+
+    Edges only point to earlier actions, so the graph has no cycles.
+    '''
+    barrier_actions = {"ask_continue", "abort"}
+    file_actions = {"delete_folder", "mod_install"}
+    dialog_actions = {"message", "ask_continue"}
+
+    def __init__(self, actions):
+        self.nodes = [ActionNode(index, action) for index, action in enumerate(actions)]
+
+        last_provider = {}  # name -> index of the last node providing it
+        readers = {}  # name -> indexes of the nodes reading it since its last provider
+        last_barrier = None
+        last_ordered = None  # last node that changes files or that the user sees
+        asking = []  # nodes that may ask for a folder since last_ordered
+        gates = []  # nodes that may ask the user or abort, directly or on error
+        for node in self.nodes:
+            for action in self._walk(node.action):
+                node.provides |= self._provides(action)
+                node.reads |= self._reads(action)
+
+            for name in node.reads:
+                if name in last_provider:
+                    node.depends.add(last_provider[name])
+            for name in node.provides:
+                if name in last_provider:
+                    node.depends.add(last_provider[name])
+                node.depends.update(readers.get(name, []))
+
+            types = set(action.get("action") for action in self._walk(node.action))
+            is_barrier = node.action.get("action") in self.barrier_actions
+            if is_barrier:
+                node.depends.update(range(node.index))
+            elif last_barrier is not None:
+                node.depends.add(last_barrier)
+            if types & self.file_actions or types & self.dialog_actions:
+                # Never change files or show something before an earlier action that may still abort
+                node.depends.update(gates)
+                node.depends.update(asking)
+                if last_ordered is not None:
+                    node.depends.add(last_ordered)
+                last_ordered = node.index
+                asking = []
+            elif any(self._asks_folder(action) for action in self._walk(node.action)):
+                # Only the folder dialog waits, see SimpleInstaller._ui
+                node.dialog_depends.update(gates)
+                node.dialog_depends.update(asking)
+                if last_ordered is not None:
+                    node.dialog_depends.add(last_ordered)
+                asking.append(node.index)
+
+            for name in node.reads:
+                readers.setdefault(name, []).append(node.index)
+            for name in node.provides:
+                last_provider[name] = node.index
+                readers[name] = []
+            if is_barrier:
+                last_barrier = node.index
+            if types & self.barrier_actions:
+                gates.append(node.index)
+
+            node.depends.discard(node.index)
+            node.dialog_depends.discard(node.index)
+            node.dialog_depends -= node.depends
+            for index in node.depends:
+                self.nodes[index].dependents.append(node.index)
+
+    @staticmethod
+    def _walk(action):
+        # The action and all of its success_actions and error_actions
+        yield action
+        for key in ["success_actions", "error_actions"]:
+            for sub_action in action.get(key) or []:
+                yield from ActionGraph._walk(sub_action)
+
+    @staticmethod
+    def _asks_folder(action):
+        return action.get("action") == "find_folder" and any("ask" in method for method in action.get("find_methods") or [])
+
+    @staticmethod
+    def _provides(action):
+        names = set(action.get("provides") or [])
+        if "id" in action:
+            names.add(action["id"])
+        if action.get("action") == "find_folder" and "save_path_to_variable" in action:
+            names.add(action["save_path_to_variable"])
+        if action.get("action") in ["set_variable", "append_variable"] and "name" in action:
+            names.add(action["name"])
+        return names
+
+    @staticmethod
+    def _reads(action):
+        names = set(action.get("depends_on") or [])
+
+        def find_placeholders(value):
+            if isinstance(value, str):
+                names.update(template_variables(value))
+            elif isinstance(value, list):
+                for item in value:
+                    find_placeholders(item)
+            elif isinstance(value, dict):
+                for item in value.values():
+                    find_placeholders(item)
+
+        for key, value in action.items():
+            if key not in ["success_actions", "error_actions"]:
+                find_placeholders(value)
+        return names
+
+    def critical_path_length(self):
+        # Number of actions on the longest dependency chain
+        lengths = []
+        for node in self.nodes:
+            lengths.append(1 + max((lengths[index] for index in node.depends), default=0))
+        return max(lengths, default=0)
@@ -0,0 +1,56 @@
+import concurrent.futures
+import queue
+
+
+class BackgroundTasks:
+    '''
+    Runs slow work on a thread pool and hands the results back to the Tk main
+    thread.
+
+    submit(fn, on_done, on_error) runs fn(*args) on a worker thread. Its
+    result, or the exception it raised, is put on a queue that the main loop
+    drains every poll_interval_ms with root.after, calling on_done(result) or
+    on_error(exception) there. Callbacks may use Tk and show dialogs; the
+    background functions must not.
+    '''
+    poll_interval_ms = 50
+
+    def __init__(self, root, max_workers=4):
+        self.root = root
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        self.results = queue.Queue()
+        self.pending = 0  # tasks whose callback has not run yet, only used on the main thread
+        self.polling = False
+
+    def submit(self, fn, on_done, on_error, *args):
+        # Only call from the main thread
+        def run():
+            try:
+                self.results.put((on_done, fn(*args)))
+            except Exception as e:
+                self.results.put((on_error, e))
+
+        self.pending += 1
+        self.executor.submit(run)
+        if not self.polling:
+            self.polling = True
+            self.root.after(self.poll_interval_ms, self._drain)
+
+    def _drain(self):
+        try:
+            while True:
+                try:
+                    callback, value = self.results.get_nowait()
+                except queue.Empty:
+                    break
+                self.pending -= 1
+                callback(value)
+        finally:
+            # Keep polling even if a callback failed
+            if self.pending > 0:
+                self.root.after(self.poll_interval_ms, self._drain)
+            else:
+                self.polling = False
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,106 @@
+import collections
+import os
+import threading
+
+from cache_registry import CacheRegistry
+
+
+class CacheManager:
+    '''
+    Keeps the download cache folder within a byte budget.
+
+    Built on the CacheRegistry of the folder, which records the size and last
+    access time of every stored file, so usage is reported without walking the
+    folder. enforce_budget() deletes the least recently used files until the
+    cache fits in max_bytes. Files needed by the current selection can be
+    pinned by url and are never evicted, and so are the files of downloads in
+    progress, pinned with pin_urls() until unpin_urls(). A max_bytes of None
+    means no limit.
+    '''
+    # Class-wide registry of CacheManager objects, keyed by cache folder
+    managers = {}
+    managers_lock = threading.Lock()
+
+    @classmethod
+    def for_folder(cls, cache_folder, logger=print):
+        key = os.path.abspath(cache_folder)
+        with cls.managers_lock:
+            if key not in cls.managers:
+                cls.managers[key] = CacheManager(cache_folder, logger=logger)
+            return cls.managers[key]
+
+    def __init__(self, cache_folder, max_bytes=None, logger=print):
+        self.cache_folder = cache_folder
+        self.registry = CacheRegistry.for_folder(cache_folder, logger)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.pinned_urls = set()  # urls of the selection
+        self.active_urls = collections.Counter()  # urls of downloads in progress
+
+    def set_max_bytes(self, max_bytes):
+        with self.lock:
+            self.max_bytes = max_bytes
+
+    def set_pinned_urls(self, urls):
+        # Replace the urls of the selection whose files must stay in the
+        # cache, downloads in progress stay pinned
+        with self.lock:
+            self.pinned_urls = set(urls)
+
+    def pin_urls(self, urls):
+        # Pin the urls of a download in progress, until unpin_urls()
+        with self.lock:
+            self.active_urls.update(urls)
+
+    def unpin_urls(self, urls):
+        with self.lock:
+            self.active_urls.subtract(urls)
+            self.active_urls += collections.Counter()  # Drop urls no download pins anymore
+
+    def usage(self):
+        # Returns (number of files, total bytes) of the cache
+        return len(self.registry), self.registry.total_size()
+
+    def _pinned_content_hashes(self):
+        # Called with the lock held
+        pinned = set()
+        for url in self.pinned_urls | set(self.active_urls):
+            entry = self.registry.lookup(url)
+            if entry is not None:
+                pinned.add(entry["content_hash"])
+        return pinned
+
+    def enforce_budget(self, logger=print):
+        # Evict least recently used, unpinned files until the cache fits the
+        # budget. Returns the number of bytes freed.
+        with self.lock:
+            if self.max_bytes is None:
+                return 0
+            total = self.registry.total_size()
+            if total <= self.max_bytes:
+                return 0
+
+            pinned = self._pinned_content_hashes()
+            candidates = [(entry.get("last_access", 0), content_hash, entry)
+                          for content_hash, entry in self.registry.content_items()
+                          if content_hash not in pinned]
+            candidates.sort(key=lambda candidate: candidate[0])
+
+            freed = 0
+            for _, content_hash, entry in candidates:
+                if total - freed <= self.max_bytes:
+                    break
+                path = os.path.join(self.cache_folder, entry["filename"])
+                try:
+                    if os.path.exists(path):
+                        os.remove(path)
+                except OSError as e:
+                    logger(f"WARNING: Could not evict {entry['filename']} from the download cache: {e}")
+                    continue
+                self.registry.remove_content(content_hash)
+                freed += entry["filesize"] or 0
+                logger(f"INFO: Evicted {entry['filename']} from the download cache")
+
+            if total - freed > self.max_bytes:
+                logger(f"WARNING: Download cache is over budget, remaining files are pinned")
+            return freed
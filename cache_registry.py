@@ -0,0 +1,231 @@
+import atexit
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+class CacheRegistry:
+    '''
+    In-memory view of the download cache's "cache_registry.json".
+
+    There is one registry per cache folder per process, see for_folder(). It is
+    read from disk once, lookups and updates happen in memory under a lock, and
+    changes are written back at most once per save_delay seconds by a
+    background timer. Writes go to a temporary file that is renamed over the
+    registry, so a crash never leaves a half written file behind. Pending
+    changes are flushed when the process exits.
+
+    Keys are stable across runs. Urls are looked up by the SHA-256 of the url,
+    and downloaded files are stored by the SHA-256 of their content, so the same
+    archive reached through different mirror urls is only stored once:
+        {"version": 2,
+         "urls": {<sha256 of url>: {"url": <url>, "name": <mod name>, "content_hash": <sha256>}},
+         "files": {<sha256 of content>: {"filename": <file in cache folder>, "filesize": <bytes>,
+                                         "last_access": <unix time>}}}
+
+    Files from the original url keyed registry are migrated without reading
+    them: they are stored under a "legacy:<url key>" content hash, and only
+    hashed when their url is first looked up.
+    Warnings go to logger, the one of the first for_folder() call.
+    '''
+    registry_filename = "cache_registry.json"
+    save_delay = 1.0
+
+    # Class-wide registry of CacheRegistry objects, keyed by cache folder
+    registries = {}
+    registries_lock = threading.Lock()
+
+    legacy_prefix = "legacy:"
+
+    @classmethod
+    def for_folder(cls, cache_folder, logger=print):
+        # Shared registry for this cache folder, loaded on first use
+        key = os.path.abspath(cache_folder)
+        with cls.registries_lock:
+            if key not in cls.registries:
+                cls.registries[key] = CacheRegistry(cache_folder, logger)
+            return cls.registries[key]
+
+    @staticmethod
+    def url_key(url):
+        return hashlib.sha256(url.encode("utf8")).hexdigest()
+
+    @staticmethod
+    def hash_file(path):
+        # Streaming SHA-256 of a file's content
+        hasher = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                hasher.update(chunk)
+        return hasher.hexdigest()
+
+    def __init__(self, cache_folder, logger=print):
+        self.cache_folder = cache_folder
+        self.logger = logger
+        self.path = os.path.join(cache_folder, self.registry_filename)
+        self.lock = threading.RLock()
+        self.urls = {}
+        self.files = {}
+        self.dirty = False
+        self.save_timer = None
+
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r", encoding="utf8") as f:
+                    data = json.load(f)
+                if data.get("version") == 2:
+                    self.urls = data["urls"]
+                    self.files = data["files"]
+                else:
+                    self._migrate_url_keyed_registry(data)
+            except Exception as e:
+                # Start with an empty registry rather than failing every download
+                self.logger(f"WARNING: Ignoring unreadable cache registry {self.path}: {e}")
+                self.urls = {}
+                self.files = {}
+
+        atexit.register(self.flush)
+
+    def _migrate_url_keyed_registry(self, data):
+        # Convert the original {url: {"name", "filename", "filesize"}} registry
+        # for the files that are still in the cache folder. Their content is
+        # hashed later, by _hash_legacy_entry()
+        for url, entry in data.items():
+            path = os.path.join(self.cache_folder, entry["filename"])
+            if not os.path.exists(path):
+                continue
+            url_key = self.url_key(url)
+            content_hash = self.legacy_prefix + url_key
+            self.urls[url_key] = {"url": url, "name": entry["name"], "content_hash": content_hash}
+            self.files[content_hash] = {"filename": entry["filename"], "filesize": entry["filesize"],
+                                        "last_access": os.path.getatime(path)}
+        self.dirty = True
+
+    def _hash_legacy_entry(self, url_key, legacy_hash):
+        # Hash a migrated file outside the lock and store it under its content hash.
+        # If the same content is already stored, the url points there and the
+        # migrated copy is left to be evicted.
+        with self.lock:
+            entry = self.files.get(legacy_hash)
+            if entry is None:
+                return
+            path = os.path.join(self.cache_folder, entry["filename"])
+        try:
+            content_hash = self.hash_file(path)
+        except OSError as e:
+            self.logger(f"WARNING: Could not hash cached file {path}: {e}")
+            return
+        with self.lock:
+            url_entry = self.urls.get(url_key)
+            if url_entry is None or url_entry["content_hash"] != legacy_hash or legacy_hash not in self.files:
+                return
+            if content_hash not in self.files:
+                self.files[content_hash] = self.files.pop(legacy_hash)
+            url_entry["content_hash"] = content_hash
+            self._schedule_save()
+
+    def lookup(self, url):
+        # Returns the entry registered for this url merged with its file entry, or None
+        url_key = self.url_key(url)
+        with self.lock:
+            url_entry = self.urls.get(url_key)
+            legacy_hash = url_entry["content_hash"] if url_entry is not None else None
+        if legacy_hash is not None and legacy_hash.startswith(self.legacy_prefix):
+            self._hash_legacy_entry(url_key, legacy_hash)
+        with self.lock:
+            url_entry = self.urls.get(url_key)
+            if url_entry is None or url_entry["content_hash"] not in self.files:
+                return None
+            entry = dict(url_entry)
+            entry.update(self.files[url_entry["content_hash"]])
+            return entry
+
+    def lookup_content(self, content_hash):
+        # Returns the file entry stored for this content hash, or None
+        with self.lock:
+            entry = self.files.get(content_hash)
+            return dict(entry) if entry is not None else None
+
+    def register(self, url, name, content_hash, filename, filesize):
+        # Point url at a downloaded file. If the content is already registered
+        # the existing file entry is kept.
+        with self.lock:
+            self.urls[self.url_key(url)] = {"url": url, "name": name, "content_hash": content_hash}
+            if content_hash not in self.files:
+                self.files[content_hash] = {"filename": filename, "filesize": filesize}
+            self.files[content_hash]["last_access"] = time.time()
+            self._schedule_save()
+
+    def touch(self, content_hash):
+        # Record that a stored file was used, for least recently used eviction
+        with self.lock:
+            if content_hash in self.files:
+                self.files[content_hash]["last_access"] = time.time()
+                self._schedule_save()
+
+    def total_size(self):
+        # Bytes used by all stored files, from the registry rather than the disk
+        with self.lock:
+            return sum(entry["filesize"] or 0 for entry in self.files.values())
+
+    def content_items(self):
+        # Snapshot of all (content hash, file entry) pairs
+        with self.lock:
+            return [(content_hash, dict(entry)) for content_hash, entry in self.files.items()]
+
+    def remove(self, url):
+        # Forget a url. Its file entry is removed too if no other url uses it.
+        with self.lock:
+            url_entry = self.urls.pop(self.url_key(url), None)
+            if url_entry is None:
+                return
+            content_hash = url_entry["content_hash"]
+            if not any(other["content_hash"] == content_hash for other in self.urls.values()):
+                self.files.pop(content_hash, None)
+            self._schedule_save()
+
+    def remove_content(self, content_hash):
+        # Forget a stored file and every url pointing at it
+        with self.lock:
+            self.files.pop(content_hash, None)
+            for key in [key for key, url_entry in self.urls.items() if url_entry["content_hash"] == content_hash]:
+                del self.urls[key]
+            self._schedule_save()
+
+    def items(self):
+        # Snapshot of all (url, entry) pairs
+        with self.lock:
+            return [(url_entry["url"], self.lookup(url_entry["url"])) for url_entry in self.urls.values()
+                    if url_entry["content_hash"] in self.files]
+
+    def __len__(self):
+        with self.lock:
+            return len(self.files)
+
+    def _schedule_save(self):
+        # Called with the lock held. Batches changes made within save_delay into one write.
+        self.dirty = True
+        if self.save_timer is None:
+            self.save_timer = threading.Timer(self.save_delay, self.flush)
+            self.save_timer.daemon = True
+            self.save_timer.start()
+
+    def flush(self):
+        # Write pending changes to disk now
+        with self.lock:
+            if self.save_timer is not None:
+                self.save_timer.cancel()
+                self.save_timer = None
+            if not self.dirty:
+                return
+            data = json.dumps({"version": 2, "urls": self.urls, "files": self.files}, indent=4)
+            self.dirty = False
+
+            temp_path = self.path + ".tmp"
+            with open(temp_path, "w", encoding="utf8") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.path)
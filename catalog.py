@@ -0,0 +1,232 @@
+import collections
+import concurrent.futures
+import glob
+import os
+import pickle
+import sys
+import threading
+from urllib.parse import urlparse
+
+import yaml
+
+# Use the libyaml C loader when PyYAML was built with it
+YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+class ModRecord:
+    '''
+    Compact catalog entry for a mod: just what is needed to list, search,
+    index, link and pin it. installs are its install entries, for the
+    compatibility index, and urls the download urls of all of them. Names,
+    tags, hosts and game versions are interned so repeated values share
+    memory. The full config is loaded from the template file when the mod's
+    description or load order is needed, see CatalogCompiler.load_config().
+    '''
+    __slots__ = ["name", "tags", "only_one_with_tag", "hosts", "official_website", "installs", "urls",
+                 "filename", "index"]
+
+    def __init__(self, name, tags, only_one_with_tag, hosts, official_website, installs, urls, filename, index):
+        self.name = name
+        self.tags = tags
+        self.only_one_with_tag = only_one_with_tag
+        self.hosts = hosts
+        self.official_website = official_website
+        self.installs = installs
+        self.urls = urls
+        self.filename = filename
+        self.index = index
+
+    @staticmethod
+    def from_config(config, filename, index):
+        tags = config.get("tag") or []
+        if not isinstance(tags, list):
+            tags = [tags]
+        only_one_with_tag = config.get("only_one_with_tag")
+        installs = []
+        download_urls = []
+        for install in config["install"]:
+            install = dict(install)
+            if isinstance(install.get("game_version"), str):
+                install["game_version"] = sys.intern(install["game_version"])
+            installs.append(install)
+            download_urls += install.get("urls", [])
+        urls = [config["official_website"]] if "official_website" in config else []
+        urls += download_urls
+        hosts = sorted(set(urlparse(url).netloc for url in urls if isinstance(url, str)))
+        return ModRecord(sys.intern(config["name"]),
+                         tuple(sys.intern(str(tag)) for tag in tags),
+                         sys.intern(str(only_one_with_tag)) if only_one_with_tag else None,
+                         tuple(sys.intern(host) for host in hosts),
+                         config["official_website"] if isinstance(config.get("official_website"), str) else None,
+                         tuple(installs),
+                         tuple(download_urls),
+                         sys.intern(filename),
+                         index)
+
+    def __getstate__(self):
+        return (self.name, self.tags, self.only_one_with_tag, self.hosts, self.official_website, self.installs,
+                self.urls, self.filename, self.index)
+
+    def __setstate__(self, state):
+        name, tags, only_one_with_tag, hosts, official_website, installs, urls, filename, index = state
+        self.name = sys.intern(name)
+        self.tags = tuple(sys.intern(tag) for tag in tags)
+        self.only_one_with_tag = sys.intern(only_one_with_tag) if only_one_with_tag else None
+        self.hosts = tuple(sys.intern(host) for host in hosts)
+        self.official_website = official_website
+        self.installs = installs
+        self.urls = urls
+        self.filename = sys.intern(filename)
+        self.index = index
+
+
+def _parse_template(filename):
+    # Parse one YAML template file. Module level so it can run in a worker process.
+    try:
+        with open(filename, "r", encoding="utf8") as f:
+            return yaml.load(f, Loader=YamlLoader), None
+    except Exception as e:
+        return None, str(e)
+
+
+class CatalogCompiler:
+    '''
+    Loads the mod and mod group templates through a compiled catalog snapshot.
+
+    All templates/mods/*.yaml and templates/mod_groups/*.yaml files are parsed
+    (in parallel worker processes when many files changed, with the C YAML
+    loader when available), validated, and saved together in one pickle
+    snapshot keyed by each file's mtime and size. Later launches load the
+    snapshot and only reparse the files that were added or changed.
+
+    load() returns {"mods": [config, ...], "mod_groups": [config, ...]} in
+    filename order. In compact mode the mods are ModRecord objects instead,
+    and only those records are kept in the snapshot, so memory stays flat as
+    the catalog grows.
+    '''
+    snapshot_version = 5
+    # Number of template files whose parsed content load_config() keeps around
+    config_cache_size = 16
+    # Parse in worker processes once this many files need parsing
+    parallel_threshold = 64
+
+    def __init__(self, templates_folder, snapshot_path, logger, compact=False):
+        self.templates_folder = templates_folder
+        self.snapshot_path = snapshot_path
+        self.logger = logger
+        self.compact = compact
+        self.config_cache = collections.OrderedDict()
+        self.config_cache_lock = threading.Lock()
+
+    def _template_files(self):
+        files = {}
+        for kind in ["mods", "mod_groups"]:
+            for filename in sorted(glob.glob(os.path.join(self.templates_folder, kind, "*.yaml"))):
+                files[filename] = kind
+        return files
+
+    def _load_snapshot(self):
+        if not os.path.exists(self.snapshot_path):
+            return {}
+        try:
+            with open(self.snapshot_path, "rb") as f:
+                snapshot = pickle.load(f)
+            if snapshot.get("version") != self.snapshot_version or snapshot.get("compact") != self.compact:
+                return {}
+            return snapshot["files"]
+        except Exception as e:
+            self.logger(f"WARNING: Ignoring unreadable catalog snapshot {self.snapshot_path}: {e}")
+            return {}
+
+    def _save_snapshot(self, files):
+        temp_path = self.snapshot_path + ".tmp"
+        try:
+            with open(temp_path, "wb") as f:
+                pickle.dump({"version": self.snapshot_version, "compact": self.compact, "files": files}, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, self.snapshot_path)
+        except Exception as e:
+            self.logger(f"WARNING: Failed to save catalog snapshot {self.snapshot_path}: {e}")
+
+    def _validate(self, kind, filename, configs):
+        # Returns the valid configs of a template file, logging the invalid ones
+        if not configs or not isinstance(configs, list):
+            self.logger(f"ERROR: Failed to load {kind} from {filename}")
+            return []
+        required_keys = ["name", "description", "install"] if kind == "mods" else ["name", "description", "mods"]
+        valid = []
+        for index, config in enumerate(configs):
+            missing = [key for key in required_keys if not isinstance(config, dict) or key not in config]
+            if missing:
+                self.logger(f"ERROR: Entry in {filename} is missing {', '.join(missing)}")
+                continue
+            if self.compact and kind == "mods":
+                valid.append(ModRecord.from_config(config, filename, index))
+            else:
+                valid.append(config)
+        return valid
+
+    def load_config(self, record):
+        # Full config of a compact catalog mod, parsed from its template file.
+        # Recently parsed files are kept so mods from the same file load once.
+        with self.config_cache_lock:
+            configs = self.config_cache.get(record.filename)
+            if configs is not None:
+                self.config_cache.move_to_end(record.filename)
+        if configs is None:
+            configs, error = _parse_template(record.filename)
+            if error is not None:
+                raise Exception(f"Failed to load YAML mod from {record.filename}: {error}")
+            with self.config_cache_lock:
+                self.config_cache[record.filename] = configs
+                while len(self.config_cache) > self.config_cache_size:
+                    self.config_cache.popitem(last=False)
+        config = configs[record.index]
+        if config.get("name") != record.name:
+            raise Exception(f"Template {record.filename} changed since the catalog was loaded, restart to reload it")
+        return config
+
+    def _parse_files(self, filenames):
+        # Returns {filename: (configs, error)}
+        if len(filenames) >= self.parallel_threshold:
+            try:
+                with concurrent.futures.ProcessPoolExecutor() as executor:
+                    return dict(zip(filenames, executor.map(_parse_template, filenames, chunksize=16)))
+            except Exception as e:
+                self.logger(f"WARNING: Parallel template parsing failed, parsing serially: {e}")
+        return {filename: _parse_template(filename) for filename in filenames}
+
+    def load(self):
+        template_files = self._template_files()
+        cached = self._load_snapshot()
+
+        # Keep the entries whose file is unchanged, reparse the rest
+        files = {}
+        changed = []
+        for filename, kind in template_files.items():
+            stat = os.stat(filename)
+            entry = cached.get(filename)
+            if entry is not None and entry["mtime_ns"] == stat.st_mtime_ns and entry["size"] == stat.st_size and entry["error"] is None:
+                files[filename] = entry
+            else:
+                changed.append(filename)
+                files[filename] = {"kind": kind, "mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "configs": [], "error": None}
+
+        if changed:
+            self.logger(f"INFO: Parsing {len(changed)} changed templates")
+            for filename, (configs, error) in self._parse_files(changed).items():
+                kind = files[filename]["kind"]
+                if error is not None:
+                    # Not cached as valid, so the file is parsed again next launch
+                    self.logger(f"ERROR: Failed to load YAML {kind} from {filename}: {error}")
+                    files[filename]["error"] = error
+                    continue
+                files[filename]["configs"] = self._validate(kind, filename, configs)
+
+        if changed or len(files) != len(cached):
+            self._save_snapshot(files)
+        self.logger(f"INFO: Loaded catalog of {len(files)} templates, {len(files) - len(changed)} from snapshot")
+
+        catalog = {"mods": [], "mod_groups": []}
+        for filename in sorted(files):
+            catalog[files[filename]["kind"]] += files[filename]["configs"]
+        return catalog
@@ -0,0 +1,187 @@
+import collections
+import time
+import tkinter as tk
+from tkinter import ttk
+from urllib.parse import urlparse
+
+from mod import Mod
+
+
+class DownloadDashboard:
+    '''
+    Download panel of the App window: one row per planned mod with a progress
+    bar, its state, rate, queue position and mirror, and a summary line with
+    the overall progress, combined rate and ETA for the whole install plan.
+
+    Download threads only append their DownloadProgress events to a deque,
+    which needs no lock. The panel drains it frame_rate times per second on
+    the Tk main loop and only redraws the rows whose mod reported something.
+    '''
+    frame_rate = 10
+    bar_width = 20
+    # A planned download with no event after this long counts as not started
+    start_timeout = 5.0
+
+    def __init__(self, root, x, y, width, height):
+        self.root = root
+        self.events = collections.deque()
+        self.plan = None
+        self.rows = {}  # mod name -> latest DownloadProgress, or None before the first event
+        self.sizes = {}  # mod name -> expected size from the plan
+        self.plan_time = None
+        self.running = False
+
+        label_summary = tk.Label(root, anchor="w", justify="left")
+        label_summary["text"] = "Downloads: nothing planned yet"
+        label_summary.place(x=x, y=y, width=width - 310, height=24)
+        self.label_summary = label_summary
+
+        progress_total = ttk.Progressbar(root, orient="horizontal", mode="determinate", maximum=1.0)
+        progress_total.place(x=x + width - 300, y=y + 4, width=300, height=16)
+        self.progress_total = progress_total
+
+        columns = ["Mod", "Progress", "Status", "Rate", "Queue", "Mirror"]
+        tree_downloads = ttk.Treeview(root, columns=columns, show="headings")
+        for column, column_width in zip(columns, [260, 200, 110, 90, 60, 200]):
+            tree_downloads.heading(column, text=column)
+            tree_downloads.column(column, width=column_width, stretch=tk.YES if column == "Mirror" else tk.NO)
+        tree_downloads.tag_configure("failed", foreground="#cc0000")
+        tree_downloads.tag_configure("retrying", foreground="#cc7700")
+        tree_downloads.tag_configure("complete", foreground="#008800")
+        tree_downloads.place(x=x, y=y + 28, width=width, height=height - 28)
+        self.tree_downloads = tree_downloads
+
+        Mod.add_global_progress_listener(self.events.append)
+
+    def show_plan(self, plan):
+        # Start showing the downloads of an InstallPlan
+        self.plan = plan
+        self.plan_time = time.time()
+        self.rows = {}
+        self.sizes = {}
+        self.tree_downloads.delete(*self.tree_downloads.get_children())
+        for entries in plan.downloads().values():
+            # Mods sharing a file are downloaded once, by the first of them
+            entry = entries[0]
+            self.sizes[entry.mod.name] = entry.size
+            self.tree_downloads.insert("", "end", iid=entry.mod.name,
+                                       values=(entry.mod.name, self._bar(0.0), "planned", "", "", ""))
+            # Mods downloaded or queued earlier publish nothing new, start from their state
+            self.rows[entry.mod.name] = entry.mod.get_download_progress() if entry.mod.download_state is not None else None
+            self._update_row(entry.mod.name, None)
+        if not self.running:
+            self.running = True
+            self.root.after(int(1000 / self.frame_rate), self._frame)
+
+    def _bar(self, fraction):
+        filled = int(round(fraction * self.bar_width))
+        return "█" * filled + "░" * (self.bar_width - filled) + f" {fraction * 100:3.0f}%"
+
+    @staticmethod
+    def _format_bytes(size):
+        for unit in ["B", "KB", "MB", "GB"]:
+            if size < 1024 or unit == "GB":
+                return f"{size:.1f} {unit}" if unit != "B" else f"{size:.0f} B"
+            size /= 1024.0
+
+    @staticmethod
+    def _format_seconds(seconds):
+        seconds = int(seconds)
+        if seconds >= 3600:
+            return f"{seconds // 3600}h {seconds % 3600 // 60:02d}m"
+        return f"{seconds // 60}m {seconds % 60:02d}s"
+
+    def _frame(self):
+        # Apply the events that arrived since the last frame
+        changed = set()
+        while True:
+            try:
+                progress = self.events.popleft()
+            except IndexError:
+                break
+            if progress.mod.name in self.rows:
+                self.rows[progress.mod.name] = progress
+                changed.add(progress.mod.name)
+
+        queued = [label for label in Mod.get_scheduler().queued_labels() if label in self.rows]
+        queue_position = {name: position + 1 for position, name in enumerate(queued)}
+        for name in changed | set(queue_position):
+            self._update_row(name, queue_position.get(name))
+        self._update_summary()
+
+        # Keep drawing while something downloads. Rows that never got an event,
+        # eg. when starting the download failed, stop counting after start_timeout.
+        waiting_for_start = time.time() - self.plan_time < self.start_timeout
+        not_started = [name for name, progress in self.rows.items() if progress is None]
+        active = (waiting_for_start and len(not_started) > 0) or any(
+            progress is not None and progress.state in [Mod.STATE_QUEUED, Mod.STATE_DOWNLOADING]
+            for progress in self.rows.values())
+        if not active:
+            for name in not_started:
+                self.tree_downloads.item(name, tags=["failed"], values=(name, self._bar(0.0), "not started", "", "", ""))
+        if active or self.events:
+            self.root.after(int(1000 / self.frame_rate), self._frame)
+        else:
+            self.running = False
+
+    def _update_row(self, name, queue_position):
+        progress = self.rows[name]
+        if progress is None:
+            return
+        size = progress.total_bytes or self.sizes.get(name)
+        if progress.state == Mod.STATE_COMPLETE:
+            fraction = 1.0
+        elif size:
+            fraction = min(1.0, progress.downloaded_bytes / size)
+        else:
+            fraction = 0.0
+
+        tags = []
+        if progress.state == Mod.STATE_FAILED:
+            status = "failed"
+            tags.append("failed")
+        elif progress.state == Mod.STATE_COMPLETE:
+            status = "complete"
+            tags.append("complete")
+        elif progress.state == Mod.STATE_QUEUED:
+            status = "queued"
+        elif progress.attempt > 1:
+            status = f"retrying ({progress.attempt})"
+            tags.append("retrying")
+        else:
+            status = "downloading"
+
+        rate = f"{self._format_bytes(progress.rate)}/s" if progress.state == Mod.STATE_DOWNLOADING and progress.rate else ""
+        mirror = urlparse(progress.url).netloc if progress.url else ""
+        self.tree_downloads.item(name, tags=tags, values=(name, self._bar(fraction), status, rate,
+                                                          queue_position or "", mirror))
+
+    def _update_summary(self):
+        total_size = self.plan.total_size if self.plan is not None else 0
+        done_bytes = 0
+        rate = 0.0
+        failed = 0
+        complete = 0
+        for name, progress in self.rows.items():
+            if progress is None:
+                continue
+            if progress.state == Mod.STATE_COMPLETE:
+                complete += 1
+                done_bytes += self.sizes.get(name) or progress.total_bytes or 0
+            elif progress.state == Mod.STATE_FAILED:
+                failed += 1
+            elif progress.state == Mod.STATE_DOWNLOADING:
+                done_bytes += progress.downloaded_bytes
+                rate += progress.rate
+
+        text = f"Downloads: {complete} of {len(self.rows)} done, {self._format_bytes(done_bytes)} of {self._format_bytes(total_size)}"
+        if self.plan is not None and self.plan.unknown_size_count:
+            text += f" (+{self.plan.unknown_size_count} of unknown size)"
+        if rate > 0:
+            text += f", {self._format_bytes(rate)}/s"
+            if total_size > done_bytes:
+                text += f", ETA {self._format_seconds((total_size - done_bytes) / rate)}"
+        if failed:
+            text += f", {failed} failed"
+        self.label_summary["text"] = text
+        self.progress_total["value"] = min(1.0, done_bytes / total_size) if total_size else 0.0
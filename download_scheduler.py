@@ -0,0 +1,193 @@
+import heapq
+import itertools
+import threading
+from concurrent.futures import Future
+from urllib.parse import urlparse
+
+
+class DownloadScheduler:
+    '''
+    Shared worker pool that runs mod downloads.
+
+    Work is submitted with the host it will download from, its expected size and
+    whether it is required by its parent group. Jobs wait in a priority queue and
+    are started by max_workers worker threads. submit() returns a
+    concurrent.futures.Future with the result of the job.
+
+    max_per_host limits connections, not jobs: a running job holds one
+    connection to its host, and takes any extra ones it opens, for download
+    segments or mirror race probes, with acquire_connections(), which only
+    grants what is free. Those are counted against the host of the job
+    running on the calling thread, the host it was submitted with, even when
+    a download is redirected to another host. A job only starts while its
+    host has a free connection. Every mod is hosted on drive.google.com, so max_per_host is
+    in practice the total number of connections and should be at least
+    max_workers; the room above it goes to segments.
+
+    priority is a list of policies applied in order:
+    - required_by_parent_first: required mods before optional ones
+    - smallest_first: smaller downloads first (unknown sizes last)
+    - largest_first: larger downloads first (unknown sizes last)
+    '''
+    PRIORITY_REQUIRED_FIRST = "required_by_parent_first"
+    PRIORITY_SMALLEST_FIRST = "smallest_first"
+    PRIORITY_LARGEST_FIRST = "largest_first"
+
+    def __init__(self, max_workers=4, max_per_host=8, priority=None):
+        if priority is None:
+            priority = [self.PRIORITY_REQUIRED_FIRST, self.PRIORITY_SMALLEST_FIRST]
+        if isinstance(priority, str):
+            priority = [priority]
+        for policy in priority:
+            if policy not in [self.PRIORITY_REQUIRED_FIRST, self.PRIORITY_SMALLEST_FIRST, self.PRIORITY_LARGEST_FIRST]:
+                raise Exception(f"Unknown download priority policy: {policy}")
+        if max_workers < 1 or max_per_host < 1:
+            raise Exception("Download scheduler needs at least one worker and one connection per host.")
+
+        self.max_workers = max_workers
+        self.max_per_host = max_per_host
+        self.priority = priority
+
+        self.condition = threading.Condition()
+        self.queue = []  # heap of (priority key, sequence, job)
+        self.sequence = itertools.count()
+        self.active_per_host = {}
+        self.job_local = threading.local()  # .host: host of the job running on this worker
+        self.workers = []
+        self.shutdown_requested = False
+
+    def _priority_key(self, size, required):
+        key = []
+        for policy in self.priority:
+            if policy == self.PRIORITY_REQUIRED_FIRST:
+                key.append(0 if required else 1)
+            elif policy == self.PRIORITY_SMALLEST_FIRST:
+                key.append(size if size is not None else float("inf"))
+            elif policy == self.PRIORITY_LARGEST_FIRST:
+                key.append(-size if size is not None else float("inf"))
+        return tuple(key)
+
+    def submit(self, fn, *args, url=None, size=None, required=False, label=None, **kwargs):
+        # Queue fn(*args, **kwargs) and return a Future for its result. label
+        # names the job in queued_labels().
+        future = Future()
+        host = urlparse(url).netloc if url else None
+        job = {"fn": fn, "args": args, "kwargs": kwargs, "host": host, "future": future, "label": label}
+        with self.condition:
+            if self.shutdown_requested:
+                raise Exception("Download scheduler has been shut down.")
+            heapq.heappush(self.queue, (self._priority_key(size, required), next(self.sequence), job))
+            self._start_workers()
+            self.condition.notify()
+        return future
+
+    def set_concurrency(self, max_workers=None, max_per_host=None):
+        # Tune the number of parallel downloads, taking effect for the next jobs started
+        with self.condition:
+            if max_workers is not None:
+                self.max_workers = max(1, max_workers)
+            if max_per_host is not None:
+                self.max_per_host = max(1, max_per_host)
+            self._start_workers()
+            self.condition.notify_all()
+
+    def acquire_connections(self, count):
+        # Take up to count extra connections to the host of the job running on
+        # this thread, without waiting. Returns how many were granted, maybe 0.
+        # Outside of a job, or for a job without a host, nothing is counted and
+        # all are granted. Give them back with release_connections().
+        host = getattr(self.job_local, "host", None)
+        if host is None:
+            return count
+        with self.condition:
+            granted = max(0, min(count, self.max_per_host - self.active_per_host.get(host, 0)))
+            self.active_per_host[host] = self.active_per_host.get(host, 0) + granted
+            return granted
+
+    def release_connections(self, count):
+        host = getattr(self.job_local, "host", None)
+        if host is None or count <= 0:
+            return
+        with self.condition:
+            self.active_per_host[host] -= count
+            self.condition.notify_all()
+
+    def pending_count(self):
+        with self.condition:
+            return len(self.queue)
+
+    def queued_labels(self):
+        # Labels of the queued jobs in priority order, ignoring per host limits
+        with self.condition:
+            return [job["label"] for _, _, job in sorted(self.queue, key=lambda entry: entry[:2])]
+
+    def shutdown(self, wait=True):
+        # Cancel queued jobs and stop the workers once running jobs finish
+        with self.condition:
+            self.shutdown_requested = True
+            for _, _, job in self.queue:
+                job["future"].cancel()
+            self.queue = []
+            self.condition.notify_all()
+            workers = self.workers[:]
+        if wait:
+            for worker in workers:
+                worker.join()
+
+    def _start_workers(self):
+        # Called with the condition held
+        self.workers = [worker for worker in self.workers if worker.is_alive()]
+        while len(self.workers) < self.max_workers:
+            worker = threading.Thread(target=self._worker, daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def _next_job(self):
+        # Pop the highest priority job whose host has a free connection slot.
+        # Called with the condition held. Returns None if nothing can run yet.
+        skipped = []
+        job = None
+        while self.queue:
+            entry = heapq.heappop(self.queue)
+            host = entry[2]["host"]
+            if host is None or self.active_per_host.get(host, 0) < self.max_per_host:
+                job = entry[2]
+                break
+            skipped.append(entry)
+        for entry in skipped:
+            heapq.heappush(self.queue, entry)
+        return job
+
+    def _worker(self):
+        while True:
+            with self.condition:
+                job = None
+                while job is None:
+                    if self.shutdown_requested:
+                        return
+                    if len([worker for worker in self.workers if worker.is_alive()]) > self.max_workers:
+                        # Concurrency was reduced, retire this worker
+                        self.workers.remove(threading.current_thread())
+                        return
+                    job = self._next_job()
+                    if job is None:
+                        self.condition.wait()
+                if job["host"] is not None:
+                    self.active_per_host[job["host"]] = self.active_per_host.get(job["host"], 0) + 1
+
+            future = job["future"]
+            self.job_local.host = job["host"]
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        result = job["fn"](*job["args"], **job["kwargs"])
+                    except BaseException as e:
+                        future.set_exception(e)
+                    else:
+                        future.set_result(result)
+            finally:
+                self.job_local.host = None
+                with self.condition:
+                    if job["host"] is not None:
+                        self.active_per_host[job["host"]] -= 1
+                    self.condition.notify_all()
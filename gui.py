@@ -1,7 +1,6 @@
-import glob
+import concurrent.futures
 import json
 import os
-import time
 import tkinter as tk
 import tkinter.font as tkFont
 import winreg
@@ -16,8 +15,20 @@ import yaml
 from PIL import Image, ImageTk
 import webbrowser
 
+from catalog import CatalogCompiler
 from mod import Mod
+from download_scheduler import DownloadScheduler
+import http_session
+from cache_manager import CacheManager
 from mod_group import ModGroup
+from mod_group_resolver import ModGroupResolver
+from install_plan import InstallPlanCompiler
+from tree_model import TreeModel
+from search_index import SearchIndex
+from background_tasks import BackgroundTasks
+from download_dashboard import DownloadDashboard
+from selection_engine import SelectionEngine
+from structured_log import StructuredLog
 from PIL import ImageDraw
 
 class CheckboxTreeview(tw.CheckboxTreeview):
@@ -47,6 +58,10 @@ class CheckboxTreeview(tw.CheckboxTreeview):
         # Bind the click event
         self.bind("<ButtonRelease-1>", self._on_mod_selected)
 
+        # Rows are inserted by a TreeModel, children only once their parent is opened
+        self.model = None
+        self.bind("<<TreeviewOpen>>", self._on_open)
+
         # Draw a checked checkbox image for when it can't be enabled/disabled
         self.transparent_image = Image.new('RGBA', (12, 12), (255, 255, 255, 0))
         draw = ImageDraw.Draw(self.transparent_image)
@@ -66,9 +81,20 @@ class CheckboxTreeview(tw.CheckboxTreeview):
 
     def insert(self, parent, index, iid=None, **kw):
         if 'tags' in kw and 'required_by_parent' in kw['tags']:
-            kw['image'] = self.transparent_photo_checked
+            if 'unchecked' in kw['tags']:
+                kw['image'] = self.transparent_photo_unchecked
+            else:
+                kw['image'] = self.transparent_photo_checked
         return super().insert(parent, index, iid, **kw)
 
+    def is_model_row(self, item):
+        # False for empty space and for the placeholder rows of unopened nodes
+        return self.model is not None and str(item).isdigit() and int(item) in self.model.rows
+
+    def _on_open(self, event):
+        if self.model is not None:
+            self.model.on_open(event)
+
     def on_mouse_motion(self, event):
         # Change cursor to a hand when over the hyperlink column if it has a\
         # valid "official_website" backing the mod
@@ -80,7 +106,7 @@ class CheckboxTreeview(tw.CheckboxTreeview):
                 name = self.item(row_id).get("values")[0]
                 if name in self.parent_gui.mods:
                     mod = self.parent_gui.mods[name]
-                    if "official_website" in mod.config:
+                    if mod.official_website:
                         self.config(cursor="hand2")
                     else:
                         self.config(cursor="")
@@ -101,10 +127,9 @@ class CheckboxTreeview(tw.CheckboxTreeview):
                 name = self.item(row_id).get("values")[0]
                 if name in self.parent_gui.mods:
                     mod = self.parent_gui.mods[name]
-                    url = None
-                    if "official_website" in mod.config:
-                        self.parent_gui._log(f"INFO: Opening website: {mod.config['official_website']}")
-                        url = mod.config["official_website"]
+                    url = mod.official_website
+                    if url:
+                        self.parent_gui._log(f"INFO: Opening website: {url}")
                         if url.startswith("http"):
                             webbrowser.open(url)
 
@@ -113,7 +138,6 @@ class CheckboxTreeview(tw.CheckboxTreeview):
 
     # Update the checkbox image when the state changes
     def change_state(self, iid, new_state):
-        print(f"change_state: {iid} {new_state}")
         # call super
         super().change_state(iid, new_state)
         
@@ -125,29 +149,13 @@ class CheckboxTreeview(tw.CheckboxTreeview):
                 self.item(iid, image=self.transparent_photo_unchecked)
             else:
                 self.item(iid, image=self.transparent_photo_checked)
-        else:
-            # Handle "only_one_allowed" tag, where only one item can be checked
-            # in this group.
-            if new_state == "checked" and self.tag_has("only_one_allowed", iid):
-                # Uncheck all other items in the group, with preference to whichever
-                # item has "checked"
-                parent = self.parent(iid)
-
-                # Uncheck all other
-                for child in self.get_children(parent):
-                    if child != iid:
-                        self.change_state(child, "unchecked")
-                
-                # If there was no preferred item, then use the first item
-                #if not preferred_item:
-                #    preferred_item = self.get_children(parent)[0]
-
-                # Check the preferred item
-                #self.change_state(preferred_item, "checked")
 
-            # Override partially checked state to be checked
-            if new_state == "tristate":
-                new_state = "checked"
+    def apply_selection_delta(self, delta):
+        # Apply the {iid: state} changes returned by the SelectionEngine. Rows
+        # that are not in the tree yet get their state when they are inserted.
+        for iid, state in delta.items():
+            if self.model is None or self.model.is_materialized(iid):
+                self.change_state(iid, state)
 
     def _box_click(self, event):
         """Check or uncheck box when clicked."""
@@ -156,44 +164,32 @@ class CheckboxTreeview(tw.CheckboxTreeview):
         if "image" in elem:
             # a box was clicked
             item = self.identify_row(y)
+            if not self.is_model_row(item):
+                return
             if self.tag_has("required_by_parent", item):
                 return  # do nothing when disabled
-            if self.tag_has("unchecked", item) or self.tag_has("tristate", item):
-                self._check_ancestor(item)
-                self._check_descendant(item)
-            elif self.tag_has("checked"):
-                self._uncheck_descendant(item)
-                self._uncheck_ancestor(item)
-    
-    def check_item(self, item):
-        self.change_state(item, "checked")
-        self._check_descendant(item)
-        self._check_ancestor(item)
+            # The selection rules live in the SelectionEngine, only its changes are applied
+            self.apply_selection_delta(self.parent_gui.selection.click(int(item)))
+            self.parent_gui._pin_selected_mods()
     
     def _on_mod_selected(self, event):
         # Apply selected style to clicked on row
         item = self.identify_row(event.y)
-        if item:
-            # Remove selected style from all other rows
-            def remove_tag(items):
-                for item in items:
-                    self.tag_del(item, "selected")
-                    remove_tag(self.get_children(item))
-            
-            remove_tag(self.get_children())
-
-            # Add selected style to clicked on row                    
-            self.selection_set(int(item))
-            self.tag_add(item, "selected")
+        if self.is_model_row(item):
+            # The model moves the selected style from the previous row
+            self.model.select(int(item))
 
 class App:
     def __init__(self, root):
-        self.log_file = open("log.txt", "w", encoding="utf8")
+        # JSON lines log, also printed to the console, see structured_log.py
+        self.log = StructuredLog("log.jsonl")
+        self.log_app = self.log.channel("app")
+        self.log_mods = self.log.channel("mod")
 
         #### Setup TkIter GUI ####
         root.title("Skyrim EasyInstall")
         width=1200
-        height=577
+        height=780
         screenwidth = root.winfo_screenwidth()
         screenheight = root.winfo_screenheight()
         alignstr = '%dx%d+%d+%d' % (width, height, (screenwidth - width) / 2, (screenheight - height) / 2)
@@ -221,6 +217,18 @@ class App:
         label_tree_mods["text"] = "Choose which EasyInstall initial setup components you'd like to use to create your MO2 profile:"
         label_tree_mods.place(x=270,y=0,width=600,height=30)
 
+        label_filter_mods=tk.Label(root)
+        label_filter_mods["font"] = ft
+        label_filter_mods["fg"] = "#333333"
+        label_filter_mods["text"] = "Search:"
+        label_filter_mods.place(x=880,y=0,width=50,height=30)
+
+        # Filters the tree on every keystroke, see onchange_filter_mods
+        self.filter_text = tk.StringVar(root)
+        entry_filter_mods=tk.Entry(root, textvariable=self.filter_text)
+        entry_filter_mods.place(x=930,y=5,width=265,height=22)
+        self.entry_filter_mods = entry_filter_mods
+
         # Initialize the CheckboxTreeview
         columns = ["Name", "Description"]
         tree_mods = CheckboxTreeview(self, root, columns=columns, height=6)
@@ -256,16 +264,19 @@ class App:
         button_cleanup_skyrim.place(x=180,y=540,width=269,height=30)
         button_cleanup_skyrim["command"] = self.onclick_cleanup_skyrim
 
+        # Live progress of the install plan downloads
+        self.dashboard = DownloadDashboard(root, x=10, y=577, width=1185, height=195)
+
         #### End TkIter GUI setup ####
-        header_prefix = "✦✧✦ "  # Decorative stars
-        header_suffix = " ✦✧✦"
-        header_prefix = ""
-        header_suffix = ""
-        decorative_line = "────────────────────────"  # Using em dash for a line
 
         # Load saved variables from "save.json"
         self.folder_skyrim = None
         self.folder_mo2 = None
+        self.download_max_workers = 4
+        # Connections, for downloads and their segments, see DownloadScheduler
+        self.download_max_per_host = 8
+        self.cache_max_size_gb = None
+        self.compact_catalog = False
         if os.path.exists("save.json"):
             with open("save.json", "r", encoding="utf8") as f:
                 self._log(f"INFO: Loading save.json")
@@ -275,219 +286,367 @@ class App:
                         self.folder_skyrim = value
                     elif key == "folder_mo2":
                         self.folder_mo2 = value
+                    elif key == "download_max_workers":
+                        self.download_max_workers = value
+                    elif key == "download_max_per_host":
+                        self.download_max_per_host = value
+                    elif key == "cache_max_size_gb":
+                        self.cache_max_size_gb = value
+                    elif key == "compact_catalog":
+                        self.compact_catalog = value
+
+        # Shared download scheduler, tuned per machine in save.json
+        Mod.scheduler = DownloadScheduler(max_workers=self.download_max_workers,
+                                          max_per_host=self.download_max_per_host)
+        http_session.configure_pool(self.download_max_workers * Mod.download_segments)
+        self._log(f"INFO: Downloading with {self.download_max_workers} workers, {self.download_max_per_host} per host")
+
+        # Everything below is detected in the background so the window shows
+        # right away. Results arrive on the main thread through self.background,
+        # and the "Your setup" panel shows placeholders until then.
+        self.folder_download_cache = os.path.join(os.getenv("TEMP"), "Skyrim EasyInstall")
+        self.version_skyrim = None
+        self.folder_mo2_appdata = None
+        self.cache_manager = None
+        self.cache_usage = None
+        self.mods = {}
+        self.mod_groups = {}
+        self.selection = None
+        self.tree_model = None
+        self.install_plan = None
+        self.plan_compiling = False
+        self.pinned_mods = set()  # mods whose urls are pinned in the download cache
+        self.pinned_urls = {}  # mod name -> download urls
+        self.settings_saved = False
+        self.render_setup_info()
+
+        self.background = BackgroundTasks(root)
+        self.background.submit(self.find_game_folder, self.on_game_folder_found,
+                               lambda e: self._on_startup_error("Skyrim game folder", e), self.folder_skyrim)
+        self.background.submit(self.find_mo2_folder, self.on_mo2_folder_found,
+                               lambda e: self._on_startup_error("MO2 folder", e), self.folder_mo2)
+        self.background.submit(self.load_download_cache, self.on_download_cache_loaded,
+                               lambda e: self._on_startup_error("download cache", e))
+        self.background.submit(self.build_catalog, self.on_catalog_built,
+                               lambda e: self._on_startup_error("mod catalog", e))
+
+    def render_setup_info(self):
+        # Fill the "Your setup" panel, with placeholders for what is still detected
+        header_prefix = "✦✧✦ "  # Decorative stars
+        header_suffix = " ✦✧✦"
+        header_prefix = ""
+        header_suffix = ""
+        decorative_line = "────────────────────────"  # Using em dash for a line
+        def value(text):
+            return "Detecting..." if text is None else text
 
-        # Load the game folder
-        self.load_game_folder()
+        self.text_info.delete("1.0", tk.END)
         self.text_info.insert(tk.END, f"{decorative_line}\n")
         self.text_info.insert(tk.END, f"{header_prefix}✦✧✦ Skyrim ✦✧✦{header_suffix}\n")
         self.text_info.insert(tk.END, f"{header_prefix}Version:{header_suffix}\n")
-        self.text_info.insert(tk.END, f"{self.version_skyrim}\n\n")
+        self.text_info.insert(tk.END, f"{value(self.version_skyrim)}\n\n")
         self.text_info.insert(tk.END, f"{header_prefix}Folder:{header_suffix}\n")
-        self.text_info.insert(tk.END, f"{self.folder_skyrim}\n")
+        self.text_info.insert(tk.END, f"{value(self.folder_skyrim if self.version_skyrim else None)}\n")
         self.text_info.insert(tk.END, f"{decorative_line}\n")
 
-        # Load the MO2 folder
-        self.load_mo2_folder()
         self.text_info.insert(tk.END, f"{header_prefix}✦✧✦ Mod Organizer 2 ✦✧✦{header_suffix}\n")
         self.text_info.insert(tk.END, f"{header_prefix}Folder:{header_suffix}\n")
-        self.text_info.insert(tk.END, f"{self.folder_mo2}\n\n")
+        self.text_info.insert(tk.END, f"{value(self.folder_mo2 if self.folder_mo2_appdata else None)}\n\n")
         
-        # Set the MO2 profile instance
+        # The MO2 profile instance
         self.text_info.insert(tk.END, f"{header_prefix}EasyInstall instance:{header_suffix}\n")
-        self.text_info.insert(tk.END, f"{self.folder_mo2_appdata}\n")
+        self.text_info.insert(tk.END, f"{value(self.folder_mo2_appdata)}\n")
         self.text_info.insert(tk.END, f"{decorative_line}\n")
 
-        # Load the download cache folder as a %temp% folder
-        self.folder_download_cache = os.path.join(os.getenv("TEMP"), "Skyrim EasyInstall")
-        # Make the folder if it doesn't exist
-        if not os.path.exists(self.folder_download_cache):
-            os.makedirs(self.folder_download_cache)
         self.text_info.insert(tk.END, f"{header_prefix}✦✧✦ Download cache ✦✧✦{header_suffix}\n")
         self.text_info.insert(tk.END, f"{header_prefix}Number of mods:{header_suffix}\n")
-        self.text_info.insert(tk.END, f"{len(os.listdir(self.folder_download_cache))}\n\n")
-        self.text_info.insert(tk.END, f"{header_prefix}Size:{header_suffix}\n")
-        self.text_info.insert(tk.END, f"{os.path.getsize(self.folder_download_cache) / 1024 / 1024 / 1024:.2f} GB\n\n")
+        if self.cache_usage is None:
+            self.text_info.insert(tk.END, f"{value(None)}\n\n")
+            self.text_info.insert(tk.END, f"{header_prefix}Size:{header_suffix}\n")
+            self.text_info.insert(tk.END, f"{value(None)}\n\n")
+        else:
+            cache_count, cache_bytes = self.cache_usage
+            self.text_info.insert(tk.END, f"{cache_count}\n\n")
+            self.text_info.insert(tk.END, f"{header_prefix}Size:{header_suffix}\n")
+            if self.cache_max_size_gb is not None:
+                self.text_info.insert(tk.END, f"{cache_bytes / 1024 / 1024 / 1024:.2f} GB of {self.cache_max_size_gb:.2f} GB\n\n")
+            else:
+                self.text_info.insert(tk.END, f"{cache_bytes / 1024 / 1024 / 1024:.2f} GB\n\n")
         self.text_info.insert(tk.END, f"{header_prefix}Folder:{header_suffix}\n")
         self.text_info.insert(tk.END, f"{self.folder_download_cache}\n")
         self.text_info.insert(tk.END, f"{decorative_line}\n")
 
-        # Save specific variables to "save.json"
+    def _on_startup_error(self, what, error):
+        self._log(f"ERROR: Failed to load the {what}: {error}")
+
+    def on_game_folder_found(self, result):
+        # Ask for the game folder on the main thread if the search failed
+        install_location, version = result
+        if install_location is None:
+            install_location = self.ask_game_folder()
+            version = self.read_game_version(install_location)
+        self.folder_skyrim = install_location
+        self.version_skyrim = version
+        self.render_setup_info()
+        self._save_settings()
+
+    def on_mo2_folder_found(self, result):
+        # Ask for the MO2 folder on the main thread if the search failed
+        folder_mo2, folder_mo2_appdata = result
+        if folder_mo2 is None:
+            folder_mo2 = self.ask_mo2_folder()
+        self.folder_mo2 = folder_mo2
+        self.folder_mo2_appdata = folder_mo2_appdata
+        self.render_setup_info()
+        self._save_settings()
+
+    def _save_settings(self):
+        # Save specific variables to "save.json", once both folders are known
+        if self.settings_saved or self.version_skyrim is None or self.folder_mo2_appdata is None:
+            return
+        self.settings_saved = True
         with open("save.json", "w", encoding="utf8") as f:
             self._log(f"INFO: Saving save.json")
             json.dump({"folder_skyrim": self.folder_skyrim,
-                       "folder_mo2": self.folder_mo2}, f, indent=4)
-
-        self.load_mods()
-        self.load_mod_groups()
-
-        # Populate the top-level mod-groups into the tree.
+                       "folder_mo2": self.folder_mo2,
+                       "download_max_workers": self.download_max_workers,
+                       "download_max_per_host": self.download_max_per_host,
+                       "cache_max_size_gb": self.cache_max_size_gb,
+                       "compact_catalog": self.compact_catalog}, f, indent=4)
+
+    def load_download_cache(self):
+        # Runs in the background. Cache usage comes from the cache registry,
+        # kept within cache_max_size_gb.
+        # Make the folder if it doesn't exist
+        if not os.path.exists(self.folder_download_cache):
+            os.makedirs(self.folder_download_cache)
+        cache_manager = CacheManager.for_folder(self.folder_download_cache, self._log)
+        if self.cache_max_size_gb is not None:
+            cache_manager.set_max_bytes(int(self.cache_max_size_gb * 1024 * 1024 * 1024))
+        return cache_manager, cache_manager.usage()
+
+    def on_download_cache_loaded(self, result):
+        self.cache_manager, self.cache_usage = result
+        self.render_setup_info()
+        self._enforce_cache_budget()
+
+    def build_catalog(self):
+        # Runs in the background: load the templates and prepare everything
+        # the tree needs, without touching Tk or the App's attributes. The
+        # results are swapped in on the main thread by on_catalog_built.
+        catalog_compiler, catalog = self.load_catalog()
+        mods = self.load_mods(catalog_compiler, catalog)
+        mod_groups = self.load_mod_groups(catalog)
+
+        # Resolve the top-level mod-groups for the tree.
         # Use mod_group.gui_order_in_table to order them.
-        self.iid_to_name = {}
-        self.iid_to_table_data = {}
-        ordered_mod_groups = sorted(self.mod_groups.values(), key=lambda mod_group: mod_group.gui_order_in_table)
+        iid_to_name = {}
+        group_resolver = ModGroupResolver(mods, mod_groups, self._log)
+        selection = SelectionEngine(mods, self._log)
+        tree_rows = []
+        ordered_mod_groups = sorted(mod_groups.values(), key=lambda mod_group: mod_group.gui_order_in_table)
         for mod_group in ordered_mod_groups:
             if mod_group.gui_show_in_table:
-                table_data = mod_group.get_tree_data(None, False, self.mods, self.mod_groups, self.iid_to_name)
-
-                for data in table_data:
-                    print(data)
-                    # Add some tags
-                    tags_to_add = []
-                    tags = data["tags"] if "tags" in data else []
-
-                    if "required_by_parent" in tags:
-                        tags_to_add.append("disabled")
-                    
-                    if "highlighted" in tags:
-                        tags_to_add.append("highlighted")
-                    
-                    self.tree_mods.insert(data["parent"] or "", 'end', iid=data["iid"], text='', values=data["values"], tags=tags[:])
-                    self.iid_to_table_data[data["iid"]] = data
+                table_data = group_resolver.tree_rows(mod_group.name, iid_to_name)
+                tree_rows.append(table_data)
+                selection.add_rows(table_data)
                 
                 # Check the first item in the mod group
                 if len(table_data) > 0 and mod_group.gui_checked_by_default == True:
-                    self.tree_mods.check_item(table_data[0]["iid"])
-        
-        # Expand all the items in the tree view recursively
-        def expand_all(items):
-            for item in items:
-                self.tree_mods.item(item, open=True)
-                expand_all(self.tree_mods.get_children(item))
-        
-        expand_all(self.tree_mods.get_children())
+                    selection.check(table_data[0]["iid"])
+
+        return {
+            "catalog_compiler": catalog_compiler,
+            "catalog": catalog,
+            "mods": mods,
+            "mod_groups": mod_groups,
+            "iid_to_name": iid_to_name,
+            "group_resolver": group_resolver,
+            "plan_compiler": InstallPlanCompiler(mods, self.folder_download_cache, self._log),
+            "search_index": SearchIndex(mods),
+            "selection": selection,
+            "tree_rows": tree_rows,
+        }
+
+    def on_catalog_built(self, result):
+        self.catalog_compiler = result["catalog_compiler"]
+        self.catalog = result["catalog"]
+        self.mods = result["mods"]
+        self.mod_groups = result["mod_groups"]
+        self.iid_to_name = result["iid_to_name"]
+        self.group_resolver = result["group_resolver"]
+        self.plan_compiler = result["plan_compiler"]
+        self.search_index = result["search_index"]
+        self.selection = result["selection"]
+        tree_rows = result["tree_rows"]
+        self.tree_model = TreeModel(self.tree_mods, self.selection.state, self.describe_mods)
+        self.tree_mods.model = self.tree_model
+        for table_data in tree_rows:
+            self.tree_model.add_rows(table_data)
+
+        # Insert the rows with their checked states, opening the tree as far
+        # as the catalog size allows
+        self.tree_model.populate()
+        self.filter_text.trace_add("write", self.onchange_filter_mods)
+        self._enforce_cache_budget()
+
+    def describe_mods(self, names):
+        # Rows of compact catalog mods were shown, load their descriptions in the background
+        self.background.submit(self.load_descriptions, self.tree_model.set_descriptions,
+                               lambda e: self._log(f"ERROR: Failed to load mod descriptions: {e}"), names)
+
+    def load_descriptions(self, names):
+        # Runs in the background. Returns {mod name: description}, the configs
+        # are only loaded for this and dropped again
+        descriptions = {}
+        for name in names:
+            mod = self.mods[name]
+            descriptions[name] = mod.description
+            mod.unload_config()
+        return descriptions
+
+    def _enforce_cache_budget(self):
+        # Evict old downloads that the current selection does not need, once
+        # both the cache and the selection are loaded
+        if self.cache_manager is None or self.selection is None:
+            return
+        self._pin_selected_mods()
+        self.background.submit(self.cache_manager.enforce_budget, lambda result: None,
+                               lambda e: self._on_startup_error("download cache budget", e), self._log)
+
+    def _pin_selected_mods(self):
+        # Pin the cached downloads of all checked mods so they are never evicted.
+        # Runs on every click, so only the mods whose selection changed are
+        # looked up, from the catalog record without loading their config.
+        # Downloads in progress are pinned by the CacheManager on their own.
+        if self.cache_manager is None:
+            return
+        selected = set(self.selection.selected_mods())
+        for name in selected - self.pinned_mods:
+            self.pinned_urls[name] = self.mods[name].download_urls
+        for name in self.pinned_mods - selected:
+            del self.pinned_urls[name]
+        self.pinned_mods = selected
+        self.cache_manager.set_pinned_urls(url for urls in self.pinned_urls.values() for url in urls)
     
 
-    def _check_changed_state(self, iid, state):
-        # If it was checked, then apply the check, then
-        # apply the default "checked" state according to the
-        # children's config
-        if state == "checked":
-            self.tree_mods.change_state(iid, "checked")
-
-            # Now loop through the children and check them according to their config
-            for child in self.tree_mods.get_children(iid):
-                mod_table_data = self.iid_to_table_data[int(child)]
-                if "unchecked" in mod_table_data["tags"]:
-                    self.tree_mods.change_state(child, "unchecked")
-                    self._check_changed_state(child, "unchecked")
-                else:
-                    self.tree_mods.change_state(child, "checked")
-                    self._check_changed_state(child, "checked")
-
     def _log(self, message, verbose_only_message=False):
-        # Log with timestamp
-        if not verbose_only_message or "about" in self.config and "verbose" in self.config["about"] and self.config["about"]["verbose"]:
-            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] {message}")
-        
-        if self.log_file:
-            self.log_file.write(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] {message}\n")
-            self.log_file.flush()
-
-    def load_mods(self):
-        # Load all the mods from ./templates/mods/*.yaml
-        self.mods = {} # Key: mod name, Value: Mod object
-        glob_pattern = os.path.join("templates", "mods", "*.yaml")
-        self._log(f"INFO: Loading mods from {glob_pattern}")
-        for filename in glob.glob(glob_pattern):
-            self._log(f"INFO: Loading mod from {filename}")
-            configs = None
-            try:
-                with open(filename, "r", encoding="utf8") as f:
-                    configs = yaml.safe_load(f)
-            except Exception as e:
-                self._log(f"ERROR: Failed to load YAML mod from {filename}: {e}")
-                continue
-            if not configs:
-                self._log(f"ERROR: Failed to load mod from {filename}")
-                continue
-            
-            for config in configs:
-                mod = Mod(config, self._log, self.folder_download_cache)
-                self.mods[mod.name] = mod
+        self.log_app(message, verbose_only_message)
+
+    def load_catalog(self):
+        # Parse ./templates/mods/*.yaml and ./templates/mod_groups/*.yaml through
+        # the compiled catalog snapshot, which only reparses changed files
+        # Returns (catalog compiler, catalog)
+        if self.compact_catalog:
+            catalog_compiler = CatalogCompiler("templates", os.path.join("templates", ".catalog.compact.pickle"),
+                                               self._log, compact=True)
+        else:
+            catalog_compiler = CatalogCompiler("templates", os.path.join("templates", ".catalog.pickle"), self._log)
+        return catalog_compiler, catalog_compiler.load()
+
+    def load_mods(self, catalog_compiler, catalog):
+        # Load all the mods from the catalog
+        mods = {} # Key: mod name, Value: Mod object
+        for config in catalog["mods"]:
+            if self.compact_catalog:
+                # config is a ModRecord, the full config is loaded when the mod is used
+                mod = Mod.from_record(config, catalog_compiler.load_config, self.log_mods,
+                                      self.folder_download_cache)
+            else:
+                mod = Mod(config, self.log_mods, self.folder_download_cache)
+            mods[mod.name] = mod
         
-        self._log(f"INFO: Loaded {len(self.mods)} mods")
+        self._log(f"INFO: Loaded {len(mods)} mods")
+        return mods
     
-    def load_mod_groups(self):
-        # Load all the mod groups from ./templates/mod_groups/*.yaml
-        self.mod_groups = {} # Key: mod group name, Value: ModGroup object
-        glob_pattern = os.path.join("templates", "mod_groups", "*.yaml")
-        self._log(f"INFO: Loading mod groups from {glob_pattern}")
-        for filename in glob.glob(glob_pattern):
-            self._log(f"INFO: Loading mod group from {filename}")
-            configs = None
-            try:
-                with open(filename, "r", encoding="utf8") as f:
-                    configs = yaml.safe_load(f)
-            except Exception as e:
-                self._log(f"ERROR: Failed to load YAML mod group from {filename}: {e}")
-                continue
-
-            if not configs:
-                self._log(f"ERROR: Failed to load mod group from {filename}")
-                continue
-            
-            for config in configs:
-                mod_group = ModGroup(config, self._log)
-                self.mod_groups[mod_group.name] = mod_group
+    def load_mod_groups(self, catalog):
+        # Load all the mod groups from the catalog
+        mod_groups = {} # Key: mod group name, Value: ModGroup object
+        for config in catalog["mod_groups"]:
+            mod_group = ModGroup(config, self._log)
+            mod_groups[mod_group.name] = mod_group
         
-        self._log(f"INFO: Loaded {len(self.mod_groups)} mod groups")
-            
+        self._log(f"INFO: Loaded {len(mod_groups)} mod groups")
+        return mod_groups
 
-
-
-    def load_mo2_folder(self):
-        # Use predefined locations to find the MO2 folder
-        # If that fails, ask the user to select the folder.
-        # If the user cancels, exit the program.
+    def find_mo2_folder(self, folder_mo2):
+        # Runs in the background. Use the saved folder or predefined locations
+        # to find the MO2 folder, and prepare the appdata instance folder.
+        # Returns (MO2 folder or None, appdata folder).
         validation_filename = "ModOrganizer.exe"
-        self.folder_mo2 = None
 
-        if self.folder_mo2 and os.path.exists(os.path.join(self.folder_mo2, validation_filename)):
-            self._log(f"INFO: Using saved MO2 folder: {self.folder_mo2}")
+        if folder_mo2 and os.path.exists(os.path.join(folder_mo2, validation_filename)):
+            self._log(f"INFO: Using saved MO2 folder: {folder_mo2}")
         else:
             # Try some pre-defined locations
             self._log(f"INFO: Searching for MO2 folder")
-            for location in ["C:\\Modding\MO2",
-                            "D:\\Modding\MO2",
-                            "E:\\Modding\MO2",
-                            "F:\\Modding\MO2",
-                            "G:\\Modding\MO2",
-                            "H:\\Modding\MO2",]:
-                if os.path.exists(location) and os.path.exists(os.path.join(location, validation_filename)):
-                    self._log(f"INFO: Found MO2 folder: {location}")
-                    self.folder_mo2 = location
-                    break
-            
-            while not self.folder_mo2 or not os.path.exists(os.path.join(self.folder_mo2, validation_filename)):
-                self._log(f"INFO: Pre-defined locations failed, asking user to select MO2 folder")
-                self.folder_mo2 = tk.filedialog.askdirectory(title="Select the ModOrganizer 2 (MO2) folder (where ModOrganizer.exe is located). If you have not installed it yet, install the latest version using the Nexus Mods link athttps://www.modorganizer.org/.")
-                if not self.folder_mo2:
-                    self._log(f"INFO: User cancelled MO2 folder selection")
-                    exit(0)
-        
-        self._log(f"INFO: Found MO2 folder: {self.folder_mo2}")
+            folder_mo2 = self._first_existing(["C:\\Modding\MO2",
+                                               "D:\\Modding\MO2",
+                                               "E:\\Modding\MO2",
+                                               "F:\\Modding\MO2",
+                                               "G:\\Modding\MO2",
+                                               "H:\\Modding\MO2",], validation_filename)
+            if folder_mo2:
+                self._log(f"INFO: Found MO2 folder: {folder_mo2}")
 
         # Load the appdata folder
-        self.folder_mo2_appdata = os.path.join(os.getenv("APPDATA"), "ModOrganizer", "Skyrim EasyInstall")
+        folder_mo2_appdata = os.path.join(os.getenv("APPDATA"), "ModOrganizer", "Skyrim EasyInstall")
         # Make the folder if it doesn't exist
-        if not os.path.exists(self.folder_mo2_appdata):
-            os.makedirs(self.folder_mo2_appdata)
-        self._log(f"INFO: Set appdata MO2 folder: {self.folder_mo2_appdata}")
-        
-    def load_game_folder(self):
-        # Load the game folder from the uninstall registry first
-        # If that fails, check some pre-defined locations,
-        # then ask the user to select the folder.
+        if not os.path.exists(folder_mo2_appdata):
+            os.makedirs(folder_mo2_appdata)
+        self._log(f"INFO: Set appdata MO2 folder: {folder_mo2_appdata}")
+        return folder_mo2, folder_mo2_appdata
+
+    def ask_mo2_folder(self):
+        # Ask the user to select the MO2 folder, on the main thread.
         # If the user cancels, exit the program.
+        validation_filename = "ModOrganizer.exe"
+        folder_mo2 = None
+        while not folder_mo2 or not os.path.exists(os.path.join(folder_mo2, validation_filename)):
+            self._log(f"INFO: Pre-defined locations failed, asking user to select MO2 folder")
+            folder_mo2 = tk.filedialog.askdirectory(title="Select the ModOrganizer 2 (MO2) folder (where ModOrganizer.exe is located). If you have not installed it yet, install the latest version using the Nexus Mods link athttps://www.modorganizer.org/.")
+            if not folder_mo2:
+                self._log(f"INFO: User cancelled MO2 folder selection")
+                exit(0)
+        
+        self._log(f"INFO: Found MO2 folder: {folder_mo2}")
+        return folder_mo2
+
+    def _first_existing(self, locations, validation_filename):
+        # Check all locations at once. Returns the first one in list order that
+        # has validation_filename, or None, as soon as it and every location
+        # before it are checked, without waiting for slow or disconnected
+        # drives later in the list.
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(locations))
+        try:
+            futures = {executor.submit(os.path.exists, os.path.join(location, validation_filename)): index
+                       for index, location in enumerate(locations)}
+            found = [None] * len(locations)
+            for future in concurrent.futures.as_completed(futures):
+                found[futures[future]] = future.result()
+                # The first location in order that is not known to be missing
+                for location, exists in zip(locations, found):
+                    if exists is None:
+                        break
+                    if exists:
+                        return location
+            return None
+        finally:
+            executor.shutdown(wait=False)
+
+    def find_game_folder(self, folder_skyrim):
+        # Runs in the background. Load the game folder from the uninstall
+        # registry first. If that fails, check some pre-defined locations.
+        # Returns (game folder, game version), or (None, None) if not found.
         # Get the uninstall name
         validation_filename = "SkyrimSE.exe"
         def is_valid_install_location(install_location):
             return os.path.exists(os.path.join(install_location, validation_filename))
         uninstall_display_name = "The Elder Scrolls V: Skyrim Special Edition"
 
-        if self.folder_skyrim and is_valid_install_location(self.folder_skyrim):
-            self._log(f"INFO: Using saved game folder: {self.folder_skyrim}")
-            install_location = self.folder_skyrim
+        if folder_skyrim and is_valid_install_location(folder_skyrim):
+            self._log(f"INFO: Using saved game folder: {folder_skyrim}")
+            install_location = folder_skyrim
         else:
             self._log(f"INFO: Searching for uninstall_display_name to find folder: {uninstall_display_name}")
             install_location = None
@@ -519,24 +678,33 @@ class App:
 
             # Try some pre-defined locations
             self._log(f"INFO: Searching for validation_filename to find folder: {validation_filename}")
-            for location in ["C:\\Program Files (x86)\\Steam\\steamapps\\common\\Skyrim Special Edition",
-                             "C:\\Program Files\\Steam\\steamapps\\common\\Skyrim Special Edition",
-                             "D:\\Program Files (x86)\\Steam\\steamapps\\common\\Skyrim Special Edition",
-                             "D:\\Program Files\\Steam\\steamapps\\common\\Skyrim Special Edition",
-                             "E:\\Program Files (x86)\\Steam\\steamapps\\common\\Skyrim Special Edition",
-                             "E:\\Program Files\\Steam\\steamapps\\common\\Skyrim Special Edition",
-                             "F:\\Program Files (x86)\\Steam\\steamapps\\common\\Skyrim Special Edition",
-                             "F:\\Program Files\\Steam\\steamapps\\common\\Skyrim Special Edition",
-                             "G:\\Program Files (x86)\\Steam\\steamapps\\common\\Skyrim Special Edition",
-                             "G:\\Program Files\\Steam\\steamapps\\common\\Skyrim Special Edition",
-                             "H:\\Program Files (x86)\\Steam\\steamapps\\common\\Skyrim Special Edition",
-                             "H:\\Program Files\\Steam\\steamapps\\common\\Skyrim Special Edition",]:
-                if os.path.exists(location) and os.path.exists(os.path.join(location, validation_filename)):
-                    self._log(f"INFO: Found validation_filename: {validation_filename}")
-                    install_location = location
-                    break
+            install_location = self._first_existing(["C:\\Program Files (x86)\\Steam\\steamapps\\common\\Skyrim Special Edition",
+                                                     "C:\\Program Files\\Steam\\steamapps\\common\\Skyrim Special Edition",
+                                                     "D:\\Program Files (x86)\\Steam\\steamapps\\common\\Skyrim Special Edition",
+                                                     "D:\\Program Files\\Steam\\steamapps\\common\\Skyrim Special Edition",
+                                                     "E:\\Program Files (x86)\\Steam\\steamapps\\common\\Skyrim Special Edition",
+                                                     "E:\\Program Files\\Steam\\steamapps\\common\\Skyrim Special Edition",
+                                                     "F:\\Program Files (x86)\\Steam\\steamapps\\common\\Skyrim Special Edition",
+                                                     "F:\\Program Files\\Steam\\steamapps\\common\\Skyrim Special Edition",
+                                                     "G:\\Program Files (x86)\\Steam\\steamapps\\common\\Skyrim Special Edition",
+                                                     "G:\\Program Files\\Steam\\steamapps\\common\\Skyrim Special Edition",
+                                                     "H:\\Program Files (x86)\\Steam\\steamapps\\common\\Skyrim Special Edition",
+                                                     "H:\\Program Files\\Steam\\steamapps\\common\\Skyrim Special Edition",], validation_filename)
+            if install_location:
+                self._log(f"INFO: Found validation_filename: {validation_filename}")
         
-        # Ask the user to select the folder until they cancel or select the right folder
+        if not install_location:
+            return None, None
+        self._log(f"INFO: Found game folder: {install_location}")
+        return install_location, self.read_game_version(install_location)
+
+    def ask_game_folder(self):
+        # Ask the user to select the folder until they cancel or select the
+        # right folder, on the main thread. If the user cancels, exit the program.
+        validation_filename = "SkyrimSE.exe"
+        def is_valid_install_location(install_location):
+            return os.path.exists(os.path.join(install_location, validation_filename))
+        install_location = None
         while not install_location or not is_valid_install_location(install_location):
             self._log(f"INFO: Asking user to select game folder")
             install_location = tk.filedialog.askdirectory(title="Select the Skyrim Special Edition game folder (where SkyrimSE.exe is located)")
@@ -545,21 +713,60 @@ class App:
                 exit(0)
         
         self._log(f"INFO: Found game folder: {install_location}")
-        self.folder_skyrim = install_location
+        return install_location
 
+    def read_game_version(self, folder_skyrim):
         # Now check the game version
         self._log(f"INFO: Checking game version")
-        version_file = os.path.join(self.folder_skyrim, "SkyrimSE.exe")
+        version_file = os.path.join(folder_skyrim, "SkyrimSE.exe")
         version = w.GetFileVersionInfo(version_file, "\\")
         version_ms = version["FileVersionMS"]
         version_ls = version["FileVersionLS"]
         version = (version_ms >> 16, version_ms & 0xFFFF, version_ls >> 16, version_ls & 0xFFFF)
         version = ".".join(map(str, version))
         self._log(f"INFO: Game version: {version}")
-        self.version_skyrim = version
+        return version
+
+    def onchange_filter_mods(self, *args):
+        # Show the mods matching the search box with their groups, or the whole tree when it is empty
+        names = self.search_index.search(self.filter_text.get())
+        if names is None:
+            self.tree_model.clear_filter()
+        else:
+            self.tree_model.show_filter(names)
 
     def onclick_build_mo2_profile(self):
-        print("command")
+        # Compile the selection into one install plan in the background, it
+        # probes download sizes over the network, then queue its downloads
+        # and write the profile load order from it in on_plan_compiled
+        if self.selection is None or self.version_skyrim is None or self.folder_mo2_appdata is None:
+            self._log(f"INFO: Still detecting your setup, try again in a moment")
+            return
+        if self.plan_compiling:
+            self._log(f"INFO: Already building the install plan")
+            return
+        self.plan_compiling = True
+        self.background.submit(self.plan_compiler.compile, self.on_plan_compiled, self.on_plan_failed,
+                               self.selection.selected_mods(), self.version_skyrim,
+                               os.path.join(self.folder_mo2_appdata, "mods"), self.selection.required_mods())
+
+    def on_plan_failed(self, error):
+        self.plan_compiling = False
+        self._log(f"ERROR: Failed to build the install plan: {error}")
+
+    def on_plan_compiled(self, install_plan):
+        self.plan_compiling = False
+        self.install_plan = install_plan
+        for entry in self.install_plan.entries:
+            self._log(f"INFO: Plan: {entry.mod.name} -> {entry.target_folder} ({entry.size if entry.size is not None else 'unknown'} bytes)")
+        self.dashboard.show_plan(self.install_plan)
+        self.install_plan.start_downloads()
+
+        folder_profile = os.path.join(self.folder_mo2_appdata, "profiles", "EasyInstall")
+        if not os.path.exists(folder_profile):
+            os.makedirs(folder_profile)
+        self.install_plan.write_modlist(os.path.join(folder_profile, "modlist.txt"))
+        self._log(f"INFO: Wrote load order of {len(self.install_plan.entries)} mods to {folder_profile}")
 
     def onclick_cleanup_mo2(self):
         print("command")
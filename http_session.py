@@ -0,0 +1,55 @@
+"""
+Process-wide pooled HTTP session shared by all downloads.
+
+Every request made through get_session() reuses kept-alive connections, so
+the Google Drive confirm page, the download itself and the byte range
+requests of other mods all skip the TCP+TLS handshake once a connection to
+the host is open. Size the pool to the download concurrency with
+configure_pool(), or inject a different session (for example one pointing
+at a local stub server) with set_session().
+"""
+
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+_lock = threading.Lock()
+_session = None
+_pool_size = 16
+
+
+def _create_session(pool_size):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session():
+    # Shared session, created on first use
+    global _session
+    with _lock:
+        if _session is None:
+            _session = _create_session(_pool_size)
+        return _session
+
+
+def set_session(session):
+    # Replace the shared session, eg. with a session configured for tests
+    global _session
+    with _lock:
+        old_session = _session
+        _session = session
+    if old_session is not None and old_session is not session:
+        old_session.close()
+
+
+def configure_pool(pool_size):
+    # Size the connection pool to the number of parallel requests. Open
+    # connections are dropped, so call this before downloads start.
+    global _pool_size
+    with _lock:
+        _pool_size = max(1, pool_size)
+    set_session(_create_session(_pool_size))
@@ -0,0 +1,151 @@
+import collections
+import concurrent.futures
+import os
+
+from cache_registry import CacheRegistry
+from load_order import LoadOrder
+from version_match import CompatibilityIndex
+
+# One mod to download and install.
+# - mod: the Mod
+# - install: the install entry chosen for the game version
+# - urls: candidate download urls, without duplicates
+# - size: expected download size in bytes, or None if it could not be found
+# - target_folder: MO2 mod folder the mod is installed into
+# - required: True if the mod is required by its parent in the selection
+PlanEntry = collections.namedtuple("PlanEntry", ["mod", "install", "urls", "size", "target_folder", "required"])
+
+
+class InstallPlan:
+    '''
+    Deduplicated, ordered manifest of the mods to download and install, made by
+    InstallPlanCompiler. entries are in load order. Mods that have no install
+    entry for the game version are listed in unsupported.
+    '''
+    def __init__(self, game_version, entries, unsupported, load_order):
+        self.game_version = game_version
+        self.entries = entries
+        self.unsupported = unsupported
+        self.load_order = load_order
+
+    @property
+    def total_size(self):
+        # Sum of the known download sizes
+        return sum(entry.size for entry in self.entries if entry.size is not None)
+
+    @property
+    def unknown_size_count(self):
+        return sum(1 for entry in self.entries if entry.size is None)
+
+    def downloads(self):
+        # {first url: [entries]}, one download for mods that share the same file
+        downloads = collections.OrderedDict()
+        for entry in self.entries:
+            if entry.urls:
+                downloads.setdefault(entry.urls[0], []).append(entry)
+        return downloads
+
+    def start_downloads(self):
+        # Queue every download on the shared scheduler, once per file. The
+        # other mods sharing a file get its result when it finishes.
+        # Returns {mod name: Future} for every entry.
+        futures = {}
+        for entries in self.downloads().values():
+            entry = entries[0]
+            future = entry.mod.start_download_async(
+                self.game_version,
+                required_by_parent=any(other.required for other in entries),
+                install=entry.install,
+                size=entry.size)
+            futures[entry.mod.name] = future
+            for other in entries[1:]:
+                futures[other.mod.name] = other.mod.follow_download(entry.mod, future)
+        return futures
+
+    def modlist_lines(self):
+        return self.load_order.modlist_lines()
+
+    def write_modlist(self, path):
+        self.load_order.write_modlist(path)
+
+
+class InstallPlanCompiler:
+    '''
+    Compiles a selection of mods and the game version into an InstallPlan.
+
+    Each selected mod appears once, however many groups list it. Its install
+    entry comes from a CompatibilityIndex over the catalog, and the plan is in
+    the LoadOrder of the selection. Expected sizes come from the install
+    entry's "size", else from the download cache registry, else from probing
+    the download headers of the remaining mods in parallel, so downloads can
+    be scheduled by size and progress is known from the start. Probed sizes
+    are remembered for later plans.
+    '''
+    # Number of download headers probed at once for unknown sizes
+    probe_workers = 8
+
+    def __init__(self, mods, cache_folder, logger, probe_sizes=True):
+        # mods is a dict of {name: Mod}
+        self.mods = mods
+        self.cache_folder = cache_folder
+        self.logger = logger
+        self.probe_sizes = probe_sizes
+        self.compatibility = CompatibilityIndex(mods)
+        self.probed_sizes = {}  # tuple of urls -> size
+
+    def compile(self, selected_names, game_version, mods_folder, required_names=()):
+        # selected_names: mod names in selection order, duplicates are ignored
+        # required_names: names of the mods required by their parent
+        installs = {mod.name: install for mod, install in self.compatibility.lookup(game_version)}
+        required_names = set(required_names)
+
+        names = []
+        unsupported = []
+        for name in dict.fromkeys(selected_names):
+            if name not in installs:
+                self.logger(f"WARNING: Mod {name} has no download for game version {game_version}, skipping it")
+                unsupported.append(self.mods[name])
+            else:
+                names.append(name)
+
+        load_order = LoadOrder(self.mods, self.logger)
+        ordered_names = load_order.set_selection(names)
+
+        registry = CacheRegistry.for_folder(self.cache_folder, self.logger)
+        urls_by_name = {}
+        sizes = {}
+        for name in ordered_names:
+            install = installs[name]
+            urls = list(dict.fromkeys(install.get("urls") or []))
+            urls_by_name[name] = urls
+            size = install.get("size")
+            if size is None:
+                for url in urls:
+                    entry = registry.lookup(url)
+                    if entry is not None:
+                        size = entry["filesize"]
+                        break
+            if size is None:
+                size = self.probed_sizes.get(tuple(urls))
+            sizes[name] = size
+
+        unknown = [name for name in ordered_names if sizes[name] is None and urls_by_name[name]]
+        if unknown and self.probe_sizes:
+            self.logger(f"INFO: Probing the download size of {len(unknown)} mods")
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.probe_workers) as executor:
+                probes = {name: executor.submit(self.mods[name].probe_download_size, urls_by_name[name]) for name in unknown}
+                for name, probe in probes.items():
+                    try:
+                        sizes[name] = probe.result()
+                    except Exception as e:
+                        self.logger(f"WARNING: Failed to probe the download size of mod {name}: {e}")
+                    if sizes[name] is not None:
+                        self.probed_sizes[tuple(urls_by_name[name])] = sizes[name]
+
+        entries = [PlanEntry(self.mods[name], installs[name], urls_by_name[name], sizes[name],
+                             os.path.join(mods_folder, name), name in required_names)
+                   for name in ordered_names]
+        plan = InstallPlan(game_version, entries, unsupported, load_order)
+        self.logger(f"INFO: Install plan for game version {game_version}: {len(entries)} mods, "
+                    f"{plan.total_size / 1024 / 1024:.1f} MB, {plan.unknown_size_count} of unknown size")
+        return plan
@@ -0,0 +1,193 @@
+class LoadOrder:
+    '''
+    Orders a selection of mods by their mod_order constraints.
+
+    Mod templates declare constraints like:
+      mod_order:
+      - after: "RaceMenu"
+      - before: "Some Patch"
+    A target is a mod name or a tag, a tag stands for every mod with it.
+    Each constraint becomes an edge of a graph over the selected mods. The
+    order is a depth first topological sort in selection order, O(V+E), so it
+    is stable: mods without constraints between them keep the order they
+    were selected in. A cycle raises an exception naming the chain of mods,
+    each loading before the next.
+    Constraints naming a mod that is not in the catalog are logged and kept
+    in self.missing as (mod, target) pairs. Constraints naming a catalog mod
+    that is not selected are ignored.
+
+    add() and remove() update the order for one mod without sorting the
+    whole selection again when the existing order allows it.
+    '''
+    def __init__(self, mods, logger):
+        # mods is a dict of {name: Mod} for the whole catalog
+        self.mods = mods
+        self.logger = logger
+        self.selected = []  # mod names in selection order
+        self.selected_set = set()
+        self.before = {}  # name -> set of selected names that must load before it
+        self.after = {}  # name -> set of selected names that must load after it
+        self.order = []
+        self.position = {}  # name -> index in self.order
+        self.missing = []
+        self.declared = {}  # name -> (earlier, later) pairs declared by that mod
+        self.tagged = {}  # tag -> names of the mods with that tag
+        for name, mod in mods.items():
+            if mod.record is not None:
+                tags = mod.record.tags
+            else:
+                tags = mod.config.get("tag") or []
+                if not isinstance(tags, list):
+                    tags = [tags]
+            for tag in tags:
+                self.tagged.setdefault(str(tag), []).append(name)
+
+    def _targets(self, name, target):
+        if target in self.mods:
+            return [target]
+        if target in self.tagged:
+            return [other for other in self.tagged[target] if other != name]
+        self._report_missing(name, target)
+        return []
+
+    def _constraints(self, name):
+        # (earlier, later) pairs declared by one mod
+        if name not in self.declared:
+            mod = self.mods[name]
+            pairs = []
+            for constraint in mod.config.get("mod_order") or []:
+                if "after" in constraint:
+                    pairs += [(target, name) for target in self._targets(name, constraint["after"])]
+                if "before" in constraint:
+                    pairs += [(name, target) for target in self._targets(name, constraint["before"])]
+            # The pairs are kept, a compact catalog mod's config is not needed anymore
+            mod.unload_config()
+            self.declared[name] = pairs
+        return self.declared[name]
+
+    def _report_missing(self, name, target):
+        if (name, target) not in self.missing:
+            self.missing.append((name, target))
+            self.logger(f"WARNING: Mod {name} has a mod_order constraint on {target}, which is not a known mod or tag")
+
+    def _add_edges(self, name):
+        self.before.setdefault(name, set())
+        self.after.setdefault(name, set())
+        for earlier, later in self._constraints(name):
+            if earlier in self.selected_set and later in self.selected_set:
+                self.before[later].add(earlier)
+                self.after[earlier].add(later)
+        # Constraints declared by already selected mods that point at this one
+        for other in self.selected:
+            if other == name:
+                continue
+            for earlier, later in self._constraints(other):
+                if name in (earlier, later) and earlier in self.selected_set and later in self.selected_set:
+                    self.before[later].add(earlier)
+                    self.after[earlier].add(later)
+
+    def set_selection(self, names):
+        # Replace the selection and sort it. Returns the ordered list of names.
+        self.selected = []
+        self.selected_set = set()
+        for name in names:
+            if name not in self.mods:
+                raise Exception(f"Unknown mod in selection: {name}")
+            if name not in self.selected_set:
+                self.selected.append(name)
+                self.selected_set.add(name)
+
+        self.before = {name: set() for name in self.selected}
+        self.after = {name: set() for name in self.selected}
+        for name in self.selected:
+            for earlier, later in self._constraints(name):
+                if earlier in self.selected_set and later in self.selected_set:
+                    self.before[later].add(earlier)
+                    self.after[earlier].add(later)
+        return self.sort()
+
+    def sort(self):
+        # Full depth first topological sort of the selection
+        order = []
+        state = {}  # name -> "visiting" or "done"
+        selection_index = {name: index for index, name in enumerate(self.selected)}
+
+        for root in self.selected:
+            if root in state:
+                continue
+            # Iterative DFS visiting the mods that must load earlier first
+            stack = [(root, iter(sorted(self.before[root], key=selection_index.get)))]
+            state[root] = "visiting"
+            while stack:
+                name, earlier = stack[-1]
+                advanced = False
+                for dependency in earlier:
+                    if state.get(dependency) == "done":
+                        continue
+                    if state.get(dependency) == "visiting":
+                        chain = [entry[0] for entry in stack]
+                        chain = chain[chain.index(dependency):] + [dependency]
+                        raise Exception(f"Mod load order cycle: {' -> '.join(reversed(chain))}")
+                    state[dependency] = "visiting"
+                    stack.append((dependency, iter(sorted(self.before[dependency], key=selection_index.get))))
+                    advanced = True
+                    break
+                if not advanced:
+                    stack.pop()
+                    state[name] = "done"
+                    order.append(name)
+
+        self.order = order
+        self.position = {name: index for index, name in enumerate(order)}
+        return list(order)
+
+    def add(self, name):
+        # Add one mod to the selection. It is inserted directly after the last
+        # mod it must follow when that keeps every constraint, otherwise the
+        # selection is sorted again.
+        if name in self.selected_set:
+            return list(self.order)
+        if name not in self.mods:
+            raise Exception(f"Unknown mod in selection: {name}")
+        self.selected.append(name)
+        self.selected_set.add(name)
+        self._add_edges(name)
+
+        earliest = min((self.position[other] for other in self.after[name]), default=len(self.order))
+        latest = max((self.position[other] for other in self.before[name]), default=-1)
+        if latest >= earliest:
+            return self.sort()
+
+        index = latest + 1 if self.after[name] else len(self.order)
+        self.order.insert(index, name)
+        for position in range(index, len(self.order)):
+            self.position[self.order[position]] = position
+        return list(self.order)
+
+    def remove(self, name):
+        # Remove one mod from the selection, the rest of the order stays valid
+        if name not in self.selected_set:
+            return list(self.order)
+        self.selected.remove(name)
+        self.selected_set.discard(name)
+        for other in self.before.pop(name, set()):
+            self.after[other].discard(name)
+        for other in self.after.pop(name, set()):
+            self.before[other].discard(name)
+
+        index = self.position.pop(name)
+        del self.order[index]
+        for position in range(index, len(self.order)):
+            self.position[self.order[position]] = position
+        return list(self.order)
+
+    def modlist_lines(self):
+        # Lines of an MO2 profile modlist.txt. MO2 lists the highest priority
+        # mod, the one loaded last, at the top.
+        lines = ["# This file was automatically generated by Mod Organizer."]
+        lines += ["+" + name for name in reversed(self.order)]
+        return lines
+
+    def write_modlist(self, path):
+        with open(path, "w", encoding="utf8") as f:
+            f.write("\n".join(self.modlist_lines()) + "\n")
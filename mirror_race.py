@@ -0,0 +1,141 @@
+import json
+import os
+import re
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+# /file/d/<id>/view style Google Drive links
+DRIVE_FILE_PATTERN = re.compile(r"/file/d/([A-Za-z0-9_-]+)")
+
+
+class MirrorStats:
+    '''
+    Remembers the download throughput seen from each mirror, so later runs try
+    the fastest mirrors first.
+
+    Mirrors are told apart by key(): Google Drive urls by their file id, since
+    every Drive mirror has the same host, other urls by their host.
+    Throughput is kept as a moving average in bytes per second and stored in
+    "mirror_stats.json" in the download cache folder. There is one MirrorStats
+    per cache folder per process, see for_folder(); warnings go to the logger
+    of the first call.
+    '''
+    stats_filename = "mirror_stats.json"
+    # Weight of the newest measurement in the moving average
+    smoothing = 0.3
+
+    # Class-wide registry of MirrorStats objects, keyed by cache folder
+    instances = {}
+    instances_lock = threading.Lock()
+
+    @classmethod
+    def for_folder(cls, cache_folder, logger=print):
+        key = os.path.abspath(cache_folder)
+        with cls.instances_lock:
+            if key not in cls.instances:
+                cls.instances[key] = MirrorStats(cache_folder, logger)
+            return cls.instances[key]
+
+    def __init__(self, cache_folder, logger=print):
+        self.path = os.path.join(cache_folder, self.stats_filename)
+        self.logger = logger
+        self.lock = threading.Lock()
+        self.mirrors = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r", encoding="utf8") as f:
+                    self.mirrors = json.load(f)
+            except Exception as e:
+                self.logger(f"WARNING: Ignoring unreadable mirror stats {self.path}: {e}")
+
+    @staticmethod
+    def key(url):
+        parsed = urlparse(url)
+        if parsed.netloc == "drive.google.com":
+            match = DRIVE_FILE_PATTERN.search(parsed.path)
+            if match:
+                return "drive:" + match.group(1)
+            file_ids = parse_qs(parsed.query).get("id")
+            if file_ids:
+                return "drive:" + file_ids[0]
+        return parsed.netloc
+
+    def throughput(self, url):
+        # Remembered bytes per second for the url's mirror, or None if never measured
+        with self.lock:
+            return self.mirrors.get(self.key(url))
+
+    def record(self, url, bytes_per_second):
+        with self.lock:
+            key = self.key(url)
+            if key in self.mirrors:
+                self.mirrors[key] = (1.0 - self.smoothing) * self.mirrors[key] + self.smoothing * bytes_per_second
+            else:
+                self.mirrors[key] = bytes_per_second
+            data = json.dumps(self.mirrors, indent=4)
+            temp_path = self.path + ".tmp"
+            with open(temp_path, "w", encoding="utf8") as f:
+                f.write(data)
+            os.replace(temp_path, self.path)
+
+    def order(self, urls):
+        # Sort urls by remembered mirror throughput, fastest first. Mirrors that
+        # were never measured keep their place after the measured ones.
+        with self.lock:
+            known = [url for url in urls if self.key(url) in self.mirrors]
+            unknown = [url for url in urls if self.key(url) not in self.mirrors]
+            known.sort(key=lambda url: -self.mirrors[self.key(url)])
+        return known + unknown
+
+
+def race_mirrors(urls, probe, timeout=15.0):
+    '''
+    Probe several mirror urls at once and return them ordered by early throughput.
+
+    probe(url, stop) is run on its own thread for each url. It should read the
+    first bytes of the download and return the measured bytes per second, or
+    None if the mirror failed. It must give up soon after the stop event is set,
+    which happens once the race is decided: every probe finished, the timeout
+    passed, or the other probes are already twice as slow as the first one to
+    finish.
+
+    Returns a list of (url, bytes per second) for the mirrors that answered,
+    fastest first.
+    '''
+    stop = threading.Event()
+    condition = threading.Condition()
+    results = {}
+    state = {"finished": 0, "first_finish_time": None}
+
+    def run_probe(url):
+        try:
+            throughput = probe(url, stop)
+        except Exception:
+            throughput = None
+        with condition:
+            if throughput is not None:
+                results[url] = throughput
+                if state["first_finish_time"] is None:
+                    state["first_finish_time"] = time.time()
+            state["finished"] += 1
+            condition.notify_all()
+
+    start_time = time.time()
+    threads = [threading.Thread(target=run_probe, args=(url,), daemon=True) for url in urls]
+    for thread in threads:
+        thread.start()
+
+    with condition:
+        while state["finished"] < len(urls):
+            deadline = start_time + timeout
+            if state["first_finish_time"] is not None:
+                # Anything still probing after twice the winner's time is slower
+                deadline = min(deadline, state["first_finish_time"] + (state["first_finish_time"] - start_time))
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            condition.wait(remaining)
+        ranked = sorted(results.items(), key=lambda result: -result[1])
+    stop.set()
+    return ranked
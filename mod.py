@@ -1,16 +1,53 @@
+import concurrent.futures
+import hashlib
 import json
-import re
 import time
-import requests
 import os
 import yaml
 import threading
 
+import http_session
+from cache_manager import CacheManager
+from cache_registry import CacheRegistry
+from download_scheduler import DownloadScheduler
+from mirror_race import MirrorStats, race_mirrors
+from version_match import compile_version_pattern
+
 
 class Mod:
     # Class-wide lock for shared resources
     class_lock = threading.Lock()
     nexus_api_key = None
+    # Shared DownloadScheduler used by start_download_async, see get_scheduler()
+    scheduler = None
+    # Listeners called with a DownloadProgress for every mod, see add_global_progress_listener()
+    progress_listeners = []
+    # Seconds between progress updates sent to listeners
+    progress_interval = 0.25
+
+    STATE_QUEUED = "queued"
+    STATE_DOWNLOADING = "downloading"
+    STATE_COMPLETE = "complete"
+    STATE_FAILED = "failed"
+    # Base url for Google Drive download requests, can be pointed at a stub server for testing
+    google_drive_url = "https://drive.google.com"
+
+    # Large downloads are split into this many parallel byte ranges when the
+    # server supports it. Files smaller than download_segment_min_size per
+    # segment use a single stream.
+    download_segments = 4
+    download_segment_min_size = 16 * 1024 * 1024
+    download_chunk_size = 64 * 1024
+
+    # When a mod lists several Google Drive mirrors, probe the first
+    # mirror_race_probe_bytes of up to mirror_race_candidates of them at once
+    # and download from the fastest
+    mirror_racing = True
+    mirror_race_candidates = 3
+    mirror_race_probe_bytes = 512 * 1024
+    mirror_race_timeout = 15.0
+    # Seconds between saving the progress of a download so it can be resumed
+    partial_save_interval = 2.0
 
     '''
     Mod schema is like:
@@ -29,33 +66,106 @@ class Mod:
     instructions-helpful: |
     Note that you are using a UNP BHUNP body replacer.
     '''
+    __slots__ = ["_config", "_config_loader", "record", "name", "cache_folder", "_logger", "file",
+                 "_download", "_progress_listeners"]
+
     def __init__(self, config, logger, cache_folder):
-        self.config = config
+        self._config = None
+        self._config_loader = None
+        self.record = None
         self.name = None
         self.cache_folder = cache_folder
-        self.logger = logger
-
-        self.download_failed = False
-        self.download_complete = False
-        self.download_progress = 0.0
-        self.download_in_progress = False
+        self._logger = logger
         self.file = None
 
-        self.lock = threading.Lock()
-        
+        # Created when a download starts or a listener is added, see _get_download()
+        self._download = None
+        self._progress_listeners = None
+
+        self._validate_config(config)
+        self.name = config["name"]
+        self._config = config
+
+    @classmethod
+    def from_record(cls, record, config_loader, logger, cache_folder):
+        # Compact catalog mod: only the ModRecord is kept in memory, the full
+        # config is loaded with config_loader(record) when it is first needed
+        mod = cls.__new__(cls)
+        mod._config = None
+        mod._config_loader = config_loader
+        mod.record = record
+        mod.name = record.name
+        mod.cache_folder = cache_folder
+        mod._logger = logger
+        mod.file = None
+        mod._download = None
+        mod._progress_listeners = None
+        return mod
+
+    def _validate_config(self, config):
         if 'name' not in config:
-            logger("Mod does not have a name")
+            self.logger("Mod does not have a name")
             raise Exception("Mod does not have a name")
-        self.name = config["name"]
+        name = config["name"]
 
         if 'description' not in config:
-            logger("Mod {} does not have a description".format(self.name))
-            raise Exception("Mod {} does not have a description".format(self.name))
+            self.logger("Mod {} does not have a description".format(name))
+            raise Exception("Mod {} does not have a description".format(name))
         if 'install' not in config:
-            logger("Mod {} does not have a install".format(self.name))
-            raise Exception("Mod {} does not have a install".format(self.name))
-        
-        self.description = config["description"]
+            self.logger("Mod {} does not have a install".format(name))
+            raise Exception("Mod {} does not have a install".format(name))
+
+    @property
+    def official_website(self):
+        # The mod's website, or None, without loading a compact mod's config
+        if self.record is not None:
+            return self.record.official_website
+        website = self.config.get("official_website")
+        return website if isinstance(website, str) else None
+
+    @property
+    def installs(self):
+        # Install entries, without loading a compact mod's config
+        if self.record is not None:
+            return self.record.installs
+        return self.config["install"]
+
+    @property
+    def download_urls(self):
+        # Download urls of all install entries, without loading a compact mod's config
+        if self.record is not None:
+            return self.record.urls
+        urls = []
+        for install in self.installs:
+            urls += install.get("urls", [])
+        return urls
+
+    @property
+    def logger(self):
+        # With a StructuredLog channel, messages are tagged with the mod name
+        if self.name is not None and hasattr(self._logger, "for_mod"):
+            return self._logger.for_mod(self.name)
+        return self._logger
+
+    @property
+    def config(self):
+        # Read into a local, another thread may unload the config meanwhile
+        config = self._config
+        if config is None:
+            config = self._config_loader(self.record)
+            self._validate_config(config)
+            self._config = config
+        return config
+
+    def unload_config(self):
+        # Drop the full config of a compact catalog mod once a one-off use of it
+        # is done, it is reloaded when needed again
+        if self._config_loader is not None:
+            self._config = None
+
+    @property
+    def description(self):
+        return self.config["description"]
     
     def _is_version_check_satisfied(self, version_pattern, version):
         # game_version can be formated like:
@@ -63,81 +173,42 @@ class Mod:
         #   1.6.629.0+
         #   1.6.*.*
         #   1.6.629.0-1.6.650.0
-        def version_to_tuple(v):
-            return tuple(map(int, (v.split("+")[0].split("-")[0].split("*")[0].split("."))))
+        # Patterns are compiled once and cached, see version_match.py
+        return compile_version_pattern(version_pattern).matches(version)
 
-        version_tuple = version_to_tuple(version)
-        
-        if "+" in version_pattern:
-            base_version = version_to_tuple(version_pattern)
-            return version_tuple >= base_version
-        elif "-" in version_pattern:
-            start_version, end_version = map(version_to_tuple, version_pattern.split("-"))
-            return start_version <= version_tuple <= end_version
-        elif "*" in version_pattern:
-            pattern = version_pattern.replace('*', '\d+')
-            return re.match(pattern, version) is not None
-        else:
-            return version_tuple == version_to_tuple(version_pattern)
+    def get_install_for_version(self, game_version):
+        # The first install entry that supports this game version, or None
+        for install in self.installs:
+            if self._is_version_check_satisfied(install['game_version'], game_version):
+                return install
+        return None
 
     def is_compatable(self, game_version):
-        for install in self.config['install']:
-            if self._is_version_check_satisfied(install['game_version'], game_version):
-                return True
-        return False
+        return self.get_install_for_version(game_version) is not None
 
     def _google_drive_download(self, url):
         # Download the file to the cache folder
         self.logger("Downloading {} from {}".format(self.name, url))
 
         # Check if the file is already downloaded and registered in cache
-        registry = {}
-        with self.class_lock:
-            if os.path.exists(os.path.join(self.cache_folder, "cache_registry.json")):
-                registry = json.load(open(os.path.join(self.cache_folder, "cache_registry.json"), "rb"))
-        if url in registry:
+        registry = CacheRegistry.for_folder(self.cache_folder, self.logger)
+        entry = registry.lookup(url)
+        if entry is not None:
             # Check if the file exists
-            filename = registry[url]["filename"]
+            filename = entry["filename"]
             if os.path.exists(os.path.join(self.cache_folder, filename)):
                 self.logger("File {} already downloaded, using cached value.".format(filename))
+                registry.touch(entry["content_hash"])
                 self.file = os.path.join(self.cache_folder, filename)
                 return True
             else:
                 self.logger("File in cache registry, but file it points to of {} not found".format(filename))
-                del registry[url]
-                with self.class_lock:
-                    json.dump(registry, open(os.path.join(self.cache_folder, "cache_registry.json"), "w"), indent=4)
+                registry.remove(url)
 
         try:
-            file_id = url.split("/")[5]
-            response = requests.get("https://drive.google.com/uc?export=download&id={}".format(file_id), stream=True)
-            if response.status_code != 200:
-                self.logger(f"Google drive download failed for mod {self.name} for url {url}.")
-                return False
-            if "Content-Disposition" in response.headers and "attachment" in response.headers["Content-Disposition"]:
-                # Successfully started download!
-                pass
-            elif response.headers['Content-Type'] == "text/html; charset=utf-8":
-                # UX page warning that the file is too large. Need another step to proceed to the download.
-                # https://drive.usercontent.google.com/download?id={}&export=download&authuser=0&confirm=t&at=APZUnTUmBxP8DVcYX77oD3S2xiaX%3A1703459418376
-                # Need to extract the at token from HTML, eg:
-                #       <input type="hidden" name="at" value="APZUnTVXYq1G3fxwMpBboNW9UrP4:1703459695692"></form>
-                token = response.text.split("<form>")[-1].split("</form>")[0].split("name=\"at\"")[-1].split("value=")[-1].split('"')[1]
-                if token is None:
-                    self.logger(f"Google drive download large file download failed for mod {self.name} for url {url}.")
-                    return False
-                
-                response = requests.get("https://drive.google.com/uc?export=download&id={}&authuser=0&confirm=t&at={}".format(file_id, token), stream=True)
-
-                if response.status_code != 200:
-                    self.logger(f"Google drive download large file failed for mod {self.name} for url {url}.")
-                    return False
-                if "Content-Disposition" not in response.headers or "attachment" not in response.headers["Content-Disposition"]:
-                    self.logger(f"Unexpected content disposition for url {url}.")
-                    return False
-            else:
-                self.logger(f"Unexpected content type {response.headers['Content-Type']} for url {url}.")
-                self.logger(response.headers)
+            session = http_session.get_session()
+            response = self._google_drive_open(url, session)
+            if response is None:
                 return False
             
             # Load the filename
@@ -155,49 +226,68 @@ class Mod:
                     filesize = int(value)
             
             if response.status_code == 200:
-                # Once per second, update the download progress variable
-                self.download_progress = 0.0
+                # Progress is reported to listeners as the download runs
+                download_start_time = time.time()
+                self._report_progress(0, filesize, force=True)
                 self.logger("Downloading {} {:.2f}%".format(filename, self.download_progress * 100.0))
 
-                # Download the file
-                last_log_time = time.time()
-                progress = 0
-                with open(os.path.join(self.cache_folder, filename + ".partial"), 'wb') as f:
-                    for chunk in response.iter_content(1024):
-                        f.write(chunk)
-                        # Update progress
-                        self.download_progress = float(f.tell()) / filesize
-                        # Log the download progress every 5 seconds
-                        if time.time() - last_log_time > 5.0:
-                            self.logger("Downloading {} {:.2f}%".format(filename, self.download_progress * 100.0))
-                            last_log_time = time.time()
+                # Download the file, resuming an interrupted download or in parallel
+                # byte ranges if the server supports it
+                # The partial file is named per url so concurrent downloads of the
+                # same archive from different urls never share a file
+                partial_path = os.path.join(self.cache_folder, f"{filename}.{CacheRegistry.url_key(url)[:16]}.partial")
+                download_url = response.url
+                validators = self._response_validators(response, filesize)
+                resume_segments = self._load_partial_segments(partial_path, validators)
+                if resume_segments is not None or self._can_download_segmented(response, filesize):
+                    response.close()
+                    if resume_segments is not None:
+                        downloaded = sum(segment[2] for segment in resume_segments)
+                        self.logger(f"Resuming {filename} from {downloaded} of {filesize} bytes")
+                    content_hash = None
+                    if not self._download_segmented(download_url, partial_path, filename, filesize, validators, resume_segments):
+                        self.logger(f"Ranged requests not honored for {filename}, restarting with a single stream.")
+                        response = session.get(download_url, stream=True)
+                        if response.status_code != 200:
+                            self.logger(f"Google drive download failed for mod {self.name} for url {url}.")
+                            return False
+                        content_hash = self._download_single_stream(response, partial_path, filename, filesize, validators)
+                else:
+                    content_hash = self._download_single_stream(response, partial_path, filename, filesize, validators)
                 self.logger("Downloading {} {:.2f}%".format(filename, 100.0))
-                
-                # Use the hash of the url in the cache registry so that multiple game versions can be supported
-                url_hash = hex(hash(url))[2:]
-
-                # Rename the file
-                extension = filename.split(".")[-1]
-                filename_without_extension = ".".join(filename.split(".")[:-1])
-                filename_final = f"{filename_without_extension}_{url_hash}.{extension}"
-                self.logger(f"Renaming {filename} to {filename_final}")
-                
-                os.rename(os.path.join(self.cache_folder, filename + ".partial"), os.path.join(self.cache_folder, filename_final))
+                if filesize:
+                    MirrorStats.for_folder(self.cache_folder, self.logger).record(url, filesize / max(time.time() - download_start_time, 1e-6))
+
+                # Ranged downloads arrive out of order, so hash their content in one pass afterwards
+                if content_hash is None:
+                    content_hash = CacheRegistry.hash_file(partial_path)
+                if filesize is None:
+                    filesize = os.path.getsize(partial_path)
+
+                existing = registry.lookup_content(content_hash)
+                if existing is not None and os.path.exists(os.path.join(self.cache_folder, existing["filename"])):
+                    # The same archive is already cached, eg. downloaded from another mirror
+                    self.logger(f"Content of {filename} is already cached as {existing['filename']}")
+                    os.remove(partial_path)
+                    filename_final = existing["filename"]
+                else:
+                    if existing is not None:
+                        registry.remove_content(content_hash)
+
+                    # Name the file by its content hash so the same archive is stored once
+                    extension = filename.split(".")[-1]
+                    filename_without_extension = ".".join(filename.split(".")[:-1])
+                    filename_final = f"{filename_without_extension}_{content_hash[:16]}.{extension}"
+                    self.logger(f"Renaming {filename} to {filename_final}")
+                    os.replace(partial_path, os.path.join(self.cache_folder, filename_final))
 
                 # Register the file in "cache_registry.json"
-                registry = {}
-                with self.class_lock:
-                    if os.path.exists(os.path.join(self.cache_folder, "cache_registry.json")):
-                        registry = json.load(open(os.path.join(self.cache_folder, "cache_registry.json"), "rb"))
-                registry[url] = {
-                    "name": self.name,
-                    "filename": filename_final,
-                    "filesize": filesize,
-                }
-                with self.class_lock:
-                    json.dump(registry, open(os.path.join(self.cache_folder, "cache_registry.json"), "w"), indent=4)
+                registry.register(url, self.name, content_hash, filename_final, filesize)
                 self.logger("Registered {} in cache_registry.json".format(self.name))
                 self.file = os.path.join(self.cache_folder, filename_final)
+
+                # Keep the cache folder within its size budget
+                CacheManager.for_folder(self.cache_folder, self.logger).enforce_budget(self.logger)
                 return True
             else:
                 self.logger(f"Google drive download failed for mod {self.name} for url {url}.")
@@ -205,9 +295,254 @@ class Mod:
         except Exception as e:
             self.logger("Failed to download {} from {}".format(self.name, url))
             self.logger(e)
-            self.download_failed = True
             return False
 
+    def _google_drive_open(self, url, session):
+        # Start a streamed download of a Google Drive file url, going through the
+        # large file confirm page if needed. Returns the response with the file
+        # as an attachment, or None if the download could not be started.
+        file_id = url.split("/")[5]
+        response = session.get("{}/uc?export=download&id={}".format(Mod.google_drive_url, file_id), stream=True)
+        if response.status_code != 200:
+            self.logger(f"Google drive download failed for mod {self.name} for url {url}.")
+            return None
+        if "Content-Disposition" in response.headers and "attachment" in response.headers["Content-Disposition"]:
+            # Successfully started download!
+            pass
+        elif response.headers['Content-Type'] == "text/html; charset=utf-8":
+            # UX page warning that the file is too large. Need another step to proceed to the download.
+            # https://drive.usercontent.google.com/download?id={}&export=download&authuser=0&confirm=t&at=APZUnTUmBxP8DVcYX77oD3S2xiaX%3A1703459418376
+            # Need to extract the at token from HTML, eg:
+            #       <input type="hidden" name="at" value="APZUnTVXYq1G3fxwMpBboNW9UrP4:1703459695692"></form>
+            token = response.text.split("<form>")[-1].split("</form>")[0].split("name=\"at\"")[-1].split("value=")[-1].split('"')[1]
+            if token is None:
+                self.logger(f"Google drive download large file download failed for mod {self.name} for url {url}.")
+                return None
+            
+            response = session.get("{}/uc?export=download&id={}&authuser=0&confirm=t&at={}".format(Mod.google_drive_url, file_id, token), stream=True)
+
+            if response.status_code != 200:
+                self.logger(f"Google drive download large file failed for mod {self.name} for url {url}.")
+                return None
+            if "Content-Disposition" not in response.headers or "attachment" not in response.headers["Content-Disposition"]:
+                self.logger(f"Unexpected content disposition for url {url}.")
+                return None
+        else:
+            self.logger(f"Unexpected content type {response.headers['Content-Type']} for url {url}.")
+            self.logger(response.headers)
+            return None
+        return response
+
+    def _can_download_segmented(self, response, filesize):
+        # Only split downloads that are large enough to benefit and where the
+        # server advertises byte range support
+        if Mod.download_segments <= 1 or filesize is None:
+            return False
+        if filesize < Mod.download_segment_min_size:
+            return False
+        return response.headers.get("Accept-Ranges", "").lower() == "bytes"
+
+    def _response_validators(self, response, filesize):
+        # Validators used to check that a partial download still matches the file on the server
+        return {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "filesize": filesize,
+        }
+
+    def _load_partial_segments(self, partial_path, validators):
+        # Returns the [start, end, done] segments of an interrupted download that
+        # can be resumed, or None if there is nothing to resume or the file on the
+        # server no longer matches the partial file.
+        meta_path = partial_path + ".json"
+        if validators["filesize"] is None or not os.path.exists(partial_path) or not os.path.exists(meta_path):
+            return None
+        try:
+            with open(meta_path, "r", encoding="utf8") as f:
+                meta = json.load(f)
+        except Exception as e:
+            self.logger(f"Ignoring unreadable partial download info {meta_path}: {e}")
+            return None
+
+        if meta.get("filesize") != validators["filesize"]:
+            self.logger(f"Partial download {partial_path} has a different size than the server file, restarting.")
+            return None
+        for key in ["etag", "last_modified"]:
+            if meta.get(key) is not None and validators[key] is not None and meta[key] != validators[key]:
+                self.logger(f"Partial download {partial_path} is out of date ({key} changed), restarting.")
+                return None
+        return [list(segment) for segment in meta["segments"]]
+
+    def _save_partial_segments(self, partial_path, validators, segments):
+        # Record how far each segment got so an interrupted download can resume
+        meta = dict(validators)
+        meta["segments"] = segments
+        temp_path = partial_path + ".json.tmp"
+        with open(temp_path, "w", encoding="utf8") as f:
+            json.dump(meta, f)
+        os.replace(temp_path, partial_path + ".json")
+
+    def _remove_partial_segments(self, partial_path):
+        if os.path.exists(partial_path + ".json"):
+            os.remove(partial_path + ".json")
+
+    def _download_single_stream(self, response, partial_path, filename, filesize, validators):
+        # Stream the whole response body into the partial file, returning the SHA-256
+        # of the content. The file is written unbuffered so the recorded progress
+        # never runs ahead of what is on disk.
+        segments = [[0, filesize - 1, 0]] if filesize else None
+        if segments:
+            self._save_partial_segments(partial_path, validators, segments)
+        else:
+            self._remove_partial_segments(partial_path)
+        last_log_time = time.time()
+        last_save_time = time.time()
+        hasher = hashlib.sha256()
+        with open(partial_path, 'wb', buffering=0) as f:
+            for chunk in response.iter_content(Mod.download_chunk_size):
+                f.write(chunk)
+                hasher.update(chunk)
+                # Update progress
+                if filesize:
+                    segments[0][2] += len(chunk)
+                    self._report_progress(segments[0][2], filesize)
+                    if time.time() - last_save_time > Mod.partial_save_interval:
+                        self._save_partial_segments(partial_path, validators, segments)
+                        last_save_time = time.time()
+                # Log the download progress every 5 seconds
+                if time.time() - last_log_time > 5.0:
+                    self.logger("Downloading {} {:.2f}%".format(filename, self.download_progress * 100.0))
+                    last_log_time = time.time()
+        self._remove_partial_segments(partial_path)
+        if filesize:
+            self._report_progress(segments[0][2], filesize, force=True)
+        return hasher.hexdigest()
+
+    def _download_segmented(self, url, partial_path, filename, filesize, validators, segments=None):
+        # Fetch the file as byte ranges in parallel, each written at its offset in a
+        # preallocated partial file. Passing the segments of an interrupted download
+        # continues each one where it stopped. Returns False if the server ignores
+        # the Range header or the file changed (If-Range), so the caller can restart
+        # with a single stream.
+        # The job holds one connection to its host, the other segments use the
+        # extra connections the scheduler has free for that host, also when url
+        # is a redirect to another one; segments beyond that wait for a
+        # connection of this download.
+        scheduler = Mod.get_scheduler()
+        extra_connections = scheduler.acquire_connections(Mod.download_segments - 1)
+        try:
+            return self._download_segments(url, partial_path, filename, filesize, validators, segments,
+                                           1 + extra_connections)
+        finally:
+            scheduler.release_connections(extra_connections)
+
+    def _download_segments(self, url, partial_path, filename, filesize, validators, segments, connections):
+        if segments is None:
+            segment_count = min(connections, max(1, filesize // Mod.download_segment_min_size))
+            segment_size = filesize // segment_count
+            segments = []
+            for i in range(segment_count):
+                start = i * segment_size
+                end = filesize - 1 if i == segment_count - 1 else start + segment_size - 1
+                segments.append([start, end, 0])
+            self.logger(f"Downloading {filename} in {segment_count} parallel segments")
+
+            # Preallocate the partial file so every segment can write at its offset
+            self._remove_partial_segments(partial_path)
+            with open(partial_path, 'wb') as f:
+                f.truncate(filesize)
+        else:
+            with open(partial_path, 'r+b') as f:
+                f.truncate(filesize)
+        self._save_partial_segments(partial_path, validators, segments)
+
+        # Ask the server to ignore the range and send the whole file if it changed
+        if_range = validators["etag"] or validators["last_modified"]
+
+        progress_lock = threading.Lock()
+        stop = threading.Event()
+        state = {"ranges_ignored": False, "error": None}
+
+        def download_segment(segment):
+            try:
+                start, end, done = segment
+                if start + done > end:
+                    return
+                headers = {"Range": f"bytes={start + done}-{end}"}
+                if if_range:
+                    headers["If-Range"] = if_range
+                with http_session.get_session().get(url, headers=headers, stream=True) as response:
+                    if response.status_code == 200:
+                        # The server sent the whole file instead of our range
+                        state["ranges_ignored"] = True
+                        stop.set()
+                        return
+                    if response.status_code != 206:
+                        raise Exception(f"Unexpected status code {response.status_code} for range {start + done}-{end} of {filename}")
+
+                    with open(partial_path, 'r+b', buffering=0) as f:
+                        f.seek(start + done)
+                        remaining = end - start - done + 1
+                        for chunk in response.iter_content(Mod.download_chunk_size):
+                            if stop.is_set():
+                                return
+                            chunk = chunk[:remaining]
+                            f.write(chunk)
+                            remaining -= len(chunk)
+                            with progress_lock:
+                                segment[2] += len(chunk)
+                            if remaining <= 0:
+                                break
+                if remaining > 0:
+                    raise Exception(f"Connection closed with {remaining} bytes left in range {start}-{end} of {filename}")
+            except Exception as e:
+                with progress_lock:
+                    if state["error"] is None:
+                        state["error"] = e
+                stop.set()
+
+        pending = list(segments)
+
+        def download_pending():
+            # One connection, downloading segments until none are left
+            while not stop.is_set():
+                with progress_lock:
+                    if not pending:
+                        return
+                    segment = pending.pop(0)
+                download_segment(segment)
+
+        threads = [threading.Thread(target=download_pending) for _ in range(min(connections, len(segments)))]
+        for thread in threads:
+            thread.start()
+
+        # Report progress and record it for resuming from this thread while the segments download
+        last_log_time = time.time()
+        last_save_time = time.time()
+        while any(thread.is_alive() for thread in threads):
+            for thread in threads:
+                thread.join(0.25)
+            with progress_lock:
+                downloaded = sum(segment[2] for segment in segments)
+                snapshot = [segment[:] for segment in segments]
+            self._report_progress(downloaded, filesize)
+            if time.time() - last_save_time > Mod.partial_save_interval:
+                self._save_partial_segments(partial_path, validators, snapshot)
+                last_save_time = time.time()
+            if time.time() - last_log_time > 5.0:
+                self.logger("Downloading {} {:.2f}%".format(filename, self.download_progress * 100.0))
+                last_log_time = time.time()
+
+        if state["ranges_ignored"]:
+            self._remove_partial_segments(partial_path)
+            return False
+        if state["error"] is not None:
+            self._save_partial_segments(partial_path, validators, segments)
+            raise state["error"]
+        self._remove_partial_segments(partial_path)
+        self._report_progress(filesize, filesize, force=True)
+        return True
+
     def _nexus_download(self, url):
         if Mod.nexus_api_key is None:
             # We need to use the browser to get the api key
@@ -258,56 +593,405 @@ class Mod:
 
         pass
 
+    def _probe_mirror(self, url, stop):
+        # Read the first bytes of a Google Drive url and return the throughput in bytes per second
+        session = http_session.get_session()
+        start_time = time.time()
+        response = self._google_drive_open(url, session)
+        if response is None:
+            return None
+        received = 0
+        try:
+            for chunk in response.iter_content(Mod.download_chunk_size):
+                received += len(chunk)
+                if received >= Mod.mirror_race_probe_bytes or stop.is_set():
+                    break
+        finally:
+            response.close()
+        if received == 0:
+            return None
+        return received / max(time.time() - start_time, 1e-6)
+
+    def probe_download_size(self, urls):
+        # Size in bytes of the download from the first url that reports it, or
+        # None. Only the response headers are read.
+        session = http_session.get_session()
+        for url in urls:
+            if not url.startswith("https://drive.google.com"):
+                continue
+            try:
+                response = self._google_drive_open(url, session)
+            except Exception:
+                continue
+            if response is None:
+                continue
+            response.close()
+            if "Content-Length" in response.headers:
+                return int(response.headers["Content-Length"])
+        return None
+
+    def _order_urls(self, urls):
+        # Try the mirrors that were fastest in earlier runs first. If several
+        # Google Drive mirrors are listed, race their first bytes and start
+        # with the fastest one, keeping the rest as fallbacks.
+        stats = MirrorStats.for_folder(self.cache_folder, self.logger)
+        urls = stats.order(urls)
+        if not Mod.mirror_racing:
+            return urls
+
+        registry = CacheRegistry.for_folder(self.cache_folder, self.logger)
+        if any(registry.lookup(url) is not None for url in urls):
+            # Already downloaded, no need to pick a mirror
+            return urls
+        candidates = [url for url in urls if url.startswith("https://drive.google.com")][:Mod.mirror_race_candidates]
+        if len(candidates) < 2:
+            return urls
+
+        # The probes count against the scheduler's connections per host: the
+        # first one uses this job's connection, the others what is free
+        scheduler = Mod.get_scheduler()
+        extra_connections = scheduler.acquire_connections(len(candidates) - 1)
+        try:
+            candidates = candidates[:1 + extra_connections]
+            if len(candidates) < 2:
+                return urls
+            self.logger(f"Racing {len(candidates)} mirrors for mod {self.name}")
+            ranked = race_mirrors(candidates, self._probe_mirror, Mod.mirror_race_timeout)
+        finally:
+            scheduler.release_connections(extra_connections)
+        for url, throughput in ranked:
+            stats.record(url, throughput)
+        if len(ranked) > 0:
+            self.logger(f"Fastest mirror for mod {self.name} is {ranked[0][0]} at {ranked[0][1] / 1024 / 1024:.2f} MB/s")
+        winners = [url for url, _ in ranked]
+        return winners + [url for url in urls if url not in winners]
+
     def _download_urls(self, urls):
         # Download the file
-        with self.lock:
-            self.download_in_progress = True
-            self.download_complete = False
-            self.download_failed = False
-            self.download_progress = 0.0
-        for url in urls:
-            if url.startswith("https://drive.google.com"):
-                if self._google_drive_download(url):
-                    with self.lock:
-                        self.download_complete = True
-                        self.download_failed = False
-                        self.download_in_progress = False
-                    return True
-            elif url.startswith("https://www.nexusmods.com"):
-                # Nexus
-                raise Exception(f"Nexus download not implemented for mod {self.name} for url {url}.")
-            else:
-                raise Exception(f"Unknown download url type {url} for mod {self.name}. Must be a google drive or nexus url.")
+        self._set_download_state(Mod.STATE_DOWNLOADING)
+        try:
+            urls = self._order_urls(urls)
+            for url in urls:
+                self._set_download_url(url)
+                if url.startswith("https://drive.google.com"):
+                    if self._google_drive_download(url):
+                        self._set_download_state(Mod.STATE_COMPLETE)
+                        return True
+                elif url.startswith("https://www.nexusmods.com"):
+                    # Nexus
+                    raise Exception(f"Nexus download not implemented for mod {self.name} for url {url}.")
+                else:
+                    raise Exception(f"Unknown download url type {url} for mod {self.name}. Must be a google drive or nexus url.")
+        except Exception:
+            # Mark the download as finished so waiters are released, the error
+            # is passed on to the scheduler future
+            self._set_download_state(Mod.STATE_FAILED)
+            raise
         
-        with self.lock:
-            self.download_in_progress = False
-            self.download_failed = True
-            self.download_complete = False
+        self._set_download_state(Mod.STATE_FAILED)
         return False
 
-    def start_download_async(self, game_version):
-        # Find the download for this game version
-        download_urls = None
-        for install in self.config['install']:
-            if self._is_version_check_satisfied(install['game_version'], game_version):
-                download_urls = install['urls']
-                break
+    def _get_download(self):
+        # Per-download state, only created once a mod is downloaded or watched
+        if self._download is None:
+            with Mod.class_lock:
+                if self._download is None:
+                    self._download = DownloadState()
+        return self._download
+
+    # Download flags, readable before any download started
+    @property
+    def download_state(self):
+        return self._download.state if self._download is not None else None
+
+    @property
+    def download_in_progress(self):
+        return self.download_state in [Mod.STATE_QUEUED, Mod.STATE_DOWNLOADING]
+
+    @property
+    def download_complete(self):
+        return self.download_state == Mod.STATE_COMPLETE
+
+    @property
+    def download_failed(self):
+        return self.download_state == Mod.STATE_FAILED
+
+    @property
+    def download_progress(self):
+        return self._download.progress if self._download is not None else 0.0
+
+    @property
+    def download_future(self):
+        return self._download.future if self._download is not None else None
+
+    def _set_download_state(self, state):
+        # Update the download flags, wake up waiters and tell progress listeners
+        download = self._get_download()
+        with download.condition:
+            download.state = state
+            if state in [Mod.STATE_QUEUED, Mod.STATE_DOWNLOADING]:
+                download.progress = 0.0
+                download.bytes = 0
+                download.total_bytes = None
+                download.rate = 0.0
+                download.rate_sample = None
+                download.last_published = 0.0
+                if state == Mod.STATE_QUEUED:
+                    download.url = None
+                    download.attempt = 0
+            elif state == Mod.STATE_COMPLETE:
+                download.progress = 1.0
+            download.condition.notify_all()
+        self._publish_progress()
+
+    def _set_download_url(self, url):
+        # Called before trying each mirror, a second attempt means the first one failed
+        download = self._get_download()
+        with download.lock:
+            download.url = url
+            download.attempt += 1
+            download.bytes = 0
+            download.progress = 0.0
+            download.rate = 0.0
+            download.rate_sample = None
+        self._publish_progress()
+
+    def _report_progress(self, downloaded_bytes, total_bytes, force=False):
+        # Called by the download code as bytes arrive. Tracks a smoothed transfer
+        # rate and publishes progress to listeners at most every progress_interval.
+        now = time.time()
+        download = self._get_download()
+        with download.lock:
+            download.bytes = downloaded_bytes
+            download.total_bytes = total_bytes
+            if total_bytes:
+                download.progress = float(downloaded_bytes) / total_bytes
+            if download.rate_sample is None:
+                download.rate_sample = (now, downloaded_bytes)
+            sample_time, sample_bytes = download.rate_sample
+            if now - sample_time >= Mod.progress_interval:
+                rate = (downloaded_bytes - sample_bytes) / (now - sample_time)
+                download.rate = rate if download.rate == 0.0 else 0.7 * download.rate + 0.3 * rate
+                download.rate_sample = (now, downloaded_bytes)
+            if not force and now - download.last_published < Mod.progress_interval:
+                return
+            download.last_published = now
+        self._publish_progress()
+
+    def get_download_progress(self):
+        # Snapshot of the download as a DownloadProgress
+        download = self._get_download()
+        with download.lock:
+            eta = None
+            if download.total_bytes and download.rate > 0:
+                eta = max(0.0, (download.total_bytes - download.bytes) / download.rate)
+            return DownloadProgress(self, download.state, download.bytes,
+                                    download.total_bytes, download.rate, eta,
+                                    download.url, download.attempt)
+
+    def _publish_progress(self):
+        progress = self.get_download_progress()
+        with Mod.class_lock:
+            listeners = Mod.progress_listeners + (self._progress_listeners or [])
+        for listener in listeners:
+            try:
+                listener(progress)
+            except Exception as e:
+                self.logger(f"ERROR: Download progress listener failed for mod {self.name}: {e}")
+
+    def add_progress_listener(self, callback):
+        # callback(DownloadProgress) is called on the downloading thread for this mod
+        with Mod.class_lock:
+            if self._progress_listeners is None:
+                self._progress_listeners = []
+            self._progress_listeners.append(callback)
+
+    def remove_progress_listener(self, callback):
+        with Mod.class_lock:
+            self._progress_listeners.remove(callback)
+
+    @classmethod
+    def add_global_progress_listener(cls, callback):
+        # callback(DownloadProgress) is called for every mod's download
+        with cls.class_lock:
+            cls.progress_listeners.append(callback)
+
+    @classmethod
+    def remove_global_progress_listener(cls, callback):
+        with cls.class_lock:
+            cls.progress_listeners.remove(callback)
+
+    @classmethod
+    def get_scheduler(cls):
+        # Shared download scheduler, created with default limits on first use
+        with cls.class_lock:
+            if cls.scheduler is None:
+                cls.scheduler = DownloadScheduler()
+            return cls.scheduler
+
+    def start_download_async(self, game_version, required_by_parent=False, install=None, size=None):
+        # Find the download for this game version, unless an install plan
+        # already chose the install entry and knows its size. A mod that is
+        # already queued, downloading or downloaded returns the future of that
+        # download, two jobs must never write the same partial file.
+        future, claimed = self._claim_download()
+        if not claimed:
+            return future
+        try:
+            self._submit_download(game_version, required_by_parent, install, size, future)
+        except Exception as e:
+            self._set_download_state(Mod.STATE_FAILED)
+            future.set_exception(e)
+            raise
+        return future
+
+    def _claim_download(self):
+        # Returns (future, claimed). Marks the mod as queued with a new future
+        # for its download, completed later from the scheduler job, unless it
+        # is already queued, downloading or downloaded; then returns the
+        # future of that download, which every caller shares.
+        download = self._get_download()
+        with download.condition:
+            if download.state in [Mod.STATE_QUEUED, Mod.STATE_DOWNLOADING, Mod.STATE_COMPLETE]:
+                future = download.future
+                if future is None:
+                    future = concurrent.futures.Future()
+                    future.set_result(download.state == Mod.STATE_COMPLETE)
+                self.logger(f"INFO: Download of mod {self.name} is already {download.state}")
+                return future, False
+            download.state = Mod.STATE_QUEUED
+            download.future = concurrent.futures.Future()
+            return download.future, True
+
+    def follow_download(self, source, future):
+        # For mods sharing the file of source's download: queued until that
+        # future finishes, then complete with source's file, or failed
+        follower, claimed = self._claim_download()
+        if not claimed:
+            return follower
+        self._set_download_state(Mod.STATE_QUEUED)
+
+        def on_done(done):
+            if not done.cancelled() and done.exception() is None and source.download_complete:
+                self.file = source.file
+                self._set_download_state(Mod.STATE_COMPLETE)
+                follower.set_result(True)
+            else:
+                self._set_download_state(Mod.STATE_FAILED)
+                error = None if done.cancelled() else done.exception()
+                follower.set_exception(error or Exception(f"Download of mod {source.name} failed"))
+        future.add_done_callback(on_done)
+        return follower
+
+    def _submit_download(self, game_version, required_by_parent, install, size, future):
+        # Queue the download on the scheduler, its job completes future
+        download_install = install if install is not None else self.get_install_for_version(game_version)
         
-        if download_urls is None:
+        if download_install is None:
             self.logger("No download url found for mod {} for game version {}.".format(self.name, game_version))
             raise Exception("No download url found for mod {} for game version {}.".format(self.name, game_version))
+        download_urls = download_install['urls']
+
+        # Never evict this download from the cache while it is in progress
+        cache_manager = CacheManager.for_folder(self.cache_folder, self.logger)
+        cache_manager.pin_urls(download_urls)
         
-        #self._download_urls(download_urls)
-        # Call _download_urls using a thread
-        thread = threading.Thread(target=self._download_urls, args=(download_urls,))
-        thread.start()
+        # Queue _download_urls on the shared download scheduler. The mod counts
+        # as in progress from now on so wait_for_download waits for queued mods.
+        self._set_download_state(Mod.STATE_QUEUED)
+        try:
+            job = Mod.get_scheduler().submit(
+                self._download_urls, download_urls,
+                url=download_urls[0] if len(download_urls) > 0 else None,
+                size=size if size is not None else download_install.get('size'),
+                required=required_by_parent,
+                label=self.name)
+        except Exception:
+            cache_manager.unpin_urls(download_urls)
+            raise
+
+        def on_done(job):
+            cache_manager.unpin_urls(download_urls)
+            if job.cancelled():
+                # Never started, e.g. the scheduler shut down
+                self._set_download_state(Mod.STATE_FAILED)
+                future.cancel()
+            elif job.exception() is not None:
+                future.set_exception(job.exception())
+            else:
+                future.set_result(job.result())
+        job.add_done_callback(on_done)
     
-    def wait_for_download(self):
-        while True:
-            with self.lock:
-                if self.download_in_progress is False:
-                    return self.download_complete
-            time.sleep(0.05)
+    def wait_for_download(self, timeout=None):
+        # Block until the download finished, returns True if it succeeded
+        if self._download is None:
+            return False
+        with self._download.condition:
+            self._download.condition.wait_for(lambda: not self.download_in_progress, timeout)
+            return self.download_complete
+
+
+class DownloadState:
+    '''
+    Progress and completion state of one Mod's download. Only created once the
+    mod is downloaded, so mods that are never selected stay small.
+    '''
+    __slots__ = ["state", "progress", "bytes", "total_bytes", "rate", "rate_sample",
+                 "last_published", "url", "attempt", "future", "lock", "condition"]
+
+    def __init__(self):
+        self.state = None
+        self.progress = 0.0
+        self.bytes = 0
+        self.total_bytes = None
+        self.rate = 0.0
+        self.rate_sample = None
+        self.last_published = 0.0
+        self.url = None
+        self.attempt = 0
+        self.future = None
+        self.lock = threading.Lock()
+        self.condition = threading.Condition(self.lock)
+
+
+class DownloadProgress:
+    '''
+    Snapshot of a mod download passed to progress listeners.
+    - mod: the Mod being downloaded
+    - state: one of Mod.STATE_QUEUED, STATE_DOWNLOADING, STATE_COMPLETE, STATE_FAILED
+    - downloaded_bytes / total_bytes: bytes so far and file size (None if unknown)
+    - rate: smoothed transfer rate in bytes per second
+    - eta: estimated seconds left, or None if unknown
+    - url: the mirror being downloaded from, or None before the first one
+    - attempt: number of mirrors tried so far, more than 1 means retrying
+    '''
+    def __init__(self, mod, state, downloaded_bytes, total_bytes, rate, eta, url=None, attempt=0):
+        self.mod = mod
+        self.state = state
+        self.downloaded_bytes = downloaded_bytes
+        self.total_bytes = total_bytes
+        self.rate = rate
+        self.eta = eta
+        self.url = url
+        self.attempt = attempt
+
+
+def wait_all(mods, timeout=None):
+    # Wait for the downloads of all mods. Returns True if all of them succeeded.
+    deadline = None if timeout is None else time.time() + timeout
+    success = True
+    for mod in mods:
+        remaining = None if deadline is None else max(0.0, deadline - time.time())
+        if not mod.wait_for_download(remaining):
+            success = False
+    return success
+
+
+def as_completed(mods, timeout=None):
+    # Yield mods as their downloads finish, whether they succeeded or failed
+    futures = {mod.download_future: mod for mod in mods if mod.download_future is not None}
+    for future in concurrent.futures.as_completed(futures, timeout):
+        yield futures[future]
 
 """
 # test google download
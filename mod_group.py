@@ -1,4 +1,4 @@
-import random
+from mod_group_resolver import ModGroupResolver
 
 
 class ModGroup:
@@ -56,78 +56,10 @@ class ModGroup:
         - parent: the parent item id
         - iid: the item id
         - values: a tuple of (name, description)
+        - tags: the tags of the entry
+        Nested groups are resolved through ModGroupResolver, see mod_group_resolver.py.
         '''
         if "mods" not in self.config:
             return []
-        
-        results = []
-        if mod_list_to_process == None:
-            # Add an entry for ourself
-            iid = random.randint(0, 1000000000)
-            iid_to_name[iid] = self.name
-            result = {
-                "parent": parent_iid,
-                "iid": iid,
-                "values": (self.name, self.description),
-                "tags": ["TEST"],
-            }
-            results.append(result)
-            parent_iid = iid
-        
-        # Process the mod list
-        mod_list_to_process = mod_list_to_process or self.config["mods"]
-        for mod_list_entry in mod_list_to_process:
-            additional_results = []
-            additional_results_modgroup = None
-            iid = None
-
-            tags = []
-            if "tags" in mod_list_entry:
-                tags = mod_list_entry["tags"]
-            
-            if 'section' in mod_list_entry:
-                # This is a section
-                section = mod_list_entry
-                iid = random.randint(0, 1000000000)
-                iid_to_name[iid] = mod_list_entry["section"]
-                result = {
-                    "parent": parent_iid,
-                    "iid": iid,
-                    "values": ("--- " + section["section"] + " ---", section["description"] or ""),
-                    "tags": tags,
-                }
-                additional_results.append(result)
-                # Process the mods in this section
-                additional_results += self.get_tree_data(iid, parent_checked, mods, mod_groups, iid_to_name, section["mods"])
-
-            elif mod_list_entry["name"] in mods:
-                # This is a mod, add it to the list
-                mod = mods[mod_list_entry['name']]
-                iid = random.randint(0, 1000000000)
-                iid_to_name[iid] = mod.name
-                result = {
-                    "parent": parent_iid,
-                    "iid": iid,
-                    "values": (mod.name, mod.description),
-                    "tags": tags,
-                }
-                additional_results.append(result)
-            
-            elif mod_list_entry["name"] in mod_groups:
-                # This is a mod group
-                mod_group = mod_groups[mod_list_entry['name']]
-                additional_results_modgroup = mod_group
-            
-            # Add to the results
-            results += additional_results
-
-            # Now process the children if needed
-            checked = parent_checked
-            if "unchecked" in tags:
-                checked = False
-            if "checked" in tags:
-                checked = True
-            if additional_results_modgroup:
-                results += additional_results_modgroup.get_tree_data(parent_iid, checked, mods, mod_groups, iid_to_name)
-            
-        return results
\ No newline at end of file
+        resolver = ModGroupResolver(mods, mod_groups, self.logger)
+        return resolver.tree_rows(self.name, iid_to_name, parent_iid)
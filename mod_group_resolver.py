@@ -0,0 +1,122 @@
+import collections
+import hashlib
+
+# Immutable node of a resolved mod group graph.
+# - kind: "group", "section" or "mod"
+# - name: group, section or mod name
+# - description: text shown next to the name, None for compact catalog mods
+#   whose description is only loaded when their row is shown
+# - tags: tuple of tags from the entry that references this node
+# - children: tuple of child ResolvedNode, empty for mods
+ResolvedNode = collections.namedtuple("ResolvedNode", ["kind", "name", "description", "tags", "children"])
+
+
+class ModGroupResolver:
+    '''
+    Flattens the mod group / section / mod graph into an immutable DAG.
+
+    Each mod group is resolved once and the resulting node is shared by every
+    place that references it, so large groups that reuse "Skyrim Core
+    Dependencies" many times expand in linear time. A group that includes
+    itself, directly or through other groups, raises an exception naming the
+    chain of groups. Entries that name neither a mod nor a group are logged
+    and skipped.
+
+    tree_rows() turns a resolved group into rows for the GUI tree with ids
+    derived from the path to each row, so ids are stable between runs. The
+    SelectionEngine is built from the same rows, so the install plan is
+    compiled from the mods selected in this DAG.
+    '''
+    def __init__(self, mods, mod_groups, logger):
+        # mods is a dict of {name: Mod}, mod_groups a dict of {name: ModGroup}
+        self.mods = mods
+        self.mod_groups = mod_groups
+        self.logger = logger
+        self.resolved = {}  # group name -> ResolvedNode
+        self.resolving = []  # chain of group names being resolved, to detect cycles
+
+    def resolve(self, group_name, tags=()):
+        # Resolved node of a mod group. tags are the tags of the entry that
+        # references the group, the children are shared between references.
+        if group_name not in self.resolved:
+            if group_name in self.resolving:
+                chain = self.resolving[self.resolving.index(group_name):] + [group_name]
+                raise Exception(f"Mod group cycle: {' -> '.join(chain)}")
+            if group_name not in self.mod_groups:
+                raise Exception(f"Unknown mod group: {group_name}")
+
+            mod_group = self.mod_groups[group_name]
+            self.resolving.append(group_name)
+            try:
+                children = self._resolve_entries(group_name, mod_group.config["mods"])
+            finally:
+                self.resolving.pop()
+            self.resolved[group_name] = ResolvedNode("group", group_name, mod_group.description, (), children)
+
+        node = self.resolved[group_name]
+        if tuple(tags) != node.tags:
+            node = node._replace(tags=tuple(tags))
+        return node
+
+    def _resolve_entries(self, group_name, entries):
+        children = []
+        for entry in entries or []:
+            tags = tuple(entry.get("tags") or [])
+            if "section" in entry:
+                section_children = self._resolve_entries(group_name, entry.get("mods"))
+                children.append(ResolvedNode("section", entry["section"], entry.get("description") or "", tags, section_children))
+            elif entry.get("name") in self.mods:
+                mod = self.mods[entry["name"]]
+                description = mod.description if mod.record is None else None
+                children.append(ResolvedNode("mod", mod.name, description, tags, ()))
+            elif entry.get("name") in self.mod_groups:
+                children.append(self.resolve(entry["name"], tags))
+            else:
+                self.logger(f"WARNING: Mod group {group_name} references unknown mod or group {entry.get('name')}")
+        return tuple(children)
+
+    @staticmethod
+    def _path_iid(path, used_iids):
+        # Stable integer id from the path of names/positions to a row
+        iid = int(hashlib.sha1("/".join(path).encode("utf8")).hexdigest()[:12], 16)
+        while iid in used_iids:
+            iid += 1
+        used_iids.add(iid)
+        return iid
+
+    def tree_rows(self, group_name, iid_to_name, parent_iid=None):
+        '''
+        Returns an array of dicts that can be used to populate a tree widget. Keys:
+        - parent: the parent item id
+        - iid: the item id
+        - values: a tuple of (name, description)
+        - name: the mod, group or section name
+        - tags: the tags of the entry
+        - kind: "group", "section" or "mod"
+        - describe: True if the description is still to be loaded, it is ""
+          in values until then
+        '''
+        rows = []
+        used_iids = set(iid_to_name.keys())
+
+        def add_rows(node, parent, path):
+            iid = self._path_iid(path, used_iids)
+            iid_to_name[iid] = node.name
+            if node.kind == "section":
+                values = ("--- " + node.name + " ---", node.description)
+            else:
+                values = (node.name, node.description or "")
+            rows.append({
+                "parent": parent,
+                "iid": iid,
+                "values": values,
+                "name": node.name,
+                "tags": list(node.tags),
+                "kind": node.kind,
+                "describe": node.description is None,
+            })
+            for index, child in enumerate(node.children):
+                add_rows(child, iid, path + [f"{index}:{child.name}"])
+
+        add_rows(self.resolve(group_name), parent_iid, [group_name])
+        return rows
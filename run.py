@@ -1,5 +1,10 @@
+import argparse
+import concurrent.futures
+import json
 import os
+import queue
 import sys
+import threading
 from tkinter import filedialog
 import yaml # pip install pyyaml
 from selenium import webdriver # pip install selenium
@@ -12,8 +17,13 @@ import subprocess
 import shutil
 import winreg
 
+from action_graph import ActionGraph
+from run_journal import RunJournal
+from structured_log import StructuredLog
+from variable_template import substitute
+
 class SimpleInstaller:
-    def __init__(self, config, initial_variables={}) -> None:
+    def __init__(self, config, initial_variables={}, resume=False, clear_journal=False) -> None:
         self.config = config
         self.variables = initial_variables
         self.variables.update({
@@ -22,29 +32,96 @@ class SimpleInstaller:
             'MO2_EXE_PATH': None,
             'MO2_APPDATA_PATH': None,
         })
-        self.log_file = None
-        if "about" in config and "debug_log" in config["about"]:
-            # Open with utf8
-            self.log_file = open(config["about"]["debug_log"], "w", encoding="utf8")
+        # about: debug_log is written as JSON lines, see structured_log.py
+        about = config.get("about") or {}
+        self.log = StructuredLog(about.get("debug_log"), console_verbose=about.get("verbose", False) == True)
+        self.log_installer = self.log.channel("installer")
+
+        # With about: parallel_actions: true, run() runs independent actions at
+        # the same time on action_workers threads, see _run_actions_parallel
+        self.parallel_actions = about.get("parallel_actions", False) == True
+        self.action_workers = about.get("action_workers", 4)
+        self.variables_lock = threading.Lock()
+        # With resume (--resume or about: resume: true) finished actions are
+        # journaled to about: journal, so a failed run can be retried from where
+        # it stopped, see run_journal.py. clear_journal (--clear-journal) deletes
+        # the journal of an earlier run first
+        journal_path = about.get("journal", "run_journal.json")
+        if clear_journal and os.path.exists(journal_path):
+            self._log(f"INFO: Deleting run journal {journal_path}")
+            os.remove(journal_path)
+        resume = resume or about.get("resume", False) == True
+        self.journal = RunJournal(journal_path, self._log) if resume else None
+        # Queue of dialogs for the main thread while actions run on workers
+        self.ui_requests = None
+        # While the graph runs: the node each worker runs, an Event per node
+        # set once it finished, and whether the run is stopping, see _ui
+        self.node_local = threading.local()
+        self.finished_nodes = {}
+        self.stopping = False
+
+        # Wall time, CPU time and bytes of every action of run(), written to
+        # about: timing_report as JSON, see _write_timing_report
+        self.timing_report_path = about.get("timing_report", "run_timing.json")
+        self.timings = []
+        self.timings_lock = threading.Lock()
+        self.timing_local = threading.local()  # .current: timing of the action running on this thread
+
+        self.dispatch_table = {
+            'ask_continue': self._action_ask_continue,
+            'find_folder': self._action_find_folder,
+            'check_executable': self._action_check_executable,
+            'mod_install': self._action_mod_install,
+            'message': self._action_message,
+            'abort': self._action_abort,
+            'set_variable': self._action_set_variable,
+            'append_variable': self._action_append_variable,
+            'label': lambda action: None,  # Do nothing
+            'delete_folder': self._action_delete_folder,
+        }
+
+        # Dry run handlers, returning the work an action would do, see plan()
+        self.plan_table = {
+            'ask_continue': lambda action: f"dialog: OK/Cancel \"{self._replace_variables(action.get('message', ''))}\"",
+            'find_folder': self._plan_find_folder,
+            'check_executable': lambda action: "check executable (not implemented, does nothing)",
+            'mod_install': self._plan_mod_install,
+            'message': lambda action: f"dialog: \"{self._replace_variables(action.get('message', ''))}\"",
+            'abort': lambda action: "abort the installer",
+            'set_variable': self._plan_set_variable,
+            'append_variable': self._plan_set_variable,
+            'label': lambda action: "label, does nothing",
+            'delete_folder': self._plan_delete_folder,
+        }
     
     def _log(self, message, verbose_only_message=False):
-        # Log with timestampe
-        if not verbose_only_message or "about" in self.config and "verbose" in self.config["about"] and self.config["about"]["verbose"]:
-            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] {message}")
-        
-        if self.log_file:
-            self.log_file.write(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] {message}\n")
-            self.log_file.flush()
+        self.log_installer(message, verbose_only_message)
     
-    def _replace_variables(self, string):
-        # Replace variables in a string with their values
-        #print("VARIABLES:", variables)
-        for key, value in self.variables.items():
-            if value is None or key is None or not isinstance(value, str) or not isinstance(key, str):
-                continue
-            string = string.replace(f"<{key}>", value)
-        return string
+    def _replace_variables(self, string, strict=False):
+        # Replace variables in a string with their values, see variable_template.py.
+        # With strict=True a placeholder without a value raises instead of
+        # being left in the string
+        result, unknown = substitute(string, self.variables, strict=strict)
+        if unknown:
+            self._log(f"WARNING: Unknown variables {', '.join(unknown)} in: {string}")
+        return result
     
+    def _ui(self, fn, *args, **kwargs):
+        # Run a dialog on the main thread. From an action worker thread this
+        # waits until the main thread has shown it, and first until the nodes
+        # of the action's dialog_depends finished, see action_graph.py.
+        if self.ui_requests is None or threading.current_thread() is threading.main_thread():
+            return fn(*args, **kwargs)
+        node = getattr(self.node_local, "node", None)
+        if node is not None:
+            for index in sorted(node.dialog_depends):
+                self.finished_nodes[index].wait()
+        if self.stopping:
+            raise Exception("The run is stopping, not showing the dialog.")
+        future = concurrent.futures.Future()
+        self.ui_requests.put(("ui", (fn, args, kwargs, future)))
+        return future.result()
+
     def _action_ask_continue(self, action):
         # Show a OK/Cancel messagebox to the user
         if "message" not in action:
@@ -52,7 +129,7 @@ class SimpleInstaller:
             raise Exception(f"Missing message in ask_continue action {action}")
         self._log(f"INFO: Showing ask/continue message: {action['message']}")
         
-        if not messagebox.askokcancel("Confirmation", self._replace_variables(action['message'])):
+        if not self._ui(messagebox.askokcancel, "Confirmation", self._replace_variables(action['message'])):
             self._log(f"INFO: User cancelled the dialog.")
             raise Exception(f"User cancelled the dialog.")
         else:
@@ -64,10 +141,12 @@ class SimpleInstaller:
         # Show a OK messagebox to the user
         self._log(f"INFO: Showing message: {message}")
         #messagebox.showinfo("Information", self._replace_variables(message))
-        root = tk.Tk()
-        root.withdraw()
-        messagebox.showinfo("Information", self._replace_variables(message))
-        root.destroy()
+        def show():
+            root = tk.Tk()
+            root.withdraw()
+            messagebox.showinfo("Information", self._replace_variables(message))
+            root.destroy()
+        self._ui(show)
 
     def _action_message(self, action):
         # Show a OK messagebox to the user
@@ -76,7 +155,7 @@ class SimpleInstaller:
             raise Exception(f"Missing message in message action {action}")
         self._message(self._replace_variables(action['message']))
 
-    def _action_find_folder(self, action):
+    def _action_find_folder(self, action, allow_dialogs=True):
         """
         Executes the 'find_folder' action defined in the configuration.
 
@@ -94,6 +173,8 @@ class SimpleInstaller:
 
         Raises:
             Exception: If the folder is not found and the 'abort' action is specified in 'error_actions'.
+
+        With allow_dialogs=False the 'ask' methods are skipped, for plan().
         """
         if "find_methods" not in action:
             self._log(f"ERROR: Missing find_methods in find_folder action {action}")
@@ -146,13 +227,16 @@ class SimpleInstaller:
                     result_folder = install_location
                     break
                 
-            elif 'ask' in method:
+            elif 'ask' in method and allow_dialogs:
                 # Create a Tkinter dialog to ask the user for the folder
-                while True:
+                def ask_directory(title):
                     root = tk.Tk()
                     root.withdraw()  # Hide the Tkinter root window
-                    chosen_folder = filedialog.askdirectory(title=method['ask'])
+                    chosen_folder = filedialog.askdirectory(title=title)
                     root.destroy()
+                    return chosen_folder
+                while True:
+                    chosen_folder = self._ui(ask_directory, method['ask'])
                     if chosen_folder:
                         self._log(f"INFO: User selected folder: {chosen_folder}")
                         # Verify the file exsists in the folder
@@ -201,7 +285,8 @@ class SimpleInstaller:
         if "folder" not in action:
             self._log(f"ERROR: Missing folder in delete_folder action {action}")
             raise Exception(f"Missing folder in delete_folder action {action}")
-        folder = self._replace_variables(action["folder"])
+        # Never delete a path that still has a <VARIABLE> in it
+        folder = self._replace_variables(action["folder"], strict=True)
 
         # Check if the folder exists
         if not os.path.exists(folder):
@@ -222,13 +307,35 @@ class SimpleInstaller:
             if confirm:
                 # Ask for confirmation
                 self._log(f"INFO: Asking for confirmation to delete folder: {folder}")
-                if not messagebox.askokcancel("Confirmation", f"Folder '{folder}' exists, but does not contain '{partial_pattern}'. Continue with deleting this whole folder?"):
+                if not self._ui(messagebox.askokcancel, "Confirmation", f"Folder '{folder}' exists, but does not contain '{partial_pattern}'. Continue with deleting this whole folder?"):
                     self._log(f"ERROR: User cancelled the folder delete.")
                     raise Exception(f"User cancelled the folder delete.")
                       
             # Delete the folder recursively
-            self._log(f"INFO: Deleting folder: {folder}")
+            file_count, size = self._folder_size(folder)
+            self._log(f"INFO: Deleting folder: {folder} ({file_count} files, {size} bytes)")
             shutil.rmtree(folder)
+            self._count_bytes(size)
+
+    @staticmethod
+    def _folder_size(folder):
+        # Number of files and bytes in a folder, recursively
+        file_count = 0
+        size = 0
+        for path, folders, files in os.walk(folder):
+            for filename in files:
+                try:
+                    size += os.path.getsize(os.path.join(path, filename))
+                    file_count += 1
+                except OSError:
+                    pass
+        return file_count, size
+
+    def _count_bytes(self, size):
+        # Add bytes read, written or deleted to the running action's timing
+        timing = getattr(self.timing_local, "current", None)
+        if timing is not None:
+            timing["bytes"] += size
 
     def _download_with_selenium(self, url):
         # Implement download logic with selenium here
@@ -241,15 +348,16 @@ class SimpleInstaller:
     def _set_variable(self, key, value):
         # Set a variable to a value
         self._log(f"INFO: Setting variable {key} to {value}")
-        self.variables[key] = value
+        with self.variables_lock:
+            self.variables[key] = value
     
     def _append_variable(self, key, value):
         # Append a value to a variable
         self._log(f"INFO: Appending variable {key} with {value}")
-        if key not in self.variables:
-            self._set_variable(key, [])
-        
-        self.variables[key].append(value)
+        with self.variables_lock:
+            if key not in self.variables:
+                self.variables[key] = []
+            self.variables[key].append(value)
 
     def _action_abort(self, action):
         # Abort the whole script
@@ -276,54 +384,189 @@ class SimpleInstaller:
             raise Exception(f"Missing value in append_variable action {action}")
         self._append_variable(action['name'], action['value'])
     
-    def _run_actions(self, actions):
+    def _run_actions(self, actions, path="actions"):
+        # Returns if every action of the group succeeded
         self._log(f"INFO: Starting group of {len(actions)} actions.")
         
         # Iterate over each action in the list
-        for action in actions:
-            if "action" not in action:
-                self._log(f"ERROR: Missing action key in action: {action}")
-                raise Exception(f"Missing action key in action: {action}")
+        succeeded = True
+        for index, action in enumerate(actions):
+            if not self._run_action(action, f"{path}.{index}"):
+                succeeded = False
+        
+        self._log(f"INFO: Completed group of {len(actions)} actions.")
+        return succeeded
 
-            action_type = action['action']
-            dispatch_table = {
-                'ask_continue': self._action_ask_continue,
-                'find_folder': self._action_find_folder,
-                'check_executable': self._action_check_executable,
-                'mod_install': self._action_mod_install,
-                'message': self._action_message,
-                'abort': self._action_abort,
-                'set_variable': self._action_set_variable,
-                'append_variable': self._action_append_variable,
-                'label': lambda action: None,  # Do nothing
-                'delete_folder': self._action_delete_folder,
-            }
-            if action_type not in dispatch_table:
-                self._log(f"ERROR: Unknown action_type: {action_type}")
-                raise Exception(f"Unknown action_type: {action_type}")
-            
-            # Dispatch the action to the corresponding function
-            self._log(f"Executing action of type {action_type}: {action}")
+    def _run_action(self, action, path):
+        # Run one action, then its success_actions or, if it failed, its error_actions.
+        # Returns if the action and its success_actions succeeded. path is the
+        # position of the action in the config, like "3.error_actions.0", for
+        # the timing report
+        if "action" not in action:
+            self._log(f"ERROR: Missing action key in action: {action}")
+            raise Exception(f"Missing action key in action: {action}")
+
+        action_type = action['action']
+        if action_type not in self.dispatch_table:
+            self._log(f"ERROR: Unknown action_type: {action_type}")
+            raise Exception(f"Unknown action_type: {action_type}")
+        
+        # Dispatch the action to the corresponding function
+        self._log(f"Executing action of type {action_type}: {action}")
+        # Times include the success_actions or error_actions the action runs
+        timing = {"path": path, "action": action_type, "bytes": 0}
+        parent_timing = getattr(self.timing_local, "current", None)
+        self.timing_local.current = timing
+        wall_start = time.perf_counter()
+        cpu_start = time.thread_time()
+        succeeded = False
+        try:
             try:
-                dispatch_table[action_type](action)
+                self.dispatch_table[action_type](action)
 
-                # Run the success_actions if specified
+                # Run the success_actions if specified. The action only counts
+                # as completed, also for the journal, once they all succeeded
                 if "success_actions" in action:
                     self._log(f"INFO: Running success_actions.")
-                    self._run_actions(action['success_actions'])
-            except:
+                    succeeded = self._run_actions(action['success_actions'], f"{path}.success_actions")
+                else:
+                    succeeded = True
+            except Exception:
+                # SystemExit from an abort is not caught, it stops the run
                 self._log(f"ERROR: Failed to execute action of type {action_type}: {action}")
                 # Run the error_actions if specified
                 if "error_actions" in action:
                     self._log(f"INFO: Running error_actions.")
-                    self._run_actions(action['error_actions'])
+                    self._run_actions(action['error_actions'], f"{path}.error_actions")
                 else:
                     self._log(f"WARNING: No error_actions specified for action.")
-            
-            # Print action completed for demonstration
-            self._log(f"Completed action: {action_type}")
+        finally:
+            timing["wall_seconds"] = round(time.perf_counter() - wall_start, 6)
+            timing["cpu_seconds"] = round(time.thread_time() - cpu_start, 6)
+            timing["outcome"] = "completed" if succeeded else "failed"
+            self.timing_local.current = parent_timing
+            if parent_timing is not None:
+                parent_timing["bytes"] += timing["bytes"]
+            with self.timings_lock:
+                self.timings.append(timing)
         
-        self._log(f"INFO: Completed group of {len(actions)} actions.")
+        # Print action completed for demonstration
+        self._log(f"Completed action: {action_type}")
+        return succeeded
+
+    def _run_node(self, node):
+        # Run a top level action, or skip it if the journal has it completed
+        # with the same inputs. Returns if it completed, skipped counts too.
+        path = str(node.index)
+        if self.journal is None:
+            return self._run_action(node.action, path)
+
+        with self.variables_lock:
+            fingerprint = RunJournal.fingerprint(node.action, node.reads, self.variables)
+        entry = self.journal.completed(fingerprint)
+        if entry is not None:
+            self._log(f"INFO: Skipping action {node.index} of type {node.action.get('action')}, it completed in an earlier run (--clear-journal runs it again).")
+            for key, value in entry["provides"].items():
+                self._set_variable(key, value)
+            with self.timings_lock:
+                self.timings.append({"path": path, "action": node.action.get("action"), "bytes": 0,
+                                     "wall_seconds": 0.0, "cpu_seconds": 0.0, "outcome": "skipped"})
+            return True
+
+        succeeded = self._run_action(node.action, path)
+        with self.variables_lock:
+            variables = dict(self.variables)
+        provides = {name: variables[name] for name in node.provides if name in variables}
+        self.journal.record(fingerprint, node.index, node.action.get("action"),
+                            "completed" if succeeded else "failed", provides, variables)
+        return succeeded
+
+    def _run_actions_parallel(self, graph):
+        # Run the actions as a dependency graph (see action_graph.py): each
+        # action starts on a worker thread once the actions it depends on are
+        # done. The main thread shows the dialogs the workers ask for. An
+        # error that escapes an action's error_actions, or an abort, stops
+        # starting new actions, cancels the queued ones and is raised once the
+        # running ones finish. Returns if every action completed.
+        self._log(f"INFO: Starting graph of {len(graph.nodes)} actions, critical path of {graph.critical_path_length()} actions.")
+
+        waiting = {node.index: len(node.depends) for node in graph.nodes}
+        events = queue.Queue()
+        futures = {}
+        running = 0
+        failed = 0
+        error = None
+        self.ui_requests = events
+        self.finished_nodes = {node.index: threading.Event() for node in graph.nodes}
+        self.stopping = False
+        # A worker can wait for its dialog turn, one more thread per action
+        # that may do so keeps the others running
+        max_workers = self.action_workers + sum(1 for node in graph.nodes if node.dialog_depends)
+
+        def run_node(node):
+            self.node_local.node = node
+            try:
+                return self._run_node(node)
+            finally:
+                self.node_local.node = None
+
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+                def start(index):
+                    future = executor.submit(run_node, graph.nodes[index])
+                    futures[index] = future
+
+                    def on_done(future):
+                        # Stopping before the dialogs waiting for this node go on
+                        if not future.cancelled() and future.exception() is not None:
+                            self.stopping = True
+                        self.finished_nodes[index].set()
+                        events.put(("done", (index, future)))
+                    future.add_done_callback(on_done)
+
+                for node in graph.nodes:
+                    if waiting[node.index] == 0:
+                        start(node.index)
+                        running += 1
+                while running > 0:
+                    kind, payload = events.get()
+                    if kind == "ui":
+                        fn, args, kwargs, future = payload
+                        try:
+                            future.set_result(fn(*args, **kwargs))
+                        except BaseException as e:
+                            future.set_exception(e)
+                        continue
+
+                    index, future = payload
+                    running -= 1
+                    if future.cancelled():
+                        continue
+                    if future.exception() is not None:
+                        if error is None:
+                            error = future.exception()
+                            # Cancel the queued actions and release the dialogs waiting for their turn
+                            for other in futures.values():
+                                other.cancel()
+                            for finished in self.finished_nodes.values():
+                                finished.set()
+                    elif not future.result():
+                        failed += 1
+                    if error is not None:
+                        continue
+                    for dependent in graph.nodes[index].dependents:
+                        waiting[dependent] -= 1
+                        if waiting[dependent] == 0:
+                            start(dependent)
+                            running += 1
+        finally:
+            self.ui_requests = None
+            self.finished_nodes = {}
+
+        if error is not None:
+            raise error
+        self._log(f"INFO: Completed graph of {len(graph.nodes)} actions, {failed} failed.")
+        return failed == 0
     
     def _prerun_actions(self, actions):
         # Run pre-run actions to register some pre-run variables
@@ -362,8 +605,130 @@ class SimpleInstaller:
     def run(self):
         # Run the main actions
         self._log(f"INFO: Starting main actions.")
-        self._run_actions(self.config["actions"])
+        # The graph also gives the variables each action reads for the journal
+        graph = ActionGraph(self.config["actions"])
+        self.timings = []
+        wall_start = time.perf_counter()
+        try:
+            if self.parallel_actions:
+                succeeded = self._run_actions_parallel(graph)
+            else:
+                succeeded = True
+                for node in graph.nodes:
+                    if not self._run_node(node):
+                        succeeded = False
+        finally:
+            # Also report the runs that failed or aborted
+            self._write_timing_report(time.perf_counter() - wall_start)
+        if self.journal is not None:
+            if succeeded:
+                # Completed, the next run starts over
+                self.journal.clear()
+            else:
+                self._log(f"WARNING: Some actions failed, keeping run journal {self.journal.path} so --resume retries only those.")
         self._log(f"INFO: Completed main actions.")
+
+    def _write_timing_report(self, wall_seconds):
+        # Write the timings of the last run() as JSON:
+        #   {"wall_seconds": 81.2, "cpu_seconds": 3.4, "bytes": 123456,
+        #    "actions": [{"path": "3", "action": "delete_folder", "outcome": "completed",
+        #                 "wall_seconds": 1.5, "cpu_seconds": 0.2, "bytes": 123456}, ...]}
+        # Nested actions have their own entries, and their times and bytes are
+        # included in the entries of the actions that ran them
+        if not self.timing_report_path:
+            return
+        with self.timings_lock:
+            timings = list(self.timings)
+        top_level = [timing for timing in timings if "." not in timing["path"]]
+        report = {
+            "wall_seconds": round(wall_seconds, 6),
+            "cpu_seconds": round(sum(timing["cpu_seconds"] for timing in top_level), 6),
+            "bytes": sum(timing["bytes"] for timing in top_level),
+            "actions": timings,
+        }
+        try:
+            with open(self.timing_report_path, "w", encoding="utf8") as file:
+                json.dump(report, file, indent=2)
+        except Exception as e:
+            self._log(f"WARNING: Failed to write timing report {self.timing_report_path}: {e}")
+            return
+        slowest = sorted(top_level, key=lambda timing: timing["wall_seconds"], reverse=True)[:3]
+        self._log(f"INFO: Wrote timing report {self.timing_report_path}, slowest actions: "
+                  + ", ".join(f"{timing['path']} {timing['action']} {timing['wall_seconds']:.2f}s" for timing in slowest))
+
+    def plan(self):
+        # Dry run: print the action tree with the work each action would do,
+        # without doing any of it. Dialogs are not shown, folders are not
+        # deleted and no journal or timing report is written. Variables are
+        # set in memory and find_folder tries its methods that need no dialog,
+        # so later actions show the values they would use
+        self.plan_totals = {"dialogs": 0, "folders": 0, "delete_bytes": 0, "download_bytes": 0, "unknown_downloads": 0}
+        lines = []
+        self._plan_actions(self.config["actions"], 0, lines)
+        totals = self.plan_totals
+        lines.append(f"Total: {totals['dialogs']} dialogs, {totals['folders']} folders to delete "
+                     f"({totals['delete_bytes']} bytes), {totals['download_bytes']} bytes to download"
+                     + (f" (+{totals['unknown_downloads']} of unknown size)" if totals["unknown_downloads"] else ""))
+        print("\n".join(lines))
+        return lines
+
+    def _plan_actions(self, actions, depth, lines):
+        for action in actions:
+            action_type = action.get("action")
+            if action_type not in self.plan_table:
+                work = "unknown action type, the run fails here"
+            else:
+                try:
+                    work = self.plan_table[action_type](action)
+                except Exception as e:
+                    work = f"invalid action, the run fails here: {e}"
+            if work.startswith("dialog:"):
+                self.plan_totals["dialogs"] += 1
+            lines.append("  " * depth + f"- {action_type}: {work}")
+
+            for key in ["success_actions", "error_actions"]:
+                if key in action:
+                    lines.append("  " * (depth + 1) + f"{key}:")
+                    self._plan_actions(action[key], depth + 2, lines)
+
+    def _plan_find_folder(self, action):
+        variable = action.get("save_path_to_variable")
+        try:
+            self._action_find_folder(action, allow_dialogs=False)
+            return f"found {self.variables[variable]}, saved to <{variable}>"
+        except Exception:
+            asks = [method["ask"] for method in action.get("find_methods", []) if "ask" in method]
+            if asks:
+                return f"dialog: ask for the folder \"{asks[0]}\", saved to <{variable}>"
+            return "folder not found, runs error_actions"
+
+    def _plan_set_variable(self, action):
+        # Setting variables has no side effects, do it so later actions resolve
+        self.dispatch_table[action["action"]](action)
+        return f"<{action['name']}> = {self.variables[action['name']]}"
+
+    def _plan_delete_folder(self, action):
+        folder, unknown = substitute(action["folder"], self.variables)
+        if unknown:
+            return f"not known before running, {folder} has unknown variables {', '.join(unknown)}"
+        if not os.path.exists(folder):
+            return f"nothing to delete, {folder} does not exist"
+        file_count, size = self._folder_size(folder)
+        self.plan_totals["folders"] += 1
+        self.plan_totals["delete_bytes"] += size
+        if action.get("confirm"):
+            self.plan_totals["dialogs"] += 1
+            return f"delete {folder} ({file_count} files, {size} bytes) after an OK/Cancel dialog"
+        return f"delete {folder} ({file_count} files, {size} bytes)"
+
+    def _plan_mod_install(self, action):
+        # mod_install does not download anything yet, use the size the action gives
+        name = action.get("name", "")
+        if "size" in action:
+            self.plan_totals["download_bytes"] += action["size"]
+            return f"install {name}, download {action['size']} bytes"
+        self.plan_totals["unknown_downloads"] += 1
+        return f"install {name}, download size unknown"
     
     def prerun(self):
         # Run the pre-run actions
@@ -381,16 +746,29 @@ def main():
         'MO2_APPDATA_PATH': None,
     }
 
+    parser = argparse.ArgumentParser(description="Run the installer actions of config.yaml")
+    parser.add_argument("--plan", action="store_true",
+                        help="only print the actions and the work they would do, without doing it")
+    parser.add_argument("--resume", action="store_true",
+                        help="journal finished actions and skip the ones an earlier failed run finished")
+    parser.add_argument("--clear-journal", action="store_true",
+                        help="delete the journal of an earlier run, so every action runs again")
+    args = parser.parse_args()
+
     # Load the configuration from YAML
     with open('config.yaml', 'r') as file:
         config = yaml.safe_load(file)
 
     # Initialize the installer
-    installer = SimpleInstaller(config, variables)
+    installer = SimpleInstaller(config, variables, resume=args.resume and not args.plan,
+                                clear_journal=args.clear_journal and not args.plan)
 
     # Execute the installation steps
     installer.prerun()
-    installer.run()
+    if args.plan:
+        installer.plan()
+    else:
+        installer.run()
 
 if __name__ == "__main__":
     # Initialize Tkinter root for messageboxes
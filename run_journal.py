@@ -0,0 +1,81 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+class RunJournal:
+    '''
+    Journal of an installer run, so a run that failed can be retried without
+    repeating what already finished.
+
+    After each top level action the journal file is rewritten with the
+    action's fingerprint, its outcome, the values of the variables it
+    provides and the current variables:
+      {"version": 1, "variables": {...},
+       "actions": {"<fingerprint>": {"index": 3, "action": "find_folder",
+                                     "outcome": "completed", "finished": 1714560000.0,
+                                     "provides": {"GAME_PATH": "C:/..."}}}}
+    The fingerprint hashes the action, with its success_actions and
+    error_actions, and the current values of the variables it reads, so an
+    action is only skipped while both are unchanged.
+
+    Only used when resuming is asked for (--resume). The journal is removed
+    when every action of a run completed, so the next run starts over.
+    '''
+    version = 1
+
+    def __init__(self, path, logger):
+        self.path = path
+        self.logger = logger
+        self.lock = threading.Lock()
+        self.actions = {}
+        self.variables = {}
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf8") as file:
+                    data = json.load(file)
+                if data.get("version") == self.version:
+                    self.actions = data.get("actions", {})
+                    self.variables = data.get("variables", {})
+                    completed = sum(1 for entry in self.actions.values() if entry["outcome"] == "completed")
+                    self.logger(f"INFO: Resuming from run journal {path} with {completed} completed actions, "
+                                f"delete it or use --clear-journal to run them again")
+            except Exception as e:
+                self.logger(f"WARNING: Ignoring unreadable run journal {path}: {e}")
+
+    @staticmethod
+    def fingerprint(action, reads, variables):
+        inputs = {name: variables.get(name) for name in sorted(reads)}
+        text = json.dumps([action, inputs], sort_keys=True, default=str)
+        return hashlib.sha1(text.encode("utf8")).hexdigest()
+
+    def completed(self, fingerprint):
+        # The journal entry of an action that completed with these inputs, or None
+        entry = self.actions.get(fingerprint)
+        if entry is not None and entry["outcome"] == "completed":
+            return entry
+        return None
+
+    def record(self, fingerprint, index, action_type, outcome, provides, variables):
+        with self.lock:
+            self.actions[fingerprint] = {"index": index, "action": action_type, "outcome": outcome,
+                                         "finished": time.time(), "provides": provides}
+            self.variables = dict(variables)
+            data = {"version": self.version, "variables": self.variables, "actions": self.actions}
+            try:
+                # Write to a temporary file first so a crash never leaves half a journal
+                temp_path = self.path + ".tmp"
+                with open(temp_path, "w", encoding="utf8") as file:
+                    json.dump(data, file, indent=2, default=str)
+                os.replace(temp_path, self.path)
+            except Exception as e:
+                self.logger(f"WARNING: Failed to write run journal {self.path}: {e}")
+
+    def clear(self):
+        with self.lock:
+            self.actions = {}
+            self.variables = {}
+            if os.path.exists(self.path):
+                os.remove(self.path)
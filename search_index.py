@@ -0,0 +1,99 @@
+import bisect
+import collections
+import re
+from urllib.parse import urlparse
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(str(text).lower())
+
+
+class SearchIndex:
+    '''
+    Inverted index over the catalog for the mod tree filter box.
+
+    Covers mod names, descriptions, tags and official_website hosts. Built
+    once; a query only looks up the index. Each query word matches the index
+    words it is a prefix of (binary search over the sorted words) and, from
+    three letters on, the words containing it anywhere (intersecting trigram
+    posting lists). A mod matches when every query word matches one of its
+    words. Results are mod names, those whose name starts with the query
+    first, then in catalog order.
+
+    In compact catalog mode descriptions are not loaded, so only names, tags
+    and the hosts in the ModRecord are indexed.
+    '''
+    def __init__(self, mods):
+        # mods is a dict of {name: Mod}
+        self.mod_names = list(mods.keys())
+        self.lower_names = [name.lower() for name in self.mod_names]
+        postings = collections.defaultdict(set)  # word -> mod indexes
+        for index, name in enumerate(self.mod_names):
+            for word in self._mod_words(mods[name]):
+                postings[word].add(index)
+
+        self.words = sorted(postings)
+        self.postings = [postings[word] for word in self.words]
+        self.trigrams = collections.defaultdict(set)  # trigram -> word indexes
+        for word_index, word in enumerate(self.words):
+            for i in range(len(word) - 2):
+                self.trigrams[word[i:i + 3]].add(word_index)
+
+    @staticmethod
+    def _mod_words(mod):
+        if mod.record is not None:
+            texts = [mod.record.name] + list(mod.record.tags) + list(mod.record.hosts)
+            if mod.record.only_one_with_tag:
+                texts.append(mod.record.only_one_with_tag)
+        else:
+            config = mod.config
+            tags = config.get("tag") or []
+            if not isinstance(tags, list):
+                tags = [tags]
+            texts = [config["name"], config.get("description") or ""] + tags
+            if config.get("only_one_with_tag"):
+                texts.append(config["only_one_with_tag"])
+            if isinstance(config.get("official_website"), str):
+                texts.append(urlparse(config["official_website"]).netloc)
+        words = set()
+        for text in texts:
+            words.update(tokenize(text))
+        return words
+
+    def _word_matches(self, term):
+        # Indexes of the mods with a word that starts with, or contains, term
+        mods = set()
+        start = bisect.bisect_left(self.words, term)
+        end = start
+        while end < len(self.words) and self.words[end].startswith(term):
+            mods |= self.postings[end]
+            end += 1
+
+        if len(term) >= 3:
+            trigram_sets = sorted((self.trigrams.get(term[i:i + 3], set()) for i in range(len(term) - 2)), key=len)
+            candidates = set(trigram_sets[0])
+            for trigram_set in trigram_sets[1:]:
+                candidates &= trigram_set
+                if not candidates:
+                    break
+            for word_index in candidates:
+                if not start <= word_index < end and term in self.words[word_index]:
+                    mods |= self.postings[word_index]
+        return mods
+
+    def search(self, query):
+        # Names of the mods matching every word of the query, or None for an empty query
+        terms = tokenize(query)
+        if not terms:
+            return None
+        matches = None
+        for term in sorted(set(terms), key=len, reverse=True):
+            term_matches = self._word_matches(term)
+            matches = term_matches if matches is None else matches & term_matches
+            if not matches:
+                return []
+        query = " ".join(terms)
+        ranked = sorted(matches, key=lambda index: (not self.lower_names[index].startswith(query), index))
+        return [self.mod_names[index] for index in ranked]
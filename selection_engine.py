@@ -0,0 +1,270 @@
+import collections
+
+
+class SelectionConflict(Exception):
+    pass
+
+
+class SelectionEngine:
+    '''
+    Selection rules of the mod tree, independent of Tk.
+
+    Rows come from ModGroupResolver.tree_rows(). The rules are:
+    - checking a row checks its ancestors. Checking a group or section checks
+      its children, except those tagged "unchecked", and an ancestor that gets
+      checked because of a child only checks its required_by_parent children.
+    - unchecking a row unchecks its descendants, and an ancestor left without
+      checked children is unchecked too.
+    - a required_by_parent row is checked exactly when its parent is.
+    - only_one_allowed siblings are a choice: at most one is checked, and one
+      is checked when their parent is (the checked one, else the last one).
+    - at most one selected mod per only_one_with_tag value.
+
+    A click assigns one row and unit propagation follows these rules from the
+    rows that changed only, so a click costs the size of what it changes.
+    A click that breaks a rule it cannot fix, like unchecking a required row,
+    changes nothing and leaves the reason in self.conflict. Every change
+    method returns the delta {iid: "checked" / "unchecked" / "tristate"} of
+    the rows whose displayed state changed, which is all the GUI applies.
+
+    Checked rows and selected mods are kept as integer bitsets; a mod is
+    selected when any row of it is checked. Usable without a GUI, e.g. for
+    batch profile generation:
+      engine = SelectionEngine(mods, logger)
+      engine.add_rows(resolver.tree_rows("Basic Skyrim Starting Point", {}))
+      engine.check(engine.find("Basic Skyrim Starting Point")[0])
+      engine.selected_mods()
+    '''
+    def __init__(self, mods, logger):
+        # mods is a dict of {name: Mod}
+        self.logger = logger
+        self.conflict = None
+
+        # Rows by index
+        self.iids = []
+        self.row_index = {}  # iid -> row index
+        self.parents = []  # row index of the parent, or None
+        self.children = []  # row indexes of the children
+        self.names = []
+        self.kinds = []
+        self.tags = []
+        self.row_mod = []  # mod index of the row, or None
+        self.display = []  # displayed state of the row
+        self.checked = 0  # bitset of checked rows
+
+        # Mods by index
+        self.mod_names = list(mods.keys())
+        self.mod_index = {name: index for index, name in enumerate(self.mod_names)}
+        self.mod_rows = [[] for _ in self.mod_names]
+        self.mod_checked_rows = [0] * len(self.mod_names)  # number of checked rows per mod
+        self.selected = 0  # bitset of selected mods
+
+        # only_one_with_tag value -> mod indexes declaring it
+        self.mod_exclusive_tag = [None] * len(self.mod_names)
+        self.tag_groups = collections.defaultdict(list)
+        for index, name in enumerate(self.mod_names):
+            mod = mods[name]
+            if mod.record is not None:
+                tag = mod.record.only_one_with_tag
+            else:
+                tag = mod.config.get("only_one_with_tag")
+            if tag:
+                self.mod_exclusive_tag[index] = str(tag)
+                self.tag_groups[str(tag)].append(index)
+
+    def add_rows(self, rows):
+        # Add rows from ModGroupResolver.tree_rows(), parents before children
+        for data in rows:
+            row = len(self.iids)
+            self.iids.append(data["iid"])
+            self.row_index[data["iid"]] = row
+            parent = data["parent"]
+            self.parents.append(self.row_index[parent] if parent is not None else None)
+            self.children.append([])
+            if parent is not None:
+                self.children[self.row_index[parent]].append(row)
+            self.names.append(data["name"])
+            self.kinds.append(data["kind"])
+            self.tags.append(frozenset(data["tags"]))
+            mod = self.mod_index.get(data["name"]) if data["kind"] == "mod" else None
+            self.row_mod.append(mod)
+            if mod is not None:
+                self.mod_rows[mod].append(row)
+            self.display.append("unchecked")
+
+    def find(self, name):
+        # iids of the rows showing a mod, group or section name
+        return [self.iids[row] for row, row_name in enumerate(self.names) if row_name == name]
+
+    def is_checked(self, iid):
+        return bool(self.checked >> self.row_index[iid] & 1)
+
+    def state(self, iid):
+        return self.display[self.row_index[iid]]
+
+    def checked_iids(self):
+        return [iid for row, iid in enumerate(self.iids) if self.checked >> row & 1]
+
+    def selected_mods(self):
+        # Names of the selected mods, in tree order
+        names = {}
+        for row in range(len(self.iids)):
+            if self.checked >> row & 1 and self.row_mod[row] is not None:
+                names[self.names[row]] = True
+        return list(names)
+
+    def required_mods(self):
+        # Names of the selected mods that are required_by_parent in a checked row
+        return [self.names[row] for row in range(len(self.iids))
+                if self.checked >> row & 1 and self.row_mod[row] is not None and "required_by_parent" in self.tags[row]]
+
+    def click(self, iid):
+        # Toggle a row like a checkbox click
+        return self.set_checked(iid, not self.is_checked(iid))
+
+    def check(self, iid):
+        return self.set_checked(iid, True)
+
+    def uncheck(self, iid):
+        return self.set_checked(iid, False)
+
+    def set_checked(self, iid, value):
+        self.conflict = None
+        try:
+            assigned = self._propagate(self.row_index[iid], value)
+        except SelectionConflict as e:
+            self.conflict = str(e)
+            self.logger(f"INFO: Selection not changed: {e}")
+            return {}
+        return self._apply(assigned)
+
+    def _row_value(self, row, assigned):
+        if row in assigned:
+            return assigned[row]
+        return bool(self.checked >> row & 1)
+
+    def _is_choice(self, row):
+        return "only_one_allowed" in self.tags[row]
+
+    def _is_forced(self, row, assigned):
+        # A required row whose parent is checked has to stay checked
+        parent = self.parents[row]
+        return "required_by_parent" in self.tags[row] and parent is not None and self._row_value(parent, assigned)
+
+    def _propagate(self, start, value):
+        # Unit propagation from one assignment. Returns {row: value} for every
+        # row that was assigned, raising SelectionConflict when a row would need
+        # both values.
+        assigned = {}
+        queue = collections.deque()
+
+        def assign(row, value, cause):
+            if row in assigned:
+                if assigned[row] != value:
+                    raise SelectionConflict(f"{self.names[row]} would have to be both checked and unchecked")
+                return
+            changed = self._row_value(row, assigned) != value
+            assigned[row] = value
+            if changed:
+                queue.append((row, value, cause))
+
+        if not value and self._is_forced(start, assigned):
+            raise SelectionConflict(f"{self.names[start]} is required by {self.names[self.parents[start]]}")
+        assign(start, value, "click")
+
+        while queue:
+            row, value, cause = queue.popleft()
+            parent = self.parents[row]
+            if value:
+                if parent is not None:
+                    assign(parent, True, "child")
+                if self._is_choice(row) and parent is not None:
+                    for sibling in self.children[parent]:
+                        if sibling != row and self._is_choice(sibling):
+                            assign(sibling, False, "choice")
+                self._check_children(row, cause, assigned, assign)
+                mod = self.row_mod[row]
+                if mod is not None and self.mod_exclusive_tag[mod] is not None:
+                    for other in self.tag_groups[self.mod_exclusive_tag[mod]]:
+                        if other == mod:
+                            continue
+                        for other_row in self.mod_rows[other]:
+                            if self._row_value(other_row, assigned):
+                                if self._is_forced(other_row, assigned):
+                                    raise SelectionConflict(f"{self.names[row]} and {self.names[other_row]} both have "
+                                                            f"only_one_with_tag {self.mod_exclusive_tag[mod]}")
+                                assign(other_row, False, "tag")
+            else:
+                if cause != "parent" and self._is_forced(row, assigned):
+                    raise SelectionConflict(f"{self.names[row]} is required by {self.names[parent]}")
+                for child in self.children[row]:
+                    assign(child, False, "parent")
+                if parent is not None and self._row_value(parent, assigned):
+                    siblings = self.children[parent]
+                    if self._is_choice(row) and cause != "choice" and \
+                            not any(self._is_choice(sibling) and self._row_value(sibling, assigned) for sibling in siblings):
+                        raise SelectionConflict(f"One of the choices under {self.names[parent]} has to stay checked")
+                    if not any(self._row_value(sibling, assigned) for sibling in siblings) and \
+                            not self._is_forced(parent, assigned):
+                        assign(parent, False, "child")
+        return assigned
+
+    def _check_children(self, row, cause, assigned, assign):
+        # Children implied by a row becoming checked
+        choices = []
+        for child in self.children[row]:
+            if self._is_choice(child):
+                choices.append(child)
+            elif "required_by_parent" in self.tags[child]:
+                assign(child, True, "parent")
+            elif cause != "child" and "unchecked" not in self.tags[child]:
+                assign(child, True, "parent")
+        if choices and not any(self._row_value(choice, assigned) for choice in choices):
+            # Keep the current choice, else the last one is the preferred one
+            for choice in reversed(choices):
+                if assigned.get(choice) is not False:
+                    assign(choice, True, "parent")
+                    break
+
+    def _apply(self, assigned):
+        # Commit the assignment and return the changed displayed states
+        touched = set()
+        for row, value in assigned.items():
+            if bool(self.checked >> row & 1) == value:
+                continue
+            self.checked ^= 1 << row
+            touched.add(row)
+            mod = self.row_mod[row]
+            if mod is not None:
+                self.mod_checked_rows[mod] += 1 if value else -1
+                if self.mod_checked_rows[mod] > 0:
+                    self.selected |= 1 << mod
+                else:
+                    self.selected &= ~(1 << mod)
+
+        # Displayed states depend on the children, so update the touched rows
+        # and their ancestors, deepest first
+        rows = set()
+        for row in touched:
+            while row is not None and row not in rows:
+                rows.add(row)
+                row = self.parents[row]
+        delta = {}
+        for row in sorted(rows, key=self._depth, reverse=True):
+            if not self.checked >> row & 1:
+                display = "unchecked"
+            elif all(self.display[child] == "checked" for child in self.children[row]):
+                display = "checked"
+            else:
+                display = "tristate"
+            if display != self.display[row]:
+                self.display[row] = display
+                delta[self.iids[row]] = display
+        return delta
+
+    def _depth(self, row):
+        depth = 0
+        while self.parents[row] is not None:
+            row = self.parents[row]
+            depth += 1
+        return depth
@@ -0,0 +1,135 @@
+import atexit
+import json
+import queue
+import sys
+import threading
+import time
+
+LEVELS = ["ERROR", "WARNING", "INFO", "DEBUG"]
+
+
+class StructuredLog:
+    '''
+    Log backend shared by App, SimpleInstaller and Mod.
+
+    Logging a message only puts a tuple on a SimpleQueue, so download threads
+    never wait on each other or on the disk. One writer thread takes up to
+    batch_size messages at a time, formats them and writes each batch with a
+    single write and flush, so lines from different threads never interleave.
+
+    The file gets one JSON record per line:
+      {"t": 12.345678, "time": "2024-05-01 12:00:00", "level": "INFO",
+       "subsystem": "mod", "mod": "RaceMenu", "thread": "Thread-3", "message": "..."}
+    t is time.monotonic() seconds since the log was opened and time the wall
+    clock time it corresponds to. level comes from the "ERROR:", "WARNING:" or
+    "INFO:" prefix of the message, INFO without one. With console=True the
+    messages are also printed like before, "[2024-05-01 12:00:00] message",
+    except verbose_only_message ones unless console_verbose is set.
+
+    channel(subsystem) returns the logger callable to hand out, with the
+    usual (message, verbose_only_message=False) signature.
+    '''
+    batch_size = 512
+
+    def __init__(self, path=None, console=True, console_verbose=False):
+        self.file = open(path, "w", encoding="utf8") if path else None
+        self.console = console
+        self.console_verbose = console_verbose
+        self.start_monotonic = time.monotonic()
+        self.start_wall = time.time()
+        self.records = queue.SimpleQueue()
+        self.closed = False
+        self.writer = threading.Thread(target=self._write_loop, name="log-writer", daemon=True)
+        self.writer.start()
+        atexit.register(self.close)
+
+    def channel(self, subsystem):
+        return LogChannel(self, subsystem)
+
+    def emit(self, subsystem, mod, message, verbose_only_message=False):
+        if not isinstance(message, str):
+            message = str(message)
+        self.records.put((time.monotonic(), threading.current_thread().name, subsystem, mod,
+                          message, verbose_only_message))
+
+    @staticmethod
+    def _level(message):
+        prefix = message.split(":", 1)[0]
+        return prefix if prefix in LEVELS else "INFO"
+
+    def _write_loop(self):
+        wall_second = None
+        wall_text = None
+        while True:
+            batch = [self.records.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.records.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = False
+            file_lines = []
+            console_lines = []
+            for record in batch:
+                if record is None:
+                    stop = True
+                    continue
+                monotonic, thread, subsystem, mod, message, verbose = record
+                t = monotonic - self.start_monotonic
+                # strftime once per second instead of per message
+                second = int(self.start_wall + t)
+                if second != wall_second:
+                    wall_second = second
+                    wall_text = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(second))
+                if self.file:
+                    file_lines.append(json.dumps({"t": round(t, 6), "time": wall_text, "level": self._level(message),
+                                                  "subsystem": subsystem, "mod": mod, "thread": thread,
+                                                  "message": message}, ensure_ascii=False))
+                if self.console and (not verbose or self.console_verbose):
+                    console_lines.append(f"[{wall_text}] {message}")
+
+            try:
+                if file_lines:
+                    self.file.write("\n".join(file_lines) + "\n")
+                    self.file.flush()
+                if console_lines:
+                    sys.stdout.write("\n".join(console_lines) + "\n")
+                    sys.stdout.flush()
+            except Exception:
+                # Nowhere left to report it, keep logging what can be logged
+                pass
+            if stop:
+                return
+
+    def close(self):
+        # Write what is queued and stop the writer thread
+        if self.closed:
+            return
+        self.closed = True
+        self.records.put(None)
+        self.writer.join()
+        if self.file:
+            self.file.close()
+
+
+class LogChannel:
+    '''
+    Logger callable for one subsystem, and with for_mod() for one mod.
+    '''
+    __slots__ = ["log", "subsystem", "mod", "mod_channels"]
+
+    def __init__(self, log, subsystem, mod=None):
+        self.log = log
+        self.subsystem = subsystem
+        self.mod = mod
+        self.mod_channels = {}
+
+    def __call__(self, message, verbose_only_message=False):
+        self.log.emit(self.subsystem, self.mod, message, verbose_only_message)
+
+    def for_mod(self, name):
+        channel = self.mod_channels.get(name)
+        if channel is None:
+            channel = self.mod_channels.setdefault(name, LogChannel(self.log, self.subsystem, name))
+        return channel
@@ -0,0 +1,153 @@
+import collections
+
+
+class TreeModel:
+    '''
+    Rows of the mod tree, kept outside the Treeview so only what is visible
+    is given to Tk.
+
+    Rows from ModGroupResolver.tree_rows() are registered with add_rows(), but
+    a row's children are only inserted into the tree when the row is opened
+    (materialize(), bound to <<TreeviewOpen>>). Until then a closed row with
+    children holds one placeholder child so it still shows the expand arrow.
+    Catalogs of up to expand_all_max_rows rows are opened completely at start
+    like before, larger ones start with only the top level groups.
+
+    show_filter() replaces the tree with just the rows of some mods and their
+    ancestors, for the search box, and clear_filter() goes back to the
+    normal tree.
+
+    Compact catalog mods have no description in their rows until the row is
+    first inserted; then describe(names) is called with the names to look up
+    and set_descriptions() fills them in.
+
+    Checkbox states come from state_of(iid), so selection changes on rows that
+    are not in the tree yet are picked up when they are inserted. The model
+    also remembers the single selected row so selecting another one only
+    retags those two rows.
+    '''
+    # Open the whole tree at start when there are at most this many rows
+    expand_all_max_rows = 500
+    placeholder_prefix = "placeholder-"
+    # Most mod rows shown for a filter, so short queries stay fast on big catalogs
+    filter_max_rows = 200
+
+    def __init__(self, tree, state_of, describe=None):
+        self.tree = tree
+        self.state_of = state_of
+        self.describe = describe
+        self.describing = set()  # mod names whose description was asked for
+        self.rows = {}  # iid -> row
+        self.order = {}  # iid -> position in the full tree
+        self.name_rows = collections.defaultdict(list)  # mod name -> iids of its rows
+        self.children = collections.defaultdict(list)  # parent iid (None for top level) -> child iids
+        self.materialized = set()  # iids inserted into the tree
+        self.expanded = set()  # iids whose children are inserted
+        self.selected_iid = None
+
+    def add_rows(self, rows):
+        for data in rows:
+            self.rows[data["iid"]] = data
+            self.order[data["iid"]] = len(self.order)
+            self.children[data["parent"]].append(data["iid"])
+            if data["kind"] == "mod":
+                self.name_rows[data["name"]].append(data["iid"])
+
+    def is_materialized(self, iid):
+        return iid in self.materialized
+
+    def _insert_rows(self, parent, iids, placeholders=True):
+        # Insert a batch of sibling rows, with a placeholder under each one that has children
+        tree = self.tree
+        undescribed = []
+        for iid in iids:
+            data = self.rows[iid]
+            tree.insert(parent if parent is not None else "", 'end', iid=iid, text='',
+                        values=data["values"], tags=list(data["tags"]) + [self.state_of(iid)])
+            self.materialized.add(iid)
+            if placeholders and self.children.get(iid):
+                tree.insert(iid, 'end', iid=self.placeholder_prefix + str(iid), text='', values=("Loading...", ""))
+            if data.get("describe") and data["name"] not in self.describing:
+                self.describing.add(data["name"])
+                undescribed.append(data["name"])
+        if undescribed and self.describe is not None:
+            self.describe(undescribed)
+
+    def set_descriptions(self, descriptions):
+        # Fill in the descriptions {mod name: text} asked for with describe()
+        for name, description in descriptions.items():
+            for iid in self.name_rows.get(name, []):
+                data = self.rows[iid]
+                data["values"] = (data["values"][0], description)
+                data["describe"] = False
+                if iid in self.materialized and self.tree.exists(iid):
+                    self.tree.item(iid, values=data["values"])
+
+    def clear(self):
+        # Remove every row from the tree
+        self.tree.delete(*self.tree.get_children(""))
+        self.materialized = set()
+        self.expanded = set()
+        self.selected_iid = None
+
+    def populate(self):
+        # Insert the top level rows, then open rows until the tree is complete
+        # or, for big catalogs, just the top level
+        self._insert_rows(None, self.children[None])
+        if len(self.rows) <= self.expand_all_max_rows:
+            pending = list(self.children[None])
+            while pending:
+                iid = pending.pop()
+                self.materialize(iid)
+                self.tree.item(iid, open=True)
+                pending += self.children.get(iid, [])
+
+    def show_filter(self, names):
+        # Show only the rows of these mods, under their opened ancestors
+        self.clear()
+        shown = set()
+        matched = 0
+        for name in names:
+            for iid in self.name_rows.get(name, []):
+                if matched >= self.filter_max_rows:
+                    break
+                matched += 1
+                while iid is not None and iid not in shown:
+                    shown.add(iid)
+                    iid = self.rows[iid]["parent"]
+        for iid in sorted(shown, key=self.order.get):
+            self._insert_rows(self.rows[iid]["parent"], [iid], placeholders=False)
+            if self.children.get(iid):
+                # Opening it must not insert the rows the filter hides
+                self.expanded.add(iid)
+                self.tree.item(iid, open=True)
+        return matched
+
+    def clear_filter(self):
+        self.clear()
+        self.populate()
+
+    def materialize(self, iid):
+        # Insert the children of a row, once
+        if iid in self.expanded or not self.children.get(iid):
+            return
+        self.expanded.add(iid)
+        placeholder = self.placeholder_prefix + str(iid)
+        if self.tree.exists(placeholder):
+            self.tree.delete(placeholder)
+        self._insert_rows(iid, self.children[iid])
+
+    def on_open(self, event=None):
+        # <<TreeviewOpen>> handler, the opened row has the focus
+        iid = self.tree.focus()
+        if iid and not iid.startswith(self.placeholder_prefix):
+            self.materialize(int(iid))
+
+    def select(self, iid):
+        # Move the "selected" style to a row
+        if self.selected_iid is not None and self.tree.exists(self.selected_iid):
+            self.tree.tag_del(self.selected_iid, "selected")
+        self.selected_iid = iid
+        if iid is not None:
+            self.tree.selection_set(iid)
+            self.tree.tag_add(iid, "selected")
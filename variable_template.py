@@ -0,0 +1,80 @@
+import functools
+import re
+
+# <NAME>, <NAME.key> or <NAME.0.key> placeholders in action strings
+PLACEHOLDER_PATTERN = re.compile(r"<([A-Za-z0-9_]+(?:\.[A-Za-z0-9_]+)*)>")
+
+
+class UnknownVariable(Exception):
+    pass
+
+
+@functools.lru_cache(maxsize=4096)
+def compile_template(string):
+    # Split a string once into literal text and placeholder paths, as a tuple of
+    # str (literal) and tuple (path, placeholder text) segments
+    segments = []
+    position = 0
+    for match in PLACEHOLDER_PATTERN.finditer(string):
+        if match.start() > position:
+            segments.append(string[position:match.start()])
+        segments.append((tuple(match.group(1).split(".")), match.group(0)))
+        position = match.end()
+    if position < len(string):
+        segments.append(string[position:])
+    return tuple(segments)
+
+
+def template_variables(string):
+    # Names of the variables a string uses
+    return set(segment[0][0] for segment in compile_template(string) if isinstance(segment, tuple))
+
+
+def _lookup(variables, path):
+    # Follow a placeholder path into the variables, None when it leads nowhere
+    value = variables.get(path[0])
+    for part in path[1:]:
+        if isinstance(value, dict):
+            value = value.get(part)
+        elif isinstance(value, list) and part.isdigit() and int(part) < len(value):
+            value = value[int(part)]
+        else:
+            return None
+    return value
+
+
+def _format(value):
+    # Lists, like the ones append_variable builds, are joined with ", " and
+    # dicts, like registered_choice entries, show their name
+    if isinstance(value, list):
+        return ", ".join(_format(item) for item in value)
+    if isinstance(value, dict):
+        return str(value.get("name", ""))
+    return str(value)
+
+
+def substitute(string, variables, strict=False):
+    '''
+    Replace the placeholders of a string with the values of the variables, in
+    one pass over the compiled string.
+
+    Returns (result, unknown) with the placeholders that have no value, which
+    are left in the result as they were. With strict=True an unknown
+    placeholder raises UnknownVariable instead.
+    '''
+    result = []
+    unknown = []
+    for segment in compile_template(string):
+        if isinstance(segment, str):
+            result.append(segment)
+            continue
+        path, text = segment
+        value = _lookup(variables, path)
+        if value is None:
+            if strict:
+                raise UnknownVariable(f"Unknown variable {text} in: {string}")
+            unknown.append(text)
+            result.append(text)
+        else:
+            result.append(_format(value))
+    return "".join(result), unknown
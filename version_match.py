@@ -0,0 +1,200 @@
+"""
+Compiled game_version patterns and a catalog-wide compatibility index.
+
+game_version can be formated like:
+  1.6.629.0                exactly this version
+  1.6.629.0+               this version or newer
+  1.6.629.0-1.6.650.0      between both versions, inclusive
+  1.6.*.*                  * matches any number in that position
+"""
+
+import bisect
+import functools
+
+# Versions are compared as 4 numbers, missing trailing numbers count as 0
+VERSION_LENGTH = 4
+# Upper bound used for "+" patterns and trailing wildcards
+VERSION_MAX = 2 ** 63
+
+
+@functools.lru_cache(maxsize=None)
+def parse_version(version):
+    # "1.6.629.0" -> (1, 6, 629, 0)
+    try:
+        numbers = [int(part) for part in version.strip().split(".")]
+    except ValueError:
+        raise Exception(f"Invalid game version: {version}")
+    if len(numbers) > VERSION_LENGTH:
+        raise Exception(f"Invalid game version, too many numbers: {version}")
+    return tuple(numbers + [0] * (VERSION_LENGTH - len(numbers)))
+
+
+class VersionPattern:
+    '''
+    A game_version pattern compiled once into a normalized form.
+
+    Most patterns become an inclusive interval (low, high) of version tuples.
+    Wildcards that only appear at the end, like "1.6.*.*", are intervals too.
+    Wildcards in the middle, like "1.*.629.0", keep a per number mask with
+    None for the wildcard positions.
+    '''
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.low = None
+        self.high = None
+        self.mask = None
+
+        text = pattern.strip()
+        if text.endswith("+"):
+            self.low = parse_version(text[:-1])
+            self.high = (VERSION_MAX,) * VERSION_LENGTH
+        elif "-" in text:
+            parts = text.split("-")
+            if len(parts) != 2:
+                raise Exception(f"Invalid game_version range: {pattern}")
+            self.low, self.high = parse_version(parts[0]), parse_version(parts[1])
+            if self.low > self.high:
+                raise Exception(f"Invalid game_version range, start is after end: {pattern}")
+        elif "*" in text:
+            parts = text.split(".")
+            if len(parts) > VERSION_LENGTH:
+                raise Exception(f"Invalid game_version, too many numbers: {pattern}")
+            parts += ["*"] * (VERSION_LENGTH - len(parts))
+            try:
+                mask = tuple(None if part == "*" else int(part) for part in parts)
+            except ValueError:
+                raise Exception(f"Invalid game_version wildcard: {pattern}")
+            fixed = [number for number in mask if number is not None]
+            if all(number is None for number in mask[len(fixed):]) and None not in mask[:len(fixed)]:
+                # Trailing wildcards only: 1.6.*.* is 1.6.0.0 up to 1.6.max.max
+                self.low = tuple(fixed + [0] * (VERSION_LENGTH - len(fixed)))
+                self.high = tuple(fixed + [VERSION_MAX] * (VERSION_LENGTH - len(fixed)))
+            else:
+                self.mask = mask
+        else:
+            self.low = self.high = parse_version(text)
+
+    def is_interval(self):
+        return self.mask is None
+
+    def matches(self, version):
+        # version is a version string or tuple
+        if isinstance(version, str):
+            version = parse_version(version)
+        if self.mask is not None:
+            return all(expected is None or expected == number for expected, number in zip(self.mask, version))
+        return self.low <= version <= self.high
+
+    def __repr__(self):
+        return f"VersionPattern({self.pattern!r})"
+
+
+@functools.lru_cache(maxsize=None)
+def compile_version_pattern(pattern):
+    return VersionPattern(pattern)
+
+
+class CompatibilityIndex:
+    '''
+    Answers "which mods and which install entries apply to game version X"
+    for a whole catalog.
+
+    Every install entry's game_version is compiled once. Entries for every
+    version ("*.*.*.*") are kept in one list shared by all versions. The
+    other interval patterns are swept into sorted version boundaries; each
+    boundary stores only the entries that start or stop covering versions
+    there, and every checkpoint_interval boundaries the full set of entries
+    covering it is stored. A lookup finds its boundary with a binary search
+    and replays the changes since the checkpoint before it. The few
+    patterns with wildcards in the middle are checked directly. For each mod
+    the first matching install entry wins, like Mod.start_download_async.
+    '''
+    # Boundaries between two stored sets of covering entries
+    checkpoint_interval = 32
+
+    def __init__(self, mods):
+        # mods is a dict of {name: Mod} or a list of Mod
+        if isinstance(mods, dict):
+            mods = list(mods.values())
+        self.mods = mods
+        self.universal = []  # (mod index, install index) covering every version
+        self.boundaries = []  # sorted (version tuple, 0 = starts at, 1 = starts after)
+        self.deltas = []  # for each boundary, (added pairs, removed pairs)
+        self.checkpoints = []  # pairs covering every checkpoint_interval-th boundary
+        self.masked = []  # (pattern, mod index, install index)
+        self.cache = {}  # version -> (lookup result, {mod name: install entry})
+
+        lowest = (0,) * VERSION_LENGTH
+        highest = (VERSION_MAX,) * VERSION_LENGTH
+        events = []
+        for mod_index, mod in enumerate(mods):
+            for install_index, install in enumerate(mod.installs):
+                pattern = compile_version_pattern(install["game_version"])
+                if not pattern.is_interval():
+                    self.masked.append((pattern, mod_index, install_index))
+                elif pattern.low == lowest and pattern.high == highest:
+                    self.universal.append((mod_index, install_index))
+                else:
+                    events.append(((pattern.low, 0), 1, (mod_index, install_index)))
+                    events.append(((pattern.high, 1), -1, (mod_index, install_index)))
+
+        # Sweep the interval boundaries in order, recording what changes at
+        # each distinct boundary
+        events.sort(key=lambda event: event[0])
+        active = set()
+        i = 0
+        while i < len(events):
+            boundary = events[i][0]
+            added = []
+            removed = []
+            while i < len(events) and events[i][0] == boundary:
+                if events[i][1] > 0:
+                    active.add(events[i][2])
+                    added.append(events[i][2])
+                else:
+                    active.discard(events[i][2])
+                    removed.append(events[i][2])
+                i += 1
+            if len(self.boundaries) % self.checkpoint_interval == 0:
+                self.checkpoints.append(tuple(active))
+            self.boundaries.append(boundary)
+            self.deltas.append((tuple(added), tuple(removed)))
+
+    def _entries_for(self, version):
+        entries = list(self.universal)
+        position = bisect.bisect_right(self.boundaries, (version, 0)) - 1
+        if position >= 0:
+            checkpoint = position // self.checkpoint_interval
+            active = set(self.checkpoints[checkpoint])
+            for added, removed in self.deltas[checkpoint * self.checkpoint_interval + 1:position + 1]:
+                active.update(added)
+                active.difference_update(removed)
+            entries += active
+        for pattern, mod_index, install_index in self.masked:
+            if pattern.matches(version):
+                entries.append((mod_index, install_index))
+        return entries
+
+    def _lookup(self, version):
+        version = parse_version(version) if isinstance(version, str) else version
+        if version not in self.cache:
+            first_install = {}
+            for mod_index, install_index in self._entries_for(version):
+                if mod_index not in first_install or install_index < first_install[mod_index]:
+                    first_install[mod_index] = install_index
+            result = [(self.mods[mod_index], self.mods[mod_index].installs[first_install[mod_index]])
+                      for mod_index in sorted(first_install)]
+            self.cache[version] = (result, {mod.name: install for mod, install in result})
+        return self.cache[version]
+
+    def lookup(self, version):
+        # Returns [(Mod, install entry)] for every mod compatible with version,
+        # in catalog order, using each mod's first matching install entry
+        return self._lookup(version)[0]
+
+    def compatible_mods(self, version):
+        return [mod for mod, _ in self.lookup(version)]
+
+    def install_for(self, mod_name, version):
+        # The install entry a mod would use for this version, or None
+        return self._lookup(version)[1].get(mod_name)